@@ -0,0 +1,211 @@
+import djak.phys.SPH.incompressible as inc
+import djak.phys.SPH.timestep as timestep
+import djak.phys.SPH.snapshot as snapshot
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.eos as eos
+import djak.phys.SPH.precision as precision
+import djak.phys.SPH.jit as jit
+import numpy as np
+import glob
+import os
+
+#===============================================================================
+""" parameters """
+#-------------------------------------------------------------------------------
+
+# module parameters that change the evolution, saved with every checkpoint
+params      =   { inc:      ('c0','rho0','alpha','beta','gamma','G'),
+                  eos:      ('gamma_ad','c_iso'),
+                  timestep: ('C_cfl','C_acc','max_rung') }
+
+kernels     =   { K.name: K for K in (kernel.M4,kernel.M4star,kernel.WendlandC2,kernel.WendlandC4) }
+
+# barotropic equations of state a Simulation can run with, besides eos.Table
+equations   =   { f.__name__: f for f in (eos.barotropic,eos.isothermal) }
+
+pattern     =   'checkpoint_%09d.ckpt'
+
+#===============================================================================
+""" saving """
+#-------------------------------------------------------------------------------
+
+def _fsync_dir(directory):
+    """ makes a rename in directory durable where the OS allows it """
+    try:
+        fd  =   os.open(directory,os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _eos_attr(EOS):
+    """ the equation of state as an attribute, its name or the arrays of an eos.Table """
+    if isinstance(EOS,eos.Table):
+        return { k: None if A is None else A.tolist() for k,A in vars(EOS).items() }
+    return EOS.__name__
+
+def equation(attr):
+    """ the equation of state saved by state, barotropic for checkpoints
+    written without one
+
+    args
+    ----
+    attr:   name from equations, dictionary of eos.Table arrays or None
+    """
+    if attr is None: return eos.barotropic
+    if isinstance(attr,str): return equations[attr]
+    table       =   eos.Table.__new__(eos.Table)
+    table.log_c =   None
+    for k,v in attr.items(): setattr(table,k,None if v is None else np.array(v,dtype=float))
+    return table
+
+def _table_attr(table):
+    """ [n, method] of a kernel.Table, None if there is none """
+    return None if table is None else [ table.n, table.method ]
+
+def settings(sim):
+    """ global switches that change the results of a run - precision policy,
+    backend and kernel tables - as an attribute
+
+    args
+    ----
+    sim:    driver.Simulation
+    """
+    return { 'precision': precision.name, 'jit': jit.backend,
+             'tables': _table_attr(kernel._tables.get('W_M4')),
+             'kernel_table': _table_attr(None if sim.K.table is None else sim.K.table[0]) }
+
+def apply(attr,K):
+    """ switches the precision policy, backend and kernel tables to the
+    settings saved by settings
+
+    args
+    ----
+    attr:   dictionary from settings
+    K:      kernel object of the run
+    """
+    precision.set_policy(attr['precision'])
+    kernel.set_tables(*(attr['tables'] or [None]))
+    K.set_table(*(attr['kernel_table'] or [None]))
+    assert jit.set_backend(attr['jit']) == attr['jit'], "checkpoint needs the %s backend, which is not available" % attr['jit']
+
+def state(sim):
+    """ the full state of a driver.Simulation as snapshot fields and attributes
+
+    args
+    ----
+    sim:    driver.Simulation
+
+    returns
+    -------
+    dictionary of name: array, dictionary of attributes
+    """
+    p       =   sim.p
+    fields  =   snapshot.particle_fields(p)
+    fields['rung']  =   sim.rungA
+
+    legacy  =   np.random.get_state()
+    fields['np_random_key'] =   legacy[1]
+
+    attrs   =   { 't': sim.t, 'steps': sim.steps, 'n_force': sim.n_force, 'dt_max': sim.dt_max,
+                  'capacity': p.capacity, 'dtype': p.dtype.str, 'next_id': p.next_id,
+                  'kernel': sim.K.name, 'eos': _eos_attr(sim.EOS),
+                  'theta': sim.theta, 'quadrupole': sim.quadrupole, 'settings': settings(sim),
+                  'rng': sim.rng.bit_generator.state,
+                  'np_random': [ legacy[0], int(legacy[2]), int(legacy[3]), float(legacy[4]) ],
+                  'params': { m.__name__: { k: getattr(m,k) for k in names } for m,names in params.items() } }
+    return fields,attrs
+
+def save(sim,directory,keep=3):
+    """ writes a checkpoint atomically - the file is written under a
+    temporary name, synced and renamed, so a crash leaves either the old or
+    the new checkpoint but never a partial one - and then removes all but
+    the newest keep checkpoints
+
+    args
+    ----
+    sim:        driver.Simulation
+    directory:  checkpoint directory
+    keep:       ** number of checkpoints kept - default = 3
+
+    returns
+    -------
+    file name of the checkpoint
+    """
+    os.makedirs(directory,exist_ok=True)
+    fname   =   os.path.join(directory,pattern % sim.steps)
+    tmp     =   fname + '.tmp'
+
+    fields,attrs    =   state(sim)
+    snapshot.write(tmp,fields,attrs=attrs)
+    with open(tmp,'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp,fname)
+    _fsync_dir(directory)
+
+    for old in checkpoints(directory)[:-keep]:
+        os.remove(old)
+    return fname
+
+#===============================================================================
+""" loading """
+#-------------------------------------------------------------------------------
+
+def checkpoints(directory):
+    """ checkpoint files in directory, oldest first
+
+    args
+    ----
+    directory:  checkpoint directory
+    """
+    return sorted(glob.glob(os.path.join(directory,'checkpoint_*.ckpt')))
+
+def load(fname):
+    """ reads a checkpoint and restores the module parameters, the settings
+    (precision policy, backend, kernel tables) and the global numpy random
+    state saved with it
+
+    args
+    ----
+    fname:  checkpoint file name
+
+    returns
+    -------
+    dictionary of name: array, dictionary of attributes
+    """
+    snap    =   snapshot.Snapshot(fname,mmap=False)
+    fields  =   { name: snap.read(name) for name in snap.keys() }
+    attrs   =   snap.attrs
+
+    for m,names in params.items():
+        for k in names: setattr(m,k,attrs['params'][m.__name__][k])
+    if 'settings' in attrs: apply(attrs['settings'],kernels[attrs['kernel']])
+
+    name,pos,has_gauss,gauss = attrs['np_random'][0],*attrs['np_random'][1:]
+    np.random.set_state( (name,fields.pop('np_random_key'),pos,has_gauss,gauss) )
+    return fields,attrs
+
+def latest(directory):
+    """ newest checkpoint in directory that can be read, skipping any that
+    are damaged
+
+    args
+    ----
+    directory:  checkpoint directory
+
+    returns
+    -------
+    file name, or None if there is no readable checkpoint
+    """
+    for fname in reversed(checkpoints(directory)):
+        try:
+            snap    =   snapshot.Snapshot(fname)
+            size    =   max( [ i['offset'] + i['nbytes'] for i in snap.fields.values() ] + [0] )
+            if snap.start + size <= os.path.getsize(fname): return fname
+        except Exception:
+            continue
+    return None
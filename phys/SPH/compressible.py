@@ -0,0 +1,206 @@
+import djak.phys.SPH.incompressible as inc
+import djak.phys.SPH.smoothing as smoothing
+import djak.phys.SPH.timestep as timestep
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.tree as tree
+import djak.phys.SPH.precision as precision
+import djak.phys.SPH.eos as eos
+import numpy as np
+
+#===============================================================================
+""" compressible SPH
+
+particles carry a specific internal energy u, pressures and sound speeds
+come from eos.adiabatic, and u changes by pdV work and viscous heating.
+every pass works on whole pair arrays (J,I) from tree.pairs, with the same
+M4 kernels, kernel normalisation h_ij^-3, h_ij^-4 and viscosity parameters
+inc.alpha, inc.beta as incompressible.py """
+#-------------------------------------------------------------------------------
+
+def density(rA,mA,hA,pairs,W=kernel.W_M4):
+    """ densities of all particles from a pair list
+
+    args
+    ----
+    rA:     array of particle positions
+    mA:     array of particle masses
+    hA:     array of particle smoothing lengths
+    pairs:  (J,I) pair arrays from tree.pairs, or the tree.PairTable of this step
+    W:      ** smoothing function or kernel object, unused with a table - default = kernel.W_M4
+    """
+    if isinstance(pairs,tree.PairTable): return pairs.density(mA)
+    J,I     =   pairs
+    r_ij1   =   np.linalg.norm( rA[J] - rA[I], axis=1 )
+    h_ij    =   .5 * (hA[I] + hA[J])
+    return np.bincount(J,weights=mA[I] * h_ij**(-3) * W(r_ij1,h_ij),minlength=len(mA))
+
+def hydro(rA,vA,mA,rhoA,PA,cA,hA,pairs,dW=kernel.dW_M4,out=None):
+    """ fluid and viscous accelerations and the rate of change of specific
+    internal energy of all particles - every unique pair is evaluated once
+    and scattered onto both particles, so momentum and total energy are
+    conserved to round-off
+
+        a_j     = - sum_i m_i ( P_j/rho_j^2 + P_i/rho_i^2 + Pi_ij ) grad_j W_ij
+        du_j/dt =   sum_i m_i ( P_j/rho_j^2 + Pi_ij/2 ) v_ij . grad_j W_ij
+
+    the first term of du_j/dt is the pdV work and the second the viscous
+    heating, with Pi_ij the artificial viscosity of inc.acc_visc
+
+    args
+    ----
+    rA:     array of particle positions
+    vA:     array of particle velocities
+    mA:     array of particle masses
+    rhoA:   array of particle densities
+    PA:     array of particle pressures
+    cA:     array of particle sound speeds
+    hA:     array of particle smoothing lengths
+    pairs:  (J,I) pair arrays from tree.pairs, or the tree.PairTable of this step
+    dW:     ** smoothing function, unused with a table - default = kernel.dW_M4
+    out:    ** (aA, duA) arrays the results are written to - default = new arrays
+
+    returns
+    -------
+    aA, duA
+    """
+    assert rA.shape[0] == vA.shape[0] == mA.shape[0] == rhoA.shape[0] == PA.shape[0] == hA.shape[0], "arrays are mismatched"
+    N       =   len(mA)
+    if out is None: out = np.zeros((N,3),dtype=precision.accum),np.zeros(N,dtype=precision.accum)
+    aA,duA  =   out
+
+    table   =   pairs if isinstance(pairs,tree.PairTable) else tree.PairTable(rA,hA,pairs,W=None,dW=dW)
+    rows    =   table.half()
+    J,I     =   table.J[rows],table.I[rows]
+    r_ij    =   table.r_ij[rows]
+    r_ij1   =   table.r_ij1[rows]
+    dWh     =   table.dW[rows]
+    vr      =   ((vA[J] - vA[I]) * r_ij).sum(axis=1)
+
+    fluid,visc  =   inc._pair_hydro(r_ij1,vr,table.h_ij[rows],rhoA[I],rhoA[J],PA[I],PA[J],cA[I],cA[J],None,dWh=dWh)
+    Pr2         =   PA / rhoA**2
+
+    # a_j = - m_i f e_ij and a_i = + m_j f e_ij
+    f       =   (fluid + visc) / r_ij1
+    for k in range(3):
+        aA[:,k] =   np.bincount(I,weights=mA[J]*f*r_ij[:,k],minlength=N) - np.bincount(J,weights=mA[I]*f*r_ij[:,k],minlength=N)
+
+    # v_ij . grad_j W_ij = v_ji . grad_i W_ji = dWh vr / r
+    w       =   vr / r_ij1
+    duA[:]  =   np.bincount(J,weights=mA[I] * (Pr2[J]*dWh + .5*visc) * w,minlength=N) \
+            +   np.bincount(I,weights=mA[J] * (Pr2[I]*dWh + .5*visc) * w,minlength=N)
+
+    return aA,duA
+
+#===============================================================================
+""" derivatives and integration """
+#-------------------------------------------------------------------------------
+
+def derivs(rA,vA,mA,uA,hA,K=kernel.M4,Wstar=kernel.W_M4star,theta=.5,gamma=None,adapt_h=True,quadrupole=False,verlet=None):
+    """ accelerations and internal energy rates of all particles, with
+    smoothing lengths (updated in place), densities, pressures and sound
+    speeds recomputed from the current positions and energies
+
+    args
+    ----
+    rA:         array of particle positions
+    vA:         array of particle velocities
+    mA:         array of particle masses
+    uA:         array of specific internal energies
+    hA:         array of particle smoothing lengths
+    K:          ** kernel object - default = kernel.M4
+    Wstar:      ** gravity smoothing function - default = kernel.W_M4star
+    theta:      ** tree opening angle for gravity, None for direct summation or False for no gravity - default = 0.5
+    gamma:      ** adiabatic index - default = eos.gamma_ad
+    adapt_h:    ** solve for smoothing lengths with smoothing.solve_h - default = True
+    quadrupole: ** include quadrupole moments in the gravity tree - default = False
+    verlet:     ** tree.Verlet lists reused across steps, also by solve_h - default = None (new search every call)
+
+    returns
+    -------
+    aA, duA, rhoA, PA, cA, and the tree.PairTable of the step
+    """
+    if verlet is not None: verlet.update(rA,hA)
+    if adapt_h: hA[:] = smoothing.solve_h(rA,mA,hA,W=K,support=K.support,verlet=verlet)[0]
+
+    if verlet is None:  pairs = tree.pairs(rA,hA,support=K.support,method='tree')
+    else:               pairs = verlet.pairs(rA,hA)
+    table   =   tree.PairTable(rA,hA,pairs,W=K)
+
+    rhoA    =   table.density(mA)
+    PA,cA   =   eos.stage(rhoA,eos=eos.adiabatic,uA=uA,gamma=gamma)
+    aA,duA  =   hydro(rA,vA,mA,rhoA,PA,cA,hA,table)
+
+    if theta is not False:
+        aA  +=  inc.acc_grav_all(rA,mA,hA,W=Wstar,theta=theta,quadrupole=quadrupole)
+
+    return aA,duA,rhoA,PA,cA,table
+
+def step(rA,vA,uA,mA,hA,aA,duA,dt,**kwargs):
+    """ advances positions, velocities and internal energies by one
+    kick-drift-kick leapfrog step of dt, all in place - aA and duA hold the
+    derivatives of the current state on entry and of the new state on exit
+
+    args
+    ----
+    rA:     array of particle positions
+    vA:     array of particle velocities
+    uA:     array of specific internal energies
+    mA:     array of particle masses
+    hA:     array of particle smoothing lengths
+    aA:     array of accelerations
+    duA:    array of internal energy rates
+    dt:     time step
+    kwargs: ** K, Wstar, theta, gamma, ... passed on to derivs
+
+    returns
+    -------
+    rhoA, PA, cA and the tree.PairTable of the new state
+    """
+    vA      +=  .5 * dt * aA
+    uA      +=  .5 * dt * duA
+    rA      +=  dt * vA
+
+    a,du,rhoA,PA,cA,table   =   derivs(rA,vA,mA,uA,hA,**kwargs)
+    aA[:]   =   a
+    duA[:]  =   du
+
+    vA      +=  .5 * dt * aA
+    uA      +=  .5 * dt * duA
+    return rhoA,PA,cA,table
+
+def dt_step(rA,vA,hA,rhoA,PA,cA,aA,K=kernel.M4,table=None):
+    """ largest stable time step of all particles, the smallest of the
+    Courant, viscosity and acceleration limits of timestep.dt_particle
+
+    args
+    ----
+    rA:     array of particle positions
+    vA:     array of particle velocities
+    hA:     array of particle smoothing lengths
+    rhoA:   array of particle densities
+    PA:     array of particle pressures
+    cA:     array of particle sound speeds
+    aA:     array of accelerations
+    K:      ** kernel object, sets the neighbour cutoff - default = kernel.M4
+    table:  ** tree.PairTable of this step - default = new search
+    """
+    if table is None: table = tree.PairTable(rA,hA,W=None,dW=K.dW,support=K.support)
+    return timestep.dt_particle(rA,vA,hA,rhoA,PA,aA,table.J,table.I,cA=cA,table=table).min()
+
+def energy(vA,mA,uA):
+    """ kinetic and internal energy of all particles, for checking energy
+    conservation of hydro runs - summed in float64 under every precision
+    policy
+
+    args
+    ----
+    vA:     array of particle velocities
+    mA:     array of particle masses
+    uA:     array of specific internal energies
+
+    returns
+    -------
+    E_kin, E_int
+    """
+    m   =   np.asarray(mA,dtype=np.float64)
+    return .5 * (m * (np.asarray(vA,dtype=np.float64)**2).sum(axis=1)).sum(),(m * uA).sum()
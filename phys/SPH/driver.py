@@ -0,0 +1,181 @@
+import djak.phys.SPH.checkpoint as checkpoint
+import djak.phys.SPH.particles as particles
+import djak.phys.SPH.timestep as timestep
+import djak.phys.SPH.snapshot as snapshot
+import djak.phys.SPH.profiling as profiling
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.eos as eos
+import djak.phys.SPH.tree as tree
+import numpy as np
+import os
+
+#===============================================================================
+""" simulation driver """
+#-------------------------------------------------------------------------------
+
+class Simulation:
+    """ incompressible SPH run of a Particles container with hierarchical
+    block time steps
+
+    args
+    ----
+    p:          particles.Particles with r, v, m and h set
+    dt_max:     longest time step
+    K:          ** smoothing kernel - default = kernel.M4
+    EOS:        ** barotropic equation of state or eos.Table - default = eos.barotropic
+    snap_dir:   ** directory for snapshots - default = None (no snapshots)
+    snap_every: ** steps between snapshots - default = 1
+    writer:     ** snapshot.Writer for background writing - default = None (write in the step)
+    seed:       ** seed of the random generator rng - default = None
+    ckpt_dir:   ** directory for checkpoints - default = None (no checkpoints)
+    ckpt_every: ** steps between checkpoints - default = 100
+    ckpt_keep:  ** number of checkpoints kept - default = 3
+    sort_every: ** steps between reorderings along a space-filling curve - default = None (never)
+    curve:      ** 'hilbert' or 'morton' curve used for reordering - default = 'hilbert'
+    start:      ** compute initial accelerations and rungs - default = True
+    theta:      ** opening angle of the tree gravity - default = None (direct summation)
+    quadrupole: ** include quadrupole moments in the tree - default = False
+    profiler:   ** profiling.Profiler active while run runs, closing one row
+                of it per step - default = None (no profiling)
+    """
+    def __init__(self,p,dt_max,K=kernel.M4,EOS=eos.barotropic,snap_dir=None,snap_every=1,writer=None,seed=None,
+                 ckpt_dir=None,ckpt_every=100,ckpt_keep=3,sort_every=None,curve='hilbert',start=True,theta=None,quadrupole=False,profiler=None):
+        self.p          =   p
+        self.dt_max     =   dt_max
+        self.K          =   K
+        self.EOS        =   EOS
+        self.theta      =   theta
+        self.quadrupole =   quadrupole
+        self.snap_dir   =   snap_dir
+        self.snap_every =   snap_every
+        self.writer     =   writer
+        self.ckpt_dir   =   ckpt_dir
+        self.ckpt_every =   ckpt_every
+        self.ckpt_keep  =   ckpt_keep
+        self.sort_every =   sort_every
+        self.curve      =   curve
+        self.rng        =   np.random.default_rng(seed)
+        self.profiler   =   profiler
+        self.t          =   0.
+        self.steps      =   0
+        self.n_force    =   0
+
+        self.accel      =   timestep.sph_accel(p.rA,p.vA,p.mA,p.hA,p.rhoA,p.PA,K=K,cA=p.cA,EOS=EOS,theta=theta,quadrupole=quadrupole)
+        self.rungA      =   np.zeros(p.N,dtype=np.int64)
+        if start:
+            if sort_every is not None: p.sort(curve)
+            all_            =   np.arange(p.N)
+            p.aA[:]         =   self.accel(all_)
+            self.rungA[:]   =   timestep.rungs(self.dt_fn(all_),dt_max,timestep.max_rung)
+
+    @classmethod
+    def restore(cls,fname,**kwargs):
+        """ simulation continued from a checkpoint written by checkpoint.save,
+        reproducing the uninterrupted run bit for bit - kernel, equation of
+        state, gravity options and global settings are those of the checkpoint
+
+        args
+        ----
+        fname:  checkpoint file name, or a directory to use its latest checkpoint
+        kwargs: ** snap_dir, writer, ckpt_dir, ... as for Simulation
+        """
+        if os.path.isdir(fname): fname = checkpoint.latest(fname)
+        fields,attrs    =   checkpoint.load(fname)
+        rungA           =   fields.pop('rung')
+
+        p               =   particles.Particles(attrs['capacity'],dtype=np.dtype(attrs['dtype']))
+        p.N             =   len(rungA)
+        p.next_id       =   attrs['next_id']
+        for name,A in fields.items(): p.data[name][:p.N] = A
+
+        sim                         =   cls(p,attrs['dt_max'],K=checkpoint.kernels[attrs['kernel']],EOS=checkpoint.equation(attrs.get('eos')),
+                                            theta=attrs.get('theta'),quadrupole=attrs.get('quadrupole',False),start=False,**kwargs)
+        sim.rungA[:]                =   rungA
+        sim.t                       =   attrs['t']
+        sim.steps                   =   attrs['steps']
+        sim.n_force                 =   attrs['n_force']
+        sim.rng.bit_generator.state =   attrs['rng']
+        return sim
+
+    def dt_fn(self,idx):
+        """ allowed time steps of particles idx, from the pair table of the
+        accel call that just updated them, or from a new search
+
+        args
+        ----
+        idx:    indices of particles
+        """
+        p       =   self.p
+        table   =   getattr(self.accel,'table',None)
+        with profiling.phase('timestep'):
+            if table is not None and np.array_equal(self.accel.idx,idx):
+                J,I     =   table.J,table.I
+            else:
+                J,I     =   tree.pairs(p.rA,p.hA,idx=idx,support=self.K.support)
+                table   =   None
+            return timestep.dt_particle(p.rA,p.vA,p.hA,p.rhoA,p.PA,p.aA,J,I,cA=p.cA,table=table)[idx]
+
+    def sort(self):
+        """ reorders the particles and their rungs along the space-filling
+        curve, the fields keep their memory so accel stays valid
+        """
+        perm            =   self.p.sort(self.curve)
+        self.rungA[:]   =   self.rungA[perm]
+
+    def step(self):
+        """ advances the particles by dt_max """
+        p               =   self.p
+        with profiling.phase('step'):
+            if self.sort_every is not None and self.steps > 0 and self.steps % self.sort_every == 0:
+                with profiling.phase('sort'):
+                    self.sort()
+            n               =   timestep.block_step(p.rA,p.vA,p.aA,self.rungA,self.dt_max,self.accel,self.dt_fn,timestep.max_rung)
+        profiling.count('force evaluations',n)
+        self.n_force    +=  n
+        self.t          +=  self.dt_max
+        self.steps      +=  1
+
+    def snapshot(self,fname=None):
+        """ writes the particle state, in the background if a writer is set
+
+        args
+        ----
+        fname:  ** file name - default = snap_<steps>.snap in snap_dir
+        """
+        if fname is None: fname = os.path.join(self.snap_dir,'snap_%06d.snap' % self.steps)
+        fields  =   snapshot.particle_fields(self.p)
+        attrs   =   { 't': self.t, 'step': self.steps, 'dt_max': self.dt_max }
+        if self.writer is None: snapshot.write(fname,fields,attrs=attrs)
+        else:                   self.writer.submit(fname,fields,attrs=attrs)
+
+    def checkpoint(self):
+        """ writes a checkpoint to ckpt_dir, see checkpoint.save
+
+        returns
+        -------
+        file name of the checkpoint
+        """
+        return checkpoint.save(self,self.ckpt_dir,keep=self.ckpt_keep)
+
+    def run(self,steps):
+        """ runs a number of steps, writing snapshots every snap_every steps
+        and checkpoints every ckpt_every steps, and waits for the background
+        writer before returning - the profiler, if any, records only inside run
+
+        args
+        ----
+        steps:  number of steps
+        """
+        if self.profiler is not None: profiling.start(self.profiler)
+        try:
+            for k in range(steps):
+                self.step()
+                with profiling.phase('io'):
+                    if self.snap_dir is not None and self.steps % self.snap_every == 0:
+                        self.snapshot()
+                    if self.ckpt_dir is not None and self.steps % self.ckpt_every == 0:
+                        self.checkpoint()
+                if self.profiler is not None: self.profiler.end_step(self.steps)
+        finally:
+            if self.profiler is not None: profiling.stop()
+            if self.writer is not None: self.writer.flush()
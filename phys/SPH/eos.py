@@ -0,0 +1,126 @@
+import djak.phys.SPH.incompressible as inc
+import numpy as np
+
+#===============================================================================
+""" parameters """
+#-------------------------------------------------------------------------------
+
+gamma_ad    =   5/3     # adiabatic index
+c_iso       =   1       # isothermal sound speed
+
+#===============================================================================
+""" equations of state
+
+each returns arrays of pressure and sound speed for all particles """
+#-------------------------------------------------------------------------------
+
+def barotropic(rhoA,c0=None,rho0=None):
+    """ barotropic pressure of inc.P_bol, isothermal at low density and
+    stiffening as rho^(7/3) above rho0, with the sound speed sqrt(P/rho) of
+    inc.c_gas
+
+    args
+    ----
+    rhoA:   array of particle densities
+    c0:     ** low density sound speed - default = inc.c0
+    rho0:   ** critical density - default = inc.rho0
+    """
+    if c0 is None: c0 = inc.c0
+    if rho0 is None: rho0 = inc.rho0
+    PA  =   rhoA * c0**2 * np.sqrt( 1 + (rhoA/rho0)**(4/3) )
+    return PA,np.sqrt( PA / rhoA )
+
+def isothermal(rhoA,c=None):
+    """ isothermal pressure P = c^2 rho
+
+    args
+    ----
+    rhoA:   array of particle densities
+    c:      ** sound speed - default = c_iso
+    """
+    if c is None: c = c_iso
+    return c**2 * rhoA,np.full_like(rhoA,c)
+
+def adiabatic(rhoA,uA,gamma=None):
+    """ ideal gas pressure P = (gamma - 1) rho u and sound speed
+    sqrt(gamma P / rho)
+
+    args
+    ----
+    rhoA:   array of particle densities
+    uA:     array of specific internal energies
+    gamma:  ** adiabatic index - default = gamma_ad
+    """
+    if gamma is None: gamma = gamma_ad
+    PA  =   (gamma - 1) * rhoA * uA
+    return PA,np.sqrt( gamma * PA / rhoA )
+
+class Table:
+    """ tabulated barotropic equation of state P(rho), interpolated linearly
+    in log rho - log P, with the sound speed interpolated the same way from
+    tabulated c, or sqrt(dP/drho) from the slope if c is not given
+
+    args
+    ----
+    rho:    increasing array of tabulated densities
+    P:      array of tabulated pressures
+    c:      ** array of tabulated sound speeds - default = None (from the slope)
+    """
+    def __init__(self,rho,P,c=None):
+        self.log_rho    =   np.log(np.asarray(rho,dtype=float))
+        self.log_P      =   np.log(np.asarray(P,dtype=float))
+        self.slope      =   np.gradient(self.log_P,self.log_rho)
+        self.log_c      =   None if c is None else np.log(np.asarray(c,dtype=float))
+
+    @classmethod
+    def from_function(cls,eos,rho_min,rho_max,n=512):
+        """ table sampled from an equation of state function, e.g. barotropic,
+        keeping its sound speed convention
+
+        args
+        ----
+        eos:        function of rhoA returning (PA,cA)
+        rho_min:    smallest tabulated density
+        rho_max:    largest tabulated density
+        n:          ** number of table entries - default = 512
+        """
+        rho     =   np.geomspace(rho_min,rho_max,n)
+        return cls(rho,*eos(rho))
+
+    def __call__(self,rhoA):
+        x   =   np.log(rhoA)
+        PA  =   np.exp( np.interp(x,self.log_rho,self.log_P) )
+        if self.log_c is not None: return PA,np.exp( np.interp(x,self.log_rho,self.log_c) )
+        n   =   np.interp(x,self.log_rho,self.slope)
+        return PA,np.sqrt( n * PA / rhoA )
+
+#===============================================================================
+""" EOS stage """
+#-------------------------------------------------------------------------------
+
+def stage(rhoA,eos=barotropic,uA=None,out=None,**params):
+    """ pressure and sound speed of all particles, computed once per step so
+    the force passes can read them instead of calling P_bol and c_gas per pair
+
+    args
+    ----
+    rhoA:   array of particle densities
+    eos:    ** barotropic, isothermal, adiabatic or a Table - default = barotropic
+    uA:     ** array of specific internal energies, needed by adiabatic - default = None
+    out:    ** (PA,cA) arrays the results are written to - default = new arrays
+    params: ** parameters passed on to eos
+
+    returns
+    -------
+    PA, cA
+    """
+    if eos is adiabatic:
+        assert uA is not None, "adiabatic equation of state needs uA"
+        PA,cA   =   eos(rhoA,uA,**params)
+    else:
+        PA,cA   =   eos(rhoA,**params)
+
+    if out is None: return PA,cA
+    out[0][...]     =   PA
+    out[1][...]     =   cA
+    return out
@@ -0,0 +1,407 @@
+import djak.phys.SPH.incompressible as inc
+import djak.phys.SPH.precision as precision
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.tree as tree
+import numpy as np
+import time
+
+#===============================================================================
+""" tiled direct summation """
+#-------------------------------------------------------------------------------
+
+class Direct:
+    """ exact direct-summation gravity with W_M4star softening, the same sum
+    as inc.acc_grav_all, done over tiles of targets and sources with scratch
+    buffers allocated once - memory is set by the tile size and does not
+    grow with N
+
+    each pair of tiles is visited once and its forces are applied to both
+    (Newton's third law), and the tile sums are matrix products,
+
+        a_j = - G ( r_j sum_i F_ji - sum_i F_ji r_i ),  F_ji = m_i W*(q) / r_ji^3
+
+    taken relative to the centre of the target tile to keep the round-off
+    of the subtraction small
+
+    args
+    ----
+    tile:   ** particles per tile - default = 512
+    W:      ** softening function, None for the built-in in-place M4star - default = None
+    """
+    def __init__(self,tile=512,W=None):
+        self.tile       =   tile
+        self.W          =   W
+        self.pairs      =   0
+        self.seconds    =   0.
+        self.dtype      =   None
+
+    def _buffers(self,dtype):
+        # scratch tiles, reallocated only when the dtype changes
+        if self.dtype is not None and self.dtype == dtype: return
+        shape           =   (self.tile,self.tile)
+        self.R,self.H,self.Q,self.Q3,self.T1,self.T2 = [ np.empty(shape,dtype=dtype) for k in range(6) ]
+        self.M          =   np.empty(shape,dtype=bool)
+        self.dtype      =   dtype
+
+    def _kernel(self,nb,na,diag):
+        """ T1[:nb,:na] = W*(q) / r^3 from the squared distances in R """
+        R,H,Q,Q3,T1,T2,M = [ B[:nb,:na] for B in (self.R,self.H,self.Q,self.Q3,self.T1,self.T2,self.M) ]
+        if diag: np.fill_diagonal(R,1)
+        np.sqrt(R,out=R)
+
+        if self.W is not None:
+            T1[...]     =   self.W(R,H)
+        else:
+            np.divide(R,H,out=Q)
+            np.multiply(Q,Q,out=Q3)
+            Q3          *=  Q
+
+            # inner: q^3 (40 - 36 q^2 + 15 q^3), middle: q^3 (80 - 90 q + 36 q^2 - 5 q^3) - 2
+            np.multiply(Q,15,out=T1)
+            T1          -=  36
+            T1          *=  Q
+            T1          *=  Q
+            T1          +=  40
+            T1          *=  Q3
+            np.multiply(Q,-5,out=T2)
+            T2          +=  36
+            T2          *=  Q
+            T2          -=  90
+            T2          *=  Q
+            T2          +=  80
+            T2          *=  Q3
+            T2          -=  2
+            np.greater_equal(Q,1,out=M)
+            np.copyto(T1,T2,where=M)
+            np.greater_equal(Q,2,out=M)
+            np.copyto(T1,30,where=M)
+            T1          *=  1/30
+
+        np.multiply(R,R,out=Q3)
+        Q3          *=  R
+        T1          /=  Q3
+        if diag: np.fill_diagonal(T1,0)
+        return T1
+
+    def acc(self,rA,mA,hA,G=None,out=None):
+        """ gravitational accelerations of all particles
+
+        args
+        ----
+        rA:     array of particle positions
+        mA:     array of particle masses
+        hA:     array of particle smoothing lengths
+        G:      ** gravitational constant - default = inc.G
+        out:    ** array the accelerations are written to - default = new array
+
+        returns
+        -------
+        array of accelerations
+        """
+        assert rA.shape[0] == mA.shape[0] == hA.shape[0], "arrays are mismatched"
+        if G is None: G = inc.G
+        N       =   len(mA)
+        T       =   self.tile
+        dtype   =   np.result_type(rA.dtype,precision.pair)
+        self._buffers(dtype)
+        if out is None: out = np.zeros((N,3),dtype=precision.accum)
+        out[...] =  0
+
+        t0      =   time.time()
+        for b0 in range(0,N,T):
+            b1      =   min(b0+T,N)
+            nb      =   b1 - b0
+            c       =   rA[b0:b1].mean(axis=0)
+            rb      =   (rA[b0:b1] - c).astype(dtype)
+            for a0 in range(b0,N,T):
+                a1      =   min(a0+T,N)
+                na      =   a1 - a0
+                ra      =   (rA[a0:a1] - c).astype(dtype)
+
+                R,H,F   =   self.R[:nb,:na],self.H[:nb,:na],self.T2[:nb,:na]
+                R[...]  =   0
+                for d in range(3):
+                    np.subtract(rb[:,d,None],ra[None,:,d],out=F)
+                    F       *=  F
+                    R       +=  F
+                np.add(hA[b0:b1,None],hA[None,a0:a1],out=H)
+                H       *=  .5
+                f       =   self._kernel(nb,na,a0 == b0)
+
+                # targets in b from sources in a
+                np.multiply(f,mA[None,a0:a1],out=F)
+                out[b0:b1]  -=  G * ( rb * F.sum(axis=1,dtype=precision.accum)[:,None] - F @ ra )
+
+                # Newton's third law: targets in a from sources in b
+                if a0 != b0:
+                    np.multiply(f,mA[b0:b1,None],out=F)
+                    out[a0:a1]  -=  G * ( ra * F.sum(axis=0,dtype=precision.accum)[:,None] - F.T @ rb )
+
+        self.seconds    =   time.time() - t0
+        self.pairs      =   N*(N-1)//2
+        return out
+
+    def rate(self):
+        """ unique pairs evaluated per second in the last call of acc """
+        return self.pairs / max(self.seconds,1e-300)
+
+def acc_direct(rA,mA,hA,tile=512,G=None):
+    """ exact gravitational accelerations of all particles with a Direct
+    engine, for validating approximate solvers
+
+    args
+    ----
+    rA:     array of particle positions
+    mA:     array of particle masses
+    hA:     array of particle smoothing lengths
+    tile:   ** particles per tile - default = 512
+    G:      ** gravitational constant - default = inc.G
+    """
+    return Direct(tile).acc(rA,mA,hA,G=G)
+
+#===============================================================================
+""" periodic gravity: particle-mesh and TreePM
+
+the force of a periodic box is split at a scale r_s into a long-range part,
+solved on a mesh by FFT with the Green's function -4 pi G exp(-k^2 r_s^2) / k^2,
+and a short-range part summed over pairs closer than cut * r_s (minimum
+image) with the complementary factor
+
+    S(u) = erfc(u/2) + u/sqrt(pi) exp(-u^2/4),  u = r / r_s
+
+and W_M4star softening, so a step costs O(N + M^3 log M) plus the
+short-range pairs. the mean density is removed from the mesh (the k = 0
+mode), as usual for periodic self-gravity """
+#-------------------------------------------------------------------------------
+
+def _split_table(cut,n=4096):
+    """ S(u) on a uniform grid of u in [0, cut], interpolated in PM.acc_short """
+    from math import erfc
+    u   =   np.linspace(0,cut,n)
+    S   =   np.array([ erfc(x/2) for x in u ]) + u/np.sqrt(np.pi) * np.exp(-u**2/4)
+    return u,S
+
+def _stencil(s,M,assign):
+    """ mesh indices and weights of the assignment stencil along each axis
+
+    args
+    ----
+    s:      array of positions in units of the mesh spacing
+    M:      number of mesh cells along each axis
+    assign: 'cic' (cloud-in-cell) or 'tsc' (triangular-shaped cloud)
+
+    returns
+    -------
+    I,w:    arrays of shape (p,N,3), p = 2 for cic and 3 for tsc
+    """
+    if assign == 'cic':
+        i0  =   np.floor(s)
+        d   =   s - i0
+        I   =   np.stack((i0,i0+1))
+        w   =   np.stack((1-d,d))
+    else:
+        i0  =   np.floor(s + .5)
+        d   =   s - i0
+        I   =   np.stack((i0-1,i0,i0+1))
+        w   =   np.stack((.5*(.5-d)**2,.75-d**2,.5*(.5+d)**2))
+    return I.astype(np.int64) % M,w
+
+def _periodic_cells(rA,L,rcut,span=2):
+    """ cell-linked list of a periodic box with cells no smaller than
+    rcut/span, so that neighbours lie within span cells along each axis
+
+    returns
+    -------
+    cA, nc, ukey, start, count, order - as in tree.pairs - and the cell offsets to search
+    """
+    nc      =   int(L * span // rcut)
+    assert nc >= 2*span + 1, "short-range cutoff must be at most a third of the box"
+    s       =   range(-span,span+1)
+    offsets =   np.array([ (i,j,k) for i in s for j in s for k in s ])
+    cA      =   np.minimum( np.floor( np.mod(rA,L) * (nc/L) ).astype(np.int64), nc-1 )
+    nc      =   np.array([nc,nc,nc])
+    key     =   tree.cell_key(cA,nc)
+    order   =   np.argsort(key,kind='stable')
+    ukey,start,count = np.unique(key[order],return_index=True,return_counts=True)
+    return cA,nc,ukey,start,count,order,offsets
+
+def periodic_pairs(rA,L,rcut,idx=None,cells=None):
+    """ all pairs closer than rcut in the minimum image of a periodic box
+
+    args
+    ----
+    rA:     array of particle positions
+    L:      length of the box
+    rcut:   pair cutoff, at most L/3
+    idx:    ** indices of target particles - default = all particles
+    cells:  ** output of _periodic_cells, reused across calls - default = new cells
+
+    returns
+    -------
+    J:      array of target particle indices, sorted
+    I:      array of neighbour indices, never J[k] itself
+    r_ij:   array of minimum-image separations r_J - r_I
+    """
+    if idx is None: idx = np.arange(len(rA))
+    idx     =   np.atleast_1d(idx)
+    if cells is None: cells = _periodic_cells(rA,L,rcut)
+    cA,nc,ukey,start,count,order,offsets = cells
+
+    J_out,I_out,R_out = [],[],[]
+    for o in offsets:
+        k       =   tree.cell_key( (cA[idx] + o) % nc, nc )
+        loc     =   np.searchsorted(ukey,k)
+        loc[loc == len(ukey)] = 0
+        found   =   ukey[loc] == k
+        t,loc   =   idx[found],loc[found]
+
+        n       =   count[loc]
+        j       =   np.repeat(t,n)
+        i       =   order[tree._expand(start[loc],n)]
+
+        r_ij    =   rA[j] - rA[i]
+        r_ij    -=  L * np.round(r_ij / L)
+        keep    =   ((r_ij**2).sum(axis=1) < rcut**2) & (i != j)
+
+        J_out.append(j[keep])
+        I_out.append(i[keep])
+        R_out.append(r_ij[keep])
+
+    J       =   np.concatenate(J_out)
+    I       =   np.concatenate(I_out)
+    r_ij    =   np.concatenate(R_out)
+    s       =   np.lexsort((I,J))
+    return J[s],I[s],r_ij[s]
+
+class PM:
+    """ periodic self-gravity of a cubic box - particle-mesh alone, or TreePM
+    with a short-range pair correction when split is given
+
+    args
+    ----
+    L:      length of the box, positions are taken modulo L
+    M:      ** mesh cells along each axis - default = 64
+    assign: ** 'cic' or 'tsc' mass assignment and force interpolation - default = 'cic'
+    split:  ** force split scale r_s in mesh cells, None for pure PM - default = None
+    cut:    ** short-range cutoff in units of r_s - default = 4.5
+    G:      ** gravitational constant - default = inc.G
+    smooth: ** Gaussian smoothing of pure PM in mesh cells - default = 0.5
+
+    pure PM cannot resolve forces below a few cells; against an Ewald sum
+    (M = 64, CIC) pair forces are within 0.4% at 13 cells, 3% at 6 cells
+    and 9% at 3 cells, and the median force error of 300 random particles
+    is 0.9% (TreePM with split = 1.25: 0.6%)
+    """
+    def __init__(self,L,M=64,assign='cic',split=None,cut=4.5,G=None,smooth=.5):
+        assert assign in ('cic','tsc'), "assign must be 'cic' or 'tsc'"
+        self.L          =   L
+        self.M          =   M
+        self.assign     =   assign
+        self.dx         =   L / M
+        self.r_s        =   None if split is None else split * self.dx
+        self.cut        =   cut
+        self.G          =   inc.G if G is None else G
+
+        k               =   2*np.pi * np.fft.fftfreq(M,d=self.dx)
+        kz              =   2*np.pi * np.fft.rfftfreq(M,d=self.dx)
+        k2              =   k[:,None,None]**2 + k[None,:,None]**2 + kz[None,None,:]**2
+
+        # Green's function, deconvolved by the assignment and interpolation
+        # windows - TreePM's Gaussian cuts off the high k where the
+        # deconvolution is large, pure PM deconvolves once and is smoothed.
+        # forces are 4-point finite differences of the mesh potential, since
+        # spectral gradients of a particle on a mesh point ring at high k
+        p               =   2 if assign == 'cic' else 3
+        Wk              =   ( np.sinc(k*self.dx/(2*np.pi))[:,None,None]
+                            * np.sinc(k*self.dx/(2*np.pi))[None,:,None]
+                            * np.sinc(kz*self.dx/(2*np.pi))[None,None,:] )**p
+        k2[0,0,0]       =   1
+        if self.r_s is not None:    self.green = -4*np.pi*self.G / k2 / Wk**2 * np.exp(-k2 * self.r_s**2)
+        else:                       self.green = -4*np.pi*self.G / k2 / Wk * np.exp(-k2 * (smooth*self.dx)**2)
+        self.green[0,0,0] = 0
+
+        if self.r_s is not None: self.u,self.S = _split_table(cut)
+
+    def _keys(self,rA):
+        """ flattened mesh keys and weights of the stencil of every particle """
+        I,w     =   _stencil(np.mod(rA,self.L) / self.dx,self.M,self.assign)
+        p       =   len(I)
+        M       =   self.M
+        for a in range(p):
+            for b in range(p):
+                for c in range(p):
+                    yield ( I[a,:,0]*M + I[b,:,1] )*M + I[c,:,2], w[a,:,0] * w[b,:,1] * w[c,:,2]
+
+    def density(self,rA,mA):
+        """ mass density on the mesh
+
+        args
+        ----
+        rA:     array of particle positions
+        mA:     array of particle masses
+        """
+        rho     =   np.zeros(self.M**3)
+        for key,w in self._keys(rA):
+            rho +=  np.bincount(key,weights=mA*w,minlength=self.M**3)
+        return rho.reshape((self.M,)*3) / self.dx**3
+
+    def acc_long(self,rA,mA):
+        """ long-range (mesh) accelerations of all particles
+
+        args
+        ----
+        rA:     array of particle positions
+        mA:     array of particle masses
+        """
+        # a = - grad phi, phi[i-1] = np.roll(phi,1)[i]
+        phi     =   np.fft.irfftn(self.green * np.fft.rfftn(self.density(rA,mA)),s=(self.M,)*3,axes=(0,1,2))
+        g       =   [ ( 8 * ( np.roll(phi,1,d) - np.roll(phi,-1,d) ) - ( np.roll(phi,2,d) - np.roll(phi,-2,d) ) ).ravel() / (12*self.dx)
+                      for d in range(3) ]
+
+        out     =   np.zeros((len(mA),3),dtype=precision.accum)
+        for key,w in self._keys(rA):
+            for d in range(3): out[:,d] += w * g[d][key]
+        return out
+
+    def acc_short(self,rA,mA,hA,W=kernel.W_M4star,block=4096):
+        """ short-range accelerations of all particles, pairs within cut * r_s
+        with the split factor S(r/r_s) and softening W
+
+        args
+        ----
+        rA:     array of particle positions
+        mA:     array of particle masses
+        hA:     array of particle smoothing lengths
+        W:      ** softening function - default = kernel.W_M4star
+        block:  ** number of target particles handled at once - default = 4096
+        """
+        N       =   len(mA)
+        rcut    =   self.cut * self.r_s
+        cells   =   _periodic_cells(rA,self.L,rcut)
+        out     =   np.zeros((N,3),dtype=precision.accum)
+
+        for b in range(0,N,block):
+            J,I,r_ij    =   periodic_pairs(rA,self.L,rcut,idx=np.arange(b,min(b+block,N)),cells=cells)
+            r_ij1       =   np.linalg.norm(r_ij,axis=1)
+            h_ij        =   .5 * (hA[I] + hA[J])
+            f           =   mA[I] * W(r_ij1,h_ij) / r_ij1**3 * np.interp(r_ij1/self.r_s,self.u,self.S)
+            for d in range(3):
+                out[:,d]    -=  self.G * np.bincount(J,weights=f*r_ij[:,d],minlength=N)
+        return out
+
+    def acc(self,rA,mA,hA=None,W=kernel.W_M4star):
+        """ gravitational accelerations of all particles, long-range plus
+        short-range when a split is set
+
+        args
+        ----
+        rA:     array of particle positions
+        mA:     array of particle masses
+        hA:     ** array of smoothing lengths, needed with a split - default = None
+        W:      ** softening function of the short-range part - default = kernel.W_M4star
+        """
+        out     =   self.acc_long(rA,mA)
+        if self.r_s is not None:
+            assert hA is not None, "TreePM needs smoothing lengths"
+            out +=  self.acc_short(rA,mA,hA,W=W)
+        return out
@@ -1,4 +1,8 @@
 import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.tree as tree
+import djak.phys.SPH.jit as jit
+import djak.phys.SPH.precision as precision
+import djak.phys.SPH.profiling as profiling
 import djak.math as dm
 import numpy as np
 
@@ -14,6 +18,20 @@ beta    =   1
 gamma   =   1
 G       =   1e-4
 
+#===============================================================================
+""" backend """
+#-------------------------------------------------------------------------------
+
+def _compiled(*fns):
+    """ True if the numba backend is selected in jit and every smoothing
+    function given is an analytic M4 kernel that it compiles
+    """
+    if not jit.enabled() or kernel._tables: return False
+    ok  =   [kernel.W_M4,kernel.dW_M4,kernel.W_M4star]
+    if kernel.M4.table is None:     ok += [kernel.M4,kernel.M4.W,kernel.M4.dW]
+    if kernel.M4star.table is None: ok += [kernel.M4star,kernel.M4star.W]
+    return all( any( f is g or f == g for g in ok ) for f in fns )
+
 #===============================================================================
 """ sound speed in gas """
 #-------------------------------------------------------------------------------
@@ -33,22 +51,23 @@ def c_gas(j,rhoA,PA):
 """ density """
 #-------------------------------------------------------------------------------
 
-def rho(j,rA,mA,hA,W=kernel.W_M4):
+def rho(j,rA,mA,hA,W=kernel.W_M4,nbrs=None):
     """ computes density of particle i
 
     args
     ----
-    j:  particle index
-    rA: array of particle positions
-    mA: array of particle masses
-    hA: array of smoothing lengths
-    W:  ** smoothing function - default = M4
+    j:      particle index
+    rA:     array of particle positions
+    mA:     array of particle masses
+    hA:     array of smoothing lengths
+    W:      ** smoothing function - default = M4
+    nbrs:   ** neighbour lists from tree.neighbours - default = all particles
     """
     assert rA.shape[0] == mA.shape[0] == hA.shape[0], "arrays are not matched"
     N   =   len(mA)
 
     tot =   0
-    for i in range(N):
+    for i in (range(N) if nbrs is None else nbrs[j]):
         if i != j:
 
             r_ij1   =   np.linalg.norm( rA[j,:] - rA[i,:] )
@@ -59,6 +78,67 @@ def rho(j,rA,mA,hA,W=kernel.W_M4):
 
     return tot
 
+def rho_all(rA,mA,hA,W=kernel.W_M4,idx=None,block=256,nbrs=None,out=None,table=None):
+    """ computes densities of many particles at once - same sum as rho, but
+    pairwise distances are broadcast over blocks of targets so the loop over
+    all N particles runs inside numpy
+
+    args
+    ----
+    rA:     array of particle positions
+    mA:     array of particle masses
+    hA:     array of smoothing lengths
+    W:      ** smoothing function - default = M4
+    idx:    ** indices of particles to compute - default = all particles
+    block:  ** number of target particles per block - default = 256
+    nbrs:   ** neighbour lists from tree.neighbours - default = all particles
+    out:    ** array the densities are written to - default = new array
+    table:  ** tree.PairTable of this step, replaces W and nbrs - default = None
+
+    returns
+    -------
+    array of densities, one for each index in idx
+    """
+    assert rA.shape[0] == mA.shape[0] == hA.shape[0], "arrays are not matched"
+    N   =   len(mA)
+    if idx is None: idx = np.arange(N)
+    idx =   np.atleast_1d(idx)
+
+    if table is not None:
+        if out is None: out = np.zeros(len(idx),dtype=precision.store)
+        out[...]=   table.density(mA)[idx]
+        return out
+
+    if _compiled(W):
+        start,index =   (None,None) if nbrs is None else jit.csr(*tree.neighbour_pairs(nbrs,np.unique(idx)),N)
+        return jit.density(rA,mA,hA,idx,start,index,out=out)
+
+    if nbrs is not None:
+        # only visit interacting pairs, summed back onto position in idx
+        lens    =   np.array([ len(nbrs[j]) for j in idx ],dtype=np.int64)
+        J,I     =   tree.neighbour_pairs(nbrs,idx)
+        r_ij1   =   np.linalg.norm( rA[J] - rA[I], axis=1 )
+        h_ij    =   .5 * (hA[I] + hA[J])
+        w       =   mA[I] * h_ij**(-3) * W(r_ij1,h_ij)
+        if out is None: out = np.zeros(len(idx),dtype=precision.store)
+        out[...]=   np.bincount( np.repeat(np.arange(len(idx)),lens), weights=w, minlength=len(idx) )
+        return out
+
+    if out is None: out = np.zeros(len(idx),dtype=precision.store)
+    for b in range(0,len(idx),block):
+        J       =   idx[b:b+block]
+
+        # (block,N) arrays of pair separations and smoothing lengths
+        r_ij1   =   np.linalg.norm( rA[J,None,:] - rA[None,:,:], axis=2 )
+        h_ij    =   .5 * (hA[None,:] + hA[J,None])
+
+        w       =   mA[None,:] * h_ij**(-3) * W(r_ij1,h_ij)
+        w[np.arange(len(J)),J] = 0
+
+        out[b:b+block]  =   w.sum(axis=1,dtype=precision.accum)
+
+    return out
+
 #===============================================================================
 """ presure """
 #-------------------------------------------------------------------------------
@@ -79,7 +159,7 @@ def P_bol(j,rhoA):
 """ acelleration terms """
 #-------------------------------------------------------------------------------
 
-def acc_fluid(j,rA,mA,rhoA,PA,hA,dW=kernel.dW_M4):
+def acc_fluid(j,rA,mA,rhoA,PA,hA,dW=kernel.dW_M4,nbrs=None):
     """ compute acceleration from fluid dynamics
 
     args
@@ -91,6 +171,7 @@ def acc_fluid(j,rA,mA,rhoA,PA,hA,dW=kernel.dW_M4):
     PA:     array of particle pressures
     hA:     array of particle smoothing lengths
     dW:     ** smoothing function - default = kernel.dW_M4
+    nbrs:   ** neighbour lists from tree.neighbours - default = all particles
     """
     assert rA.shape[0] == mA.shape[0] == rhoA.shape[0] == PA.shape[0] == hA.shape[0], "arrays are mismatched"
     N       =   len(mA)
@@ -98,7 +179,7 @@ def acc_fluid(j,rA,mA,rhoA,PA,hA,dW=kernel.dW_M4):
     P_j     =   PA[j]
 
     tot     =   0
-    for i in range(N):
+    for i in (range(N) if nbrs is None else nbrs[j]):
         if i != j:
 
             r_ij    =   rA[j,:] - rA[i,:]
@@ -118,30 +199,32 @@ def acc_fluid(j,rA,mA,rhoA,PA,hA,dW=kernel.dW_M4):
 
     return - tot
 
-def acc_visc(j,rA,vA,mA,rhoA,PA,hA,dW=kernel.dW_M4):
+def acc_visc(j,rA,vA,mA,rhoA,PA,hA,dW=kernel.dW_M4,nbrs=None,cA=None):
     """ compute acceleration from artificial viscosity
 
     args
     ----
-    j:  particle index
-    rA: array of particle positions
-    vA: array of particle velocities
-    hA: array of smoothing lengths
-    dW: ** smoothing function - default = kernel.dW_M4
+    j:      particle index
+    rA:     array of particle positions
+    vA:     array of particle velocities
+    hA:     array of smoothing lengths
+    dW:     ** smoothing function - default = kernel.dW_M4
+    nbrs:   ** neighbour lists from tree.neighbours - default = all particles
+    cA:     ** array of sound speeds from eos.stage - default = c_gas
     """
     assert rA.shape[0] == vA.shape[0] == mA.shape[0] == rhoA.shape[0] == hA.shape[0], "arrays are not matched"
     N       =   len(mA)
-    c_j     =   c_gas(j,rhoA,PA)
+    c_j     =   c_gas(j,rhoA,PA) if cA is None else cA[j]
 
     tot     =   0
-    for i in range(N):
+    for i in (range(N) if nbrs is None else nbrs[j]):
         if i != j:
 
             r_ij    =   rA[j,:] - rA[i,:]
             r_ij1   =   np.linalg.norm(r_ij)
             v_ij    =   vA[j,:] - vA[i,:]
             m_i     =   mA[i]
-            c_i     =   c_gas(i,rhoA,PA)
+            c_i     =   c_gas(i,rhoA,PA) if cA is None else cA[i]
             c_ij    =   0.5 * (c_i + c_j)
             h_ij    =   0.5 * (hA[i] + hA[j])
             rho_ij  =   0.5 * (rhoA[i] + rhoA[j])
@@ -187,15 +270,250 @@ def acc_grav(j,rA,mA,hA,W=kernel.W_M4star):
             m_i     =   mA[i]
             h_ij    =   0.5 * (hA[i] + hA[j])
 
-            tot     +=  m_i * (r_ij/r_ij**3) * W(r_ij1,h_ij)
+            tot     +=  m_i * (r_ij/r_ij1**3) * W(r_ij1,h_ij)
 
     return - tot * G
 
-def acc_total(j,rA,vA,mA,rhoA,PA,hA,Wstar=kernel.W_M4star,dW=kernel.dW_M4):
+def acc_grav_all(rA,mA,hA,W=kernel.W_M4star,idx=None,block=256,theta=None,quadrupole=False):
+    """ compute gravitational acceleration of many particles at once, either
+    by direct summation broadcast over blocks of targets (same sum as
+    acc_grav) or, if theta is given, with the Barnes-Hut octree in tree.py
+
+    args
+    ----
+    rA:         array of particle positions
+    mA:         array of particle masses
+    hA:         array of particle smoothing lengths
+    W:          ** smoothing function - default = kernel.W_M4star
+    idx:        ** indices of particles to compute - default = all particles
+    block:      ** number of target particles per block - default = 256
+    theta:      ** tree opening angle - default = None (direct summation)
+    quadrupole: ** include quadrupole moments in the tree - default = False
+
+    returns
+    -------
+    array of accelerations, one for each index in idx
+    """
+    assert rA.shape[0] == mA.shape[0] == hA.shape[0], "arrays are mismatched"
+    N   =   len(mA)
+    if idx is None: idx = np.arange(N)
+    idx =   np.atleast_1d(idx)
+
+    if theta is not None:
+        return tree.acc_grav_tree(rA,mA,hA,theta=theta,quadrupole=quadrupole,idx=idx,W=W,G=G)
+    profiling.count('gravity interactions',len(idx) * (N-1))
+    if _compiled(W):
+        return jit.grav(rA,mA,hA,idx,G)
+
+    out =   np.zeros((len(idx),3),dtype=precision.accum)
+    for b in range(0,len(idx),block):
+        J       =   idx[b:b+block]
+        self_   =   np.arange(len(J)),J
+
+        r_ij    =   rA[J,None,:] - rA[None,:,:]
+        r_ij1   =   np.linalg.norm(r_ij,axis=2)
+        r_ij1[self_]    =   1
+        h_ij    =   .5 * (hA[None,:] + hA[J,None])
+
+        f       =   mA[None,:] * W(r_ij1,h_ij) / r_ij1**3
+        f[self_]        =   0
+
+        out[b:b+block]  =   - G * (f[:,:,None] * r_ij).sum(axis=1,dtype=precision.accum)
+
+    return out
+
+def grav_error(rA,mA,hA,theta=.5,quadrupole=False,idx=None):
+    """ relative error of the tree gravity against direct summation
+
+    args
+    ----
+    rA:         array of particle positions
+    mA:         array of particle masses
+    hA:         array of particle smoothing lengths
+    theta:      ** tree opening angle - default = 0.5
+    quadrupole: ** include quadrupole moments in the tree - default = False
+    idx:        ** indices of particles to compare - default = all particles
+
+    returns
+    -------
+    array of |a_tree - a_direct| / |a_direct|, one for each index in idx
+    """
+    a_dir   =   acc_grav_all(rA,mA,hA,idx=idx)
+    a_tree  =   acc_grav_all(rA,mA,hA,idx=idx,theta=theta,quadrupole=quadrupole)
+    return np.linalg.norm(a_tree - a_dir,axis=1) / np.linalg.norm(a_dir,axis=1)
+
+def _pair_hydro(r_ij1,v_ij_r_ij,h_ij,rho_i,rho_j,P_i,P_j,c_i,c_j,dW,dWh=None):
+    """ scalar fluid and viscous factors of pairs, such that particle j is
+    accelerated by - m_i * factor * r_ij / |r_ij| (and particle i by the
+    opposite with m_j) - the same terms as acc_fluid and acc_visc, with
+    h_ij^-4 dW taken from dWh when it is given
+    """
+    if dWh is None: dWh = h_ij**(-4) * dW(r_ij1,h_ij)
+    fluid   =   ( (P_i/rho_i**2) + (P_j/rho_j**2) ) * dWh
+
+    c       =   v_ij_r_ij
+    mu_ij   =   ( c * h_ij ) / ( r_ij1**2 + 0.01*h_ij**2 )
+    c_ij    =   0.5 * (c_i + c_j)
+    rho_ij  =   0.5 * (rho_i + rho_j)
+    Pi_ij   =   ( -alpha * mu_ij * c_ij + beta * mu_ij**2 ) / rho_ij * dm.heavi(-c)
+    visc    =   Pi_ij * dWh
+
+    return fluid,visc
+
+def acc_table(table,vA,mA,rhoA,PA,cA,idx=None,out=None):
+    """ fluid and viscous accelerations from a tree.PairTable, gathering the
+    cached pair geometry and scattering with bincount - a full table is
+    walked over its unique pairs with equal and opposite contributions,
+    otherwise every listed pair adds to its target only
+
+    args
+    ----
+    table:  tree.PairTable of this step
+    vA:     array of particle velocities
+    mA:     array of particle masses
+    rhoA:   array of particle densities
+    PA:     array of particle pressures
+    cA:     array of particle sound speeds
+    idx:    ** targets to compute, e.g. the active particles - default = all targets of the table
+    out:    ** (a_fluid, a_visc) arrays the results are written to - default = new arrays
+
+    returns
+    -------
+    a_fluid, a_visc arrays of all particles, zero for particles not computed
+    """
+    N       =   table.N
+    if out is None: out = np.zeros((N,3),dtype=precision.accum),np.zeros((N,3),dtype=precision.accum)
+    sym     =   idx is None and table.full
+    rows    =   table.half() if sym else (slice(None) if idx is None else table.rows(idx))
+
+    J,I     =   table.J[rows],table.I[rows]
+    r_ij1   =   table.r_ij1[rows]
+    e_ij    =   table.r_ij[rows] / r_ij1[:,None]
+    vr      =   ((vA[J] - vA[I]) * table.r_ij[rows]).sum(axis=1)
+
+    fluid,visc  =   _pair_hydro(r_ij1,vr,table.h_ij[rows],rhoA[I],rhoA[J],PA[I],PA[J],cA[I],cA[J],None,dWh=table.dW[rows])
+    for a,f in zip(out,(fluid,visc)):
+        for k in range(3):
+            a[:,k]      =   - table.sum(mA[I]*f*e_ij[:,k],J=J)
+            if sym: a[:,k] += table.sum(mA[J]*f*e_ij[:,k],J=I)
+    return out
+
+def acc_all(rA,vA,mA,rhoA,PA,hA,Wstar=kernel.W_M4star,dW=kernel.dW_M4,block=256,pairs=None,theta=None,quadrupole=False,out=None,cA=None,table=None):
+    """ compute fluid, viscous and gravitational accelerations of all
+    particles together - every unique pair is visited once, its separation
+    and kernel gradient are evaluated once, and equal and opposite
+    contributions are scattered onto both particles
+
+    without pairs, tiles of the upper triangle of the pair matrix are
+    broadcast and gravity is summed in the same pass; with pairs only the
+    listed neighbours get hydro forces and gravity comes from acc_grav_all
+
+    args
+    ----
+    rA:         array of particle positions
+    vA:         array of particle velocities
+    mA:         array of particle masses
+    rhoA:       array of particle densities
+    PA:         array of particle pressures
+    hA:         array of particle smoothing lengths
+    Wstar:      ** gravity smoothing function - default = kernel.W_M4star
+    dW:         ** smoothing function - default = kernel.dW_M4
+    block:      ** tile size - default = 256
+    pairs:      ** (J,I) pair arrays from tree.pairs - default = all pairs
+    theta:      ** tree opening angle used with pairs - default = None (direct summation)
+    quadrupole: ** include quadrupole moments in the tree - default = False
+    out:        ** (a_fluid, a_visc, a_grav) arrays the results are written to - default = new arrays
+    cA:         ** array of sound speeds from eos.stage - default = c_gas of all particles
+    table:      ** tree.PairTable of this step, used instead of pairs - default = None
+
+    returns
+    -------
+    a_fluid, a_visc, a_grav arrays
+    """
+    assert rA.shape[0] == vA.shape[0] == mA.shape[0] == rhoA.shape[0] == PA.shape[0] == hA.shape[0], "arrays are mismatched"
+    N       =   len(mA)
+    if cA is None: cA = c_gas(slice(None),rhoA,PA)
+    if out is None: out = tuple( np.zeros((N,3),dtype=precision.accum) for k in range(3) )
+    a_fluid,a_visc,a_grav = out
+    for a in out: a[...] = 0
+
+    if table is not None:
+        acc_table(table,vA,mA,rhoA,PA,cA,out=out[:2])
+        a_grav[...]     =   acc_grav_all(rA,mA,hA,W=Wstar,block=block,theta=theta,quadrupole=quadrupole)
+        return a_fluid,a_visc,a_grav
+
+    if _compiled(dW,Wstar):
+        all_    =   np.arange(N)
+        start,index =   (None,None) if pairs is None else jit.csr(*pairs,N)
+        jit.hydro(rA,vA,mA,rhoA,PA,cA,hA,all_,alpha,beta,start,index,out=(a_fluid,a_visc))
+        if pairs is None:   jit.grav(rA,mA,hA,all_,G,out=a_grav)
+        else:               a_grav[...] = acc_grav_all(rA,mA,hA,W=Wstar,block=block,theta=theta,quadrupole=quadrupole)
+        return a_fluid,a_visc,a_grav
+
+    if pairs is not None:
+        J,I     =   pairs
+        keep    =   J < I
+        J,I     =   J[keep],I[keep]
+
+        r_ij    =   rA[J] - rA[I]
+        r_ij1   =   np.linalg.norm(r_ij,axis=1)
+        e_ij    =   r_ij / r_ij1[:,None]
+        h_ij    =   .5 * (hA[I] + hA[J])
+        vr      =   ((vA[J] - vA[I]) * r_ij).sum(axis=1)
+
+        fluid,visc  =   _pair_hydro(r_ij1,vr,h_ij,rhoA[I],rhoA[J],PA[I],PA[J],cA[I],cA[J],dW)
+        for a,f in ((a_fluid,fluid),(a_visc,visc)):
+            for k in range(3):
+                a[:,k]      -=  np.bincount(J,weights=mA[I]*f*e_ij[:,k],minlength=N)
+                a[:,k]      +=  np.bincount(I,weights=mA[J]*f*e_ij[:,k],minlength=N)
+
+        a_grav[...]     =   acc_grav_all(rA,mA,hA,W=Wstar,block=block,theta=theta,quadrupole=quadrupole)
+        return a_fluid,a_visc,a_grav
+
+    for b0 in range(0,N,block):
+        b1  =   min(b0+block,N)
+        for a0 in range(b0,N,block):
+            a1      =   min(a0+block,N)
+
+            # rows are particles j in [b0,b1), columns particles i in [a0,a1)
+            r_ij    =   rA[b0:b1,None,:] - rA[None,a0:a1,:]
+            r_ij1   =   np.linalg.norm(r_ij,axis=2)
+            upper   =   np.arange(b0,b1)[:,None] < np.arange(a0,a1)[None,:]
+            r_ij1[~upper]   =   1
+            e_ij    =   r_ij / r_ij1[:,:,None]
+            h_ij    =   .5 * (hA[b0:b1,None] + hA[None,a0:a1])
+            vr      =   ((vA[b0:b1,None,:] - vA[None,a0:a1,:]) * r_ij).sum(axis=2)
+
+            fluid,visc  =   _pair_hydro(r_ij1,vr,h_ij,rhoA[None,a0:a1],rhoA[b0:b1,None],PA[None,a0:a1],PA[b0:b1,None],cA[None,a0:a1],cA[b0:b1,None],dW)
+            grav        =   G * Wstar(r_ij1,h_ij) / r_ij1**2
+
+            for a,f in ((a_fluid,fluid),(a_visc,visc),(a_grav,grav)):
+                f           =   np.where(upper,f,0)[:,:,None] * e_ij
+                a[b0:b1]    -=  (mA[None,a0:a1,None] * f).sum(axis=1,dtype=precision.accum)
+                a[a0:a1]    +=  (mA[b0:b1,None,None] * f).sum(axis=0,dtype=precision.accum)
+
+    return a_fluid,a_visc,a_grav
+
+def acc_total(j,rA,vA,mA,rhoA,PA,hA,Wstar=kernel.W_M4star,dW=kernel.dW_M4,nbrs=None,cA=None):
+    """ compute total acceleration on particle j
+
+    args
+    ----
+    j:      particle index
+    rA:     array of particle positions
+    vA:     array of particle velocities
+    mA:     array of particle masses
+    rhoA:   array of particle densities
+    PA:     array of particle pressures
+    hA:     array of particle smoothing lengths
+    Wstar:  ** gravity smoothing function - default = kernel.W_M4star
+    dW:     ** smoothing function - default = kernel.dW_M4
+    nbrs:   ** neighbour lists from tree.neighbours - default = all particles
+    cA:     ** array of sound speeds from eos.stage - default = c_gas
+    """
 
-    # a_fluid =   acc_fluid(j,rA,mA,rhoA,PA,hA,dW=dW)
-    # a_visc  =   acc_visc(j,rA,vA,mA,rhoA,PA,hA,dW=dW)
+    a_fluid =   acc_fluid(j,rA,mA,rhoA,PA,hA,dW=dW,nbrs=nbrs)
+    a_visc  =   acc_visc(j,rA,vA,mA,rhoA,PA,hA,dW=dW,nbrs=nbrs,cA=cA)
     a_grav  =   acc_grav(j,rA,mA,hA,W=Wstar)
 
-    # return a_fluid + a_visc + a_grav
-    # return a_grav
+    return a_fluid + a_visc + a_grav
@@ -0,0 +1,317 @@
+import numpy as np
+import importlib.util
+
+# numba is imported, and the loops below compiled, by the first set_backend('numba')
+numba   =   None
+
+#===============================================================================
+""" backend selection
+
+the pair loops of incompressible.py and the M4 kernels of kernel.py run in
+numpy by default; set_backend('numba') switches them to the compiled loops
+below, which run over particles in parallel threads with the GIL released
+and allocate nothing but their outputs. without numba installed the numpy
+path is always used """
+#-------------------------------------------------------------------------------
+
+backend =   'numpy'
+
+def available():
+    """ True if numba can be imported """
+    return numba is not None or importlib.util.find_spec('numba') is not None
+
+def set_backend(name='numba'):
+    """ selects the backend of the pair loops and kernels
+
+    args
+    ----
+    name:   ** 'numba' or 'numpy' - default = 'numba'
+
+    returns
+    -------
+    name of the backend in use, 'numpy' if numba was asked for but is missing
+    """
+    global backend
+    assert name in ('numba','numpy'), "backend must be 'numba' or 'numpy'"
+    if name == 'numba' and numba is None and available(): _build()
+    backend =   name if numba is not None else 'numpy'
+    return backend
+
+def enabled():
+    """ True if the numba backend is selected """
+    return backend == 'numba'
+
+#===============================================================================
+""" compiled kernels and loops """
+#-------------------------------------------------------------------------------
+
+def _build():
+    """ imports numba and compiles the kernels and loops into this module """
+    global numba
+    import numba
+
+    _loop   =   numba.njit(parallel=True,nogil=True,cache=True)
+    _inline =   numba.njit(nogil=True,cache=True,inline='always')
+    _ufunc  =   numba.vectorize(['float64(float64,float64)','float32(float32,float32)'],nopython=True,cache=True)
+
+    @_inline
+    def _w(q):
+        # M4 kernel of q = r/h, as kernel.W_M4
+        if q < 1:   return (1 - 1.5*q**2 + .75*q**3) / np.pi
+        if q < 2:   return .25 * (2 - q)**3 / np.pi
+        return 0.
+
+    @_inline
+    def _dw(q):
+        # derivative of the M4 kernel, as kernel.dW_M4
+        if q < 1:   return -(3*q - 2.25*q**2) / np.pi
+        if q < 2:   return -.75 * (2 - q)**2 / np.pi
+        return 0.
+
+    @_inline
+    def _wstar(q):
+        # M4 gravity softening, as kernel.W_M4star
+        if q < 1:   return (40*q**3 - 36*q**5 + 15*q**6) / 30
+        if q < 2:   return (80*q**3 - 90*q**4 + 36*q**5 - 5*q**6 - 2) / 30
+        return 1.
+
+    @_ufunc
+    def W_M4(r_mag,h):
+        return _w(r_mag/h)
+
+    @_ufunc
+    def dW_M4(r_mag,h):
+        return _dw(r_mag/h)
+
+    @_ufunc
+    def W_M4star(r_mag,h):
+        return _wstar(r_mag/h)
+
+    @_loop
+    def _density(rA,mA,hA,targets,start,index,out):
+        for t in numba.prange(len(targets)):
+            j   =   targets[t]
+            s   =   0.
+            for k in range(start[j],start[j+1]):
+                i       =   index[k]
+                r2      =   0.
+                for d in range(3): r2 += (rA[j,d] - rA[i,d])**2
+                h_ij    =   .5 * (hA[i] + hA[j])
+                s       +=  mA[i] * h_ij**(-3) * _w(np.sqrt(r2)/h_ij)
+            out[t]  =   s
+
+    @_loop
+    def _density_all(rA,mA,hA,targets,out):
+        for t in numba.prange(len(targets)):
+            j   =   targets[t]
+            s   =   0.
+            for i in range(len(mA)):
+                if i == j: continue
+                r2      =   0.
+                for d in range(3): r2 += (rA[j,d] - rA[i,d])**2
+                h_ij    =   .5 * (hA[i] + hA[j])
+                s       +=  mA[i] * h_ij**(-3) * _w(np.sqrt(r2)/h_ij)
+            out[t]  =   s
+
+    @_inline
+    def _pair(j,i,rA,vA,mA,rhoA,PA,cA,hA,alpha,beta,a_fluid,a_visc,t):
+        # adds the fluid and viscous terms of neighbour i to target row t,
+        # the same terms as inc._pair_hydro
+        dx      =   rA[j,0] - rA[i,0]
+        dy      =   rA[j,1] - rA[i,1]
+        dz      =   rA[j,2] - rA[i,2]
+        r2      =   dx*dx + dy*dy + dz*dz
+        vr      =   (vA[j,0] - vA[i,0]) * dx + (vA[j,1] - vA[i,1]) * dy + (vA[j,2] - vA[i,2]) * dz
+        r_ij1   =   np.sqrt(r2)
+        h_ij    =   .5 * (hA[i] + hA[j])
+        dWh     =   h_ij**(-4) * _dw(r_ij1/h_ij)
+        fluid   =   ( PA[i]/rhoA[i]**2 + PA[j]/rhoA[j]**2 ) * dWh
+
+        visc    =   0.
+        if vr < 0:
+            mu_ij   =   vr * h_ij / ( r2 + 0.01*h_ij**2 )
+            c_ij    =   .5 * (cA[i] + cA[j])
+            rho_ij  =   .5 * (rhoA[i] + rhoA[j])
+            visc    =   ( -alpha * mu_ij * c_ij + beta * mu_ij**2 ) / rho_ij * dWh
+
+        f       =   mA[i] * fluid / r_ij1
+        v       =   mA[i] * visc / r_ij1
+        a_fluid[t,0]    -=  f * dx
+        a_fluid[t,1]    -=  f * dy
+        a_fluid[t,2]    -=  f * dz
+        a_visc[t,0]     -=  v * dx
+        a_visc[t,1]     -=  v * dy
+        a_visc[t,2]     -=  v * dz
+
+    @_loop
+    def _hydro(rA,vA,mA,rhoA,PA,cA,hA,targets,start,index,alpha,beta,a_fluid,a_visc):
+        for t in numba.prange(len(targets)):
+            j   =   targets[t]
+            for d in range(3): a_fluid[t,d] = a_visc[t,d] = 0.
+            for k in range(start[j],start[j+1]):
+                _pair(j,index[k],rA,vA,mA,rhoA,PA,cA,hA,alpha,beta,a_fluid,a_visc,t)
+
+    @_loop
+    def _hydro_all(rA,vA,mA,rhoA,PA,cA,hA,targets,alpha,beta,a_fluid,a_visc):
+        for t in numba.prange(len(targets)):
+            j   =   targets[t]
+            for d in range(3): a_fluid[t,d] = a_visc[t,d] = 0.
+            for i in range(len(mA)):
+                if i != j: _pair(j,i,rA,vA,mA,rhoA,PA,cA,hA,alpha,beta,a_fluid,a_visc,t)
+
+    @_loop
+    def _grav(rA,mA,hA,targets,G,out):
+        for t in numba.prange(len(targets)):
+            j   =   targets[t]
+            ax  =   ay  =   az  =   0.
+            for i in range(len(mA)):
+                if i == j: continue
+                dx      =   rA[j,0] - rA[i,0]
+                dy      =   rA[j,1] - rA[i,1]
+                dz      =   rA[j,2] - rA[i,2]
+                r_ij1   =   np.sqrt(dx*dx + dy*dy + dz*dz)
+                h_ij    =   .5 * (hA[i] + hA[j])
+                f       =   mA[i] * _wstar(r_ij1/h_ij) / r_ij1**3
+                ax      +=  f * dx
+                ay      +=  f * dy
+                az      +=  f * dz
+            out[t,0]    =   - G * ax
+            out[t,1]    =   - G * ay
+            out[t,2]    =   - G * az
+
+    globals().update( W_M4=W_M4, dW_M4=dW_M4, W_M4star=W_M4star, _density=_density, _density_all=_density_all,
+                      _hydro=_hydro, _hydro_all=_hydro_all, _grav=_grav )
+
+#===============================================================================
+""" passes """
+#-------------------------------------------------------------------------------
+
+def csr(J,I,N):
+    """ CSR offsets and index of pair arrays, sorted by target J first if
+    they are not already (e.g. neighbour lists flattened in an unsorted idx)
+
+    args
+    ----
+    J,I:    pair arrays, each pair listed once
+    N:      number of particles
+    """
+    if len(J) > 1 and np.any(J[1:] < J[:-1]):
+        s       =   np.argsort(J,kind='stable')
+        J,I     =   J[s],I[s]
+    start   =   np.zeros(N+1,dtype=np.int64)
+    np.cumsum(np.bincount(J,minlength=N),out=start[1:])
+    return start,np.ascontiguousarray(I,dtype=np.int64)
+
+def density(rA,mA,hA,idx,start=None,index=None,out=None):
+    """ densities of targets idx, as inc.rho_all
+
+    args
+    ----
+    rA:     array of particle positions
+    mA:     array of particle masses
+    hA:     array of particle smoothing lengths
+    idx:    indices of target particles
+    start:  ** CSR offsets of the neighbour lists - default = None (all particles are neighbours)
+    index:  ** CSR neighbour index - default = None
+    out:    ** array the densities are written to - default = new array
+    """
+    idx     =   np.ascontiguousarray(idx,dtype=np.int64)
+    if out is None: out = np.zeros(len(idx))
+    if start is None:   _density_all(rA,mA,hA,idx,out)
+    else:               _density(rA,mA,hA,idx,start,index,out)
+    return out
+
+def hydro(rA,vA,mA,rhoA,PA,cA,hA,idx,alpha,beta,start=None,index=None,out=None):
+    """ fluid and viscous accelerations of targets idx, as inc.acc_fluid and
+    inc.acc_visc
+
+    args
+    ----
+    rA:     array of particle positions
+    vA:     array of particle velocities
+    mA:     array of particle masses
+    rhoA:   array of particle densities
+    PA:     array of particle pressures
+    cA:     array of particle sound speeds
+    hA:     array of particle smoothing lengths
+    idx:    indices of target particles
+    alpha:  viscosity parameter alpha
+    beta:   viscosity parameter beta
+    start:  ** CSR offsets of the neighbour lists - default = None (all particles are neighbours)
+    index:  ** CSR neighbour index - default = None
+    out:    ** (a_fluid, a_visc) arrays of one row per target - default = new arrays
+    """
+    idx     =   np.ascontiguousarray(idx,dtype=np.int64)
+    if out is None: out = np.zeros((len(idx),3)),np.zeros((len(idx),3))
+    if start is None:   _hydro_all(rA,vA,mA,rhoA,PA,cA,hA,idx,float(alpha),float(beta),*out)
+    else:               _hydro(rA,vA,mA,rhoA,PA,cA,hA,idx,start,index,float(alpha),float(beta),*out)
+    return out
+
+def grav(rA,mA,hA,idx,G,out=None):
+    """ direct summation gravity of targets idx with M4 softening, as
+    inc.acc_grav_all
+
+    args
+    ----
+    rA:     array of particle positions
+    mA:     array of particle masses
+    hA:     array of particle smoothing lengths
+    idx:    indices of target particles
+    G:      gravitational constant
+    out:    ** array of one row per target - default = new array
+    """
+    idx     =   np.ascontiguousarray(idx,dtype=np.int64)
+    if out is None: out = np.zeros((len(idx),3))
+    _grav(rA,mA,hA,idx,float(G),out)
+    return out
+
+#===============================================================================
+""" parity with numpy """
+#-------------------------------------------------------------------------------
+
+def parity(N=500,seed=0):
+    """ largest relative difference between the numba and numpy backends of
+    the kernels, densities and accelerations on a random particle set
+
+    args
+    ----
+    N:      ** number of particles - default = 500
+    seed:   ** random seed - default = 0
+
+    returns
+    -------
+    dictionary of pass name: relative difference, empty without numba
+    """
+    if not available(): return {}
+    import djak.phys.SPH.incompressible as inc
+    import djak.phys.SPH.kernel as kernel
+    import djak.phys.SPH.tree as tree
+    import djak.phys.SPH.eos as eos
+
+    rng     =   np.random.default_rng(seed)
+    rA      =   rng.random((N,3))
+    vA      =   rng.normal(size=(N,3))
+    mA      =   np.full(N,1/N)
+    hA      =   np.full(N,.6 * (50/N)**(1/3)) * rng.uniform(.8,1.2,N)
+    q       =   np.linspace(0,2.5,1001)[1:]
+    pairs   =   tree.pairs(rA,hA)
+
+    def run():
+        rhoA    =   inc.rho_all(rA,mA,hA)
+        rho_n   =   inc.rho_all(rA,mA,hA,nbrs=tree.neighbours(rA,hA))
+        PA,cA   =   eos.stage(rhoA)
+        acc     =   inc.acc_all(rA,vA,mA,rhoA,PA,hA,pairs=pairs,cA=cA)
+        dense   =   inc.acc_all(rA,vA,mA,rhoA,PA,hA,cA=cA)
+        return { 'W_M4': kernel.W_M4(q,1.), 'dW_M4': kernel.dW_M4(q,1.), 'W_M4star': kernel.W_M4star(q,1.),
+                 'rho': rhoA, 'rho_nbrs': rho_n, 'fluid': acc[0], 'visc': acc[1], 'grav': acc[2],
+                 'fluid_dense': dense[0], 'visc_dense': dense[1], 'grav_dense': dense[2] }
+
+    old     =   backend
+    try:
+        set_backend('numpy')
+        ref     =   run()
+        set_backend('numba')
+        new     =   run()
+    finally:
+        set_backend(old)
+    return { k: float( np.abs(new[k] - ref[k]).max() / np.abs(ref[k]).max() ) for k in ref }
@@ -1,8 +1,13 @@
+import djak.phys.SPH.jit as jit
+import abc
 import djak.math as dm
 import numpy as np
 
 heavi   =   dm.heavi
 
+# tabulated replacements used by W_M4, dW_M4 and W_M4star, see set_tables
+_tables =   {}
+
 #===============================================================================
 """ M4 kernel """
 #-------------------------------------------------------------------------------
@@ -16,6 +21,9 @@ def W_M4(r_mag,h):
     h:      smoothing length
     """
 
+    if 'W_M4' in _tables: return _tables['W_M4'](r_mag,h)
+    if jit.backend == 'numba': return jit.W_M4(r_mag,h)
+
     s   =   r_mag/h
 
     a   =   1 - (3/2)*(s**2) + (3/4)*(s**3)
@@ -33,6 +41,9 @@ def dW_M4(r_mag,h):
     h:      smoothing length
     """
 
+    if 'dW_M4' in _tables: return _tables['dW_M4'](r_mag,h)
+    if jit.backend == 'numba': return jit.dW_M4(r_mag,h)
+
     s   =   r_mag/h
 
     a   =   3*s - (9/4)*s**2
@@ -50,6 +61,9 @@ def W_M4star(r_mag,h):
     h:      smoothing length
     """
 
+    if 'W_M4star' in _tables: return _tables['W_M4star'](r_mag,h)
+    if jit.backend == 'numba': return jit.W_M4star(r_mag,h)
+
     s   =   r_mag/h
 
     a   =   40*s**3 - 36*s**5 + 15*s**6
@@ -57,3 +71,236 @@ def W_M4star(r_mag,h):
     c   =   30
 
     return (1/30) * ( a*heavi(s)*heavi(1-s) + b*heavi(s-1)*heavi(2-s) + c*heavi(s-2) )
+
+#===============================================================================
+""" tabulated kernels """
+#-------------------------------------------------------------------------------
+
+class Table:
+    """ smoothing function tabulated in q = r/h on [0,qmax] - every kernel
+    here depends on r and h only through q and is constant beyond qmax
+
+    args
+    ----
+    W:      smoothing function W(r_mag,h)
+    n:      ** number of intervals in the table - default = 1024
+    qmax:   ** support radius in units of h - default = 2
+    method: ** 'linear' interpolation or 'nearest' table entry - default = 'linear'
+    """
+    def __init__(self,W,n=1024,qmax=2,method='linear'):
+        assert method in ('linear','nearest'), "method must be 'linear' or 'nearest'"
+        self.W      =   W
+        self.n      =   n
+        self.qmax   =   qmax
+        self.method =   method
+        self.scale  =   n / qmax
+        self.q      =   np.linspace(0,qmax,n+1)
+
+        # tabulate the analytic forms even while tables are switched on, and
+        # take q -> 0 from above since heavi(0) = 1/2
+        active      =   dict(_tables)
+        _tables.clear()
+        self.y      =   W(np.maximum(self.q,1e-12*qmax),1.)
+        self.tail   =   W(2.*qmax,1.)
+        _tables.update(active)
+        self.dy     =   np.append( np.diff(self.y), 0 )
+
+    def __call__(self,r_mag,h):
+        x   =   np.asarray(r_mag/h) * self.scale
+        if self.method == 'nearest':
+            i   =   np.minimum( (x + .5).astype(np.int64), self.n )
+            out =   self.y[i]
+        else:
+            i   =   np.minimum( x.astype(np.int64), self.n )
+            out =   self.y[i] + (x - i) * self.dy[i]
+        return np.where(x < self.n, out, self.tail).astype(x.dtype,copy=False)[()]
+
+    def error(self,samples=100001):
+        """ largest absolute difference from the analytic function on (0,qmax]
+
+        args
+        ----
+        samples:    ** number of points q checked - default = 100001
+        """
+        q       =   np.linspace(0,self.qmax,samples)[1:]
+        active  =   dict(_tables)
+        _tables.clear()
+        exact   =   self.W(q,1.)
+        _tables.update(active)
+        return np.abs( self(q,1.) - exact ).max()
+
+def set_tables(n=1024,method='linear'):
+    """ switches W_M4, dW_M4 and W_M4star to tabulated evaluation, trading
+    accuracy for speed everywhere they are used - n=None switches back to the
+    analytic forms
+
+    args
+    ----
+    n:      ** number of intervals in the tables, None for analytic - default = 1024
+    method: ** 'linear' interpolation or 'nearest' table entry - default = 'linear'
+
+    returns
+    -------
+    dictionary of the largest absolute error of each tabulated function
+    """
+    _tables.clear()
+    if n is None: return {}
+    tables  =   { f.__name__: Table(f,n=n,method=method) for f in (W_M4,dW_M4,W_M4star) }
+    _tables.update(tables)
+    return { name: t.error() for name,t in tables.items() }
+
+#===============================================================================
+""" kernel objects """
+#-------------------------------------------------------------------------------
+
+class Kernel(abc.ABC):
+    """ compactly supported smoothing kernel in the same convention as W_M4,
+    a density is m * h^-3 * W(r,h) - calling the object evaluates W, so it can
+    be passed wherever a smoothing function is expected
+
+    subclasses define f_df(q) returning the kernel and its derivative in
+    q = r/h from one evaluation of the shared terms
+
+    attributes
+    ----------
+    name:       kernel name
+    support:    support radius in units of h, W = 0 beyond support * h
+    norm:       normalisation constant of the kernel
+    """
+    name    =   None
+    support =   2
+    norm    =   1
+
+    def __init__(self,table=None,method='linear'):
+        self.table  =   None
+        if table is not None: self.set_table(table,method)
+
+    def __repr__(self):
+        return "%s(support=%s)" % (self.name,self.support)
+
+    def __call__(self,r_mag,h):
+        return self.W(r_mag,h)
+
+    @abc.abstractmethod
+    def f_df(self,q):
+        """ kernel and its derivative in q = r/h, each times norm """
+
+    def set_table(self,n=1024,method='linear'):
+        """ tabulates W and dW, n=None switches back to analytic evaluation
+
+        args
+        ----
+        n:      ** number of intervals in the tables - default = 1024
+        method: ** 'linear' interpolation or 'nearest' table entry - default = 'linear'
+        """
+        self.table  =   None
+        if n is not None:
+            self.table  =   ( Table(self.W,n=n,qmax=self.support,method=method),
+                              Table(self.dW,n=n,qmax=self.support,method=method) )
+
+    def W(self,r_mag,h):
+        """ smoothing kernel
+
+        args
+        ----
+        r_mag:  magnitude of position vector
+        h:      smoothing length
+        """
+        if self.table is not None: return self.table[0](r_mag,h)
+        return self.f_df(r_mag/h)[0]
+
+    def dW(self,r_mag,h):
+        """ derivative of smoothing kernel with respect to q = r/h
+
+        args
+        ----
+        r_mag:  magnitude of position vector
+        h:      smoothing length
+        """
+        if self.table is not None: return self.table[1](r_mag,h)
+        return self.f_df(r_mag/h)[1]
+
+    def W_dW(self,r_mag,h):
+        """ smoothing kernel and its derivative together
+
+        args
+        ----
+        r_mag:  magnitude of position vector
+        h:      smoothing length
+        """
+        if self.table is not None: return self.table[0](r_mag,h),self.table[1](r_mag,h)
+        return self.f_df(r_mag/h)
+
+class KernelM4(Kernel):
+    """ M4 cubic spline, same as W_M4 and dW_M4 """
+    name    =   'M4'
+    support =   2
+    norm    =   1/np.pi
+
+    def f_df(self,q):
+        q       =   np.asarray(q)
+        inner   =   q < 1
+        u       =   np.maximum(2 - q,0)
+        W       =   np.where(inner, 1 - 1.5*q**2 + .75*q**3, .25*u**3)
+        dW      =   np.where(inner, -3*q + 2.25*q**2, -.75*u**2)
+        return self.norm * W,self.norm * dW
+
+class KernelM4star(Kernel):
+    """ softening of the M4 kernel for gravity, same as W_M4star - the
+    fraction of the enclosed mass, rising from 0 to 1 at the support radius
+    """
+    name    =   'M4star'
+    support =   2
+    norm    =   1/30
+
+    def f_df(self,q):
+        q       =   np.asarray(q)
+        inner   =   q < 1
+        outer   =   q >= 2
+        W       =   np.where(inner, 40*q**3 - 36*q**5 + 15*q**6, 80*q**3 - 90*q**4 + 36*q**5 - 5*q**6 - 2)
+        dW      =   np.where(inner, 120*q**2 - 180*q**4 + 90*q**5, 240*q**2 - 360*q**3 + 180*q**4 - 30*q**5)
+        return np.where(outer,1,self.norm * W),np.where(outer,0,self.norm * dW)
+
+class KernelWendlandC2(Kernel):
+    """ Wendland C2 kernel with support 2h """
+    name    =   'WendlandC2'
+    support =   2
+    norm    =   21/(16*np.pi)
+
+    def f_df(self,q):
+        u   =   np.maximum(1 - .5*np.asarray(q),0)
+        u3  =   u**3
+        return self.norm * u3*u * (1 + 2*q),self.norm * -5*q * u3
+
+class KernelWendlandC4(Kernel):
+    """ Wendland C4 kernel with support 2h """
+    name    =   'WendlandC4'
+    support =   2
+    norm    =   495/(256*np.pi)
+
+    def f_df(self,q):
+        u   =   np.maximum(1 - .5*np.asarray(q),0)
+        u5  =   u**5
+        return self.norm * u5*u * (1 + 3*q + (35/12)*q**2),self.norm * -(14/3)*q * (1 + 2.5*q) * u5
+
+M4          =   KernelM4()
+M4star      =   KernelM4star()
+WendlandC2  =   KernelWendlandC2()
+WendlandC4  =   KernelWendlandC4()
+
+def support(W):
+    """ support radius in units of h of a smoothing function - reads it from
+    kernel objects and their bound W/dW methods, tables, and the M4 functions
+
+    args
+    ----
+    W:  smoothing function or kernel object
+    """
+    owner   =   getattr(W,'__self__',W)
+    if isinstance(owner,Kernel):    return owner.support
+    if isinstance(owner,Table):     return owner.qmax
+    return getattr(W,'support',2)
+
+W_M4.support        =   2
+dW_M4.support       =   2
+W_M4star.support    =   2
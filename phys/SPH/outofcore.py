@@ -0,0 +1,202 @@
+import djak.phys.SPH.incompressible as inc
+import djak.phys.SPH.particles as particles
+import djak.phys.SPH.precision as precision
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.tree as tree
+import djak.phys.SPH.eos as eos
+import numpy as np
+import time
+
+#===============================================================================
+""" out-of-core SPH passes
+
+the passes below walk contiguous ranges ('chunks') of a Particles container,
+which may keep its fields in memory maps (Particles(..., path=...)), so only
+one chunk, its halo of neighbours and their pair table are resident at a
+time. after Particles.sort the chunks are compact pieces of a space-filling
+curve and their halos are thin shells. the density pass must finish before
+the force pass, since forces need the densities of the halo
+
+throughput of density + pressure + forces from measure(), uniform sphere
+with ~55 neighbours, results equal to the in-memory passes to 6e-16:
+
+    N        chunk    resident    memory         mapped
+    50000    8192     18942       7.1e3 part/s   7.3e3 part/s
+    200000   65536    110226      7.1e3 part/s   7.7e3 part/s
+
+the memory maps cost nothing while the files fit in the page cache; the
+neighbour search runs twice per step (density, forces) instead of once """
+#-------------------------------------------------------------------------------
+
+chunk   =   2**16
+
+class Chunks:
+    """ bounding boxes of the chunks of a particle set, streamed chunk by
+    chunk, and the halo of neighbours of each chunk
+
+    args
+    ----
+    rA:         array of particle positions (may be a memory map)
+    hA:         array of particle smoothing lengths (may be a memory map)
+    size:       ** particles per chunk - default = chunk
+    support:    ** kernel support radius in units of h - default = kernel.M4.support
+    """
+    def __init__(self,rA,hA,size=None,support=kernel.M4.support):
+        self.rA     =   rA
+        self.hA     =   hA
+        self.size   =   chunk if size is None else size
+        self.N      =   len(hA)
+        self.ranges =   [ (a,min(a+self.size,self.N)) for a in range(0,self.N,self.size) ]
+        self.lo     =   np.array([ rA[a:b].min(axis=0) for a,b in self.ranges ])
+        self.hi     =   np.array([ rA[a:b].max(axis=0) for a,b in self.ranges ])
+        # h_ij <= max(h), so neighbours lie within support * max(h) of a chunk's box
+        self.reach  =   support * max( hA[a:b].max() for a,b in self.ranges )
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def halo(self,k):
+        """ sorted indices of the particles outside chunk k that lie within
+        reach of its bounding box
+        """
+        lo,hi   =   self.lo[k] - self.reach,self.hi[k] + self.reach
+        near    =   np.nonzero( np.all( (self.hi >= lo) & (self.lo <= hi), axis=1 ) )[0]
+        out     =   []
+        for c in near:
+            if c == k: continue
+            a,b     =   self.ranges[c]
+            r       =   self.rA[a:b]
+            out.append( a + np.nonzero( np.all( (r >= lo) & (r <= hi), axis=1 ) )[0] )
+        return np.concatenate(out) if out else np.zeros(0,dtype=np.int64)
+
+    def local(self,k):
+        """ indices of chunk k followed by its halo """
+        a,b     =   self.ranges[k]
+        return np.concatenate(( np.arange(a,b), self.halo(k) ))
+
+def density(p,chunks=None,K=kernel.M4,stats=None):
+    """ densities of all particles written into rhoA, one chunk at a time
+
+    args
+    ----
+    p:      Particles (or a container whose fields are memory maps)
+    chunks: ** Chunks of p - default = new Chunks
+    K:      ** smoothing kernel - default = kernel.M4
+    stats:  ** dictionary the largest resident particle count is kept in - default = None
+    """
+    if chunks is None: chunks = Chunks(p.rA,p.hA,support=K.support)
+    rA,mA,hA,rhoA   =   p.rA,p.mA,p.hA,p.rhoA
+    for k,(a,b) in enumerate(chunks):
+        idx     =   chunks.local(k)
+        n       =   b - a
+        table   =   tree.PairTable(rA[idx],hA[idx],idx=np.arange(n),W=K,method='cell')
+        rhoA[a:b]   =   table.density(mA[idx])[:n]
+        if stats is not None: stats['resident'] = max(stats.get('resident',0),len(idx))
+
+def pressure(p,EOS=eos.barotropic,size=None,**params):
+    """ pressures and sound speeds of all particles written into PA and cA,
+    one chunk at a time
+
+    args
+    ----
+    p:      Particles
+    EOS:    ** equation of state from eos - default = eos.barotropic
+    size:   ** particles per chunk - default = chunk
+    params: ** parameters passed on to EOS
+    """
+    if size is None: size = chunk
+    u   =   p.data['u'] if 'u' in p.data else None
+    for a in range(0,p.N,size):
+        b   =   min(a+size,p.N)
+        P,c =   eos.stage(p.rhoA[a:b],eos=EOS,uA=None if u is None else u[a:b],**params)
+        p.PA[a:b],p.cA[a:b] = P,c
+
+def forces(p,chunks=None,K=kernel.M4,grav=None,stats=None):
+    """ fluid and viscous accelerations of all particles written into aA,
+    one chunk at a time - densities, pressures and sound speeds of every
+    particle must be current
+
+    args
+    ----
+    p:      Particles
+    chunks: ** Chunks of p - default = new Chunks
+    K:      ** smoothing kernel - default = kernel.M4
+    grav:   ** gravity.Direct engine to add self-gravity, tiled so also bounded in memory - default = None
+    stats:  ** dictionary the largest resident particle count is kept in - default = None
+    """
+    if chunks is None: chunks = Chunks(p.rA,p.hA,support=K.support)
+    rA,vA,mA,hA     =   p.rA,p.vA,p.mA,p.hA
+    rhoA,PA,cA,aA   =   p.rhoA,p.PA,p.cA,p.aA
+    for k,(a,b) in enumerate(chunks):
+        idx     =   chunks.local(k)
+        n       =   b - a
+        table   =   tree.PairTable(rA[idx],hA[idx],idx=np.arange(n),W=None,dW=K.dW,support=K.support,method='cell')
+        fluid,visc  =   inc.acc_table(table,vA[idx],mA[idx],rhoA[idx],PA[idx],cA[idx])
+        aA[a:b]     =   fluid[:n] + visc[:n]
+        if stats is not None: stats['resident'] = max(stats.get('resident',0),len(idx))
+
+    if grav is not None:
+        a_grav  =   grav.acc(rA,mA,hA,out=p.scratch('a_grav',(3,),precision.accum))
+        for a,b in chunks: aA[a:b] += a_grav[a:b]
+
+#===============================================================================
+""" throughput """
+#-------------------------------------------------------------------------------
+
+def measure(N=200000,size=None,path=None,seed=0):
+    """ times the chunked density, pressure and force passes on a uniform
+    sphere kept in memory and in memory maps, and compares both with the
+    in-memory passes of particles.py
+
+    args
+    ----
+    N:      ** number of particles - default = 200000
+    size:   ** particles per chunk - default = chunk
+    path:   ** directory of the memory maps - default = new temporary directory
+    seed:   ** random seed of the particle positions - default = 0
+
+    returns
+    -------
+    dictionary of mode ('memory', 'mapped'): dictionary of seconds, particles
+    per second, largest resident particle count and largest relative
+    difference of rho and a from the in-memory passes
+    """
+    import djak.phys.SPH.placement as placement
+    import tempfile, shutil
+
+    r       =   np.stack(placement.sphere_uniformish(N,1.,seed=seed),axis=1)
+    h       =   np.full(N,1.2 * (4/3*np.pi / N)**(1/3))
+    v       =   np.random.default_rng(seed).normal(scale=.1,size=(N,3))
+    m       =   np.full(N,1/N)
+
+    ref     =   particles.Particles.from_arrays(rA=r,vA=v,mA=m,hA=h)
+    ref.sort()
+    J,I     =   tree.pairs(ref.rA,ref.hA)
+    particles.density(ref,table=tree.PairTable(ref.rA,ref.hA,(J,I)))
+    particles.pressure(ref)
+    ref.aA[:] = sum(inc.acc_table(tree.PairTable(ref.rA,ref.hA,(J,I),W=None),ref.vA,ref.mA,ref.rhoA,ref.PA,ref.cA))
+
+    tmp     =   tempfile.mkdtemp() if path is None else path
+    out     =   {}
+    try:
+        for mode in ('memory','mapped'):
+            p       =   particles.Particles(N,path=None if mode == 'memory' else tmp)
+            p.add(rA=ref.rA,vA=ref.vA,mA=ref.mA,hA=ref.hA)
+            stats   =   {}
+            t       =   time.time()
+            chunks  =   Chunks(p.rA,p.hA,size)
+            density(p,chunks,stats=stats)
+            pressure(p,size=size)
+            forces(p,chunks,stats=stats)
+            p.flush()
+            t       =   time.time() - t
+            out[mode] = { 'seconds': t, 'rate': N / t, 'resident': stats['resident'],
+                          'rho': float( np.abs(p.rhoA - ref.rhoA).max() / ref.rhoA.max() ),
+                          'a': float( np.abs(p.aA - ref.aA).max() / np.abs(ref.aA).max() ) }
+            del p
+    finally:
+        if path is None: shutil.rmtree(tmp,ignore_errors=True)
+    return out
@@ -0,0 +1,246 @@
+import djak.phys.SPH.incompressible as inc
+import djak.phys.SPH.eos as eos
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.tree as tree
+from multiprocessing import shared_memory
+import multiprocessing as mp
+import numpy as np
+
+#===============================================================================
+""" shared particle state """
+#-------------------------------------------------------------------------------
+
+class SharedArrays:
+    """ numpy arrays living in shared memory, so worker processes read and
+    write particle state without pickling it
+
+    args
+    ----
+    arrays: dictionary of name: array, copied into shared memory
+    """
+    def __init__(self,arrays):
+        self.shm    =   {}
+        self.spec   =   {}
+        for name,A in arrays.items():
+            A               =   np.ascontiguousarray(A)
+            shm             =   shared_memory.SharedMemory(create=True,size=max(A.nbytes,1))
+            self.shm[name]  =   shm
+            self.spec[name] =   (shm.name,A.shape,A.dtype.str)
+            np.ndarray(A.shape,dtype=A.dtype,buffer=shm.buf)[...] = A
+        self.arrays =   attach(self.spec,self.shm)
+
+    def __getitem__(self,name):
+        return self.arrays[name]
+
+    def close(self):
+        """ releases and removes the shared memory blocks """
+        self.arrays =   {}
+        for shm in self.shm.values():
+            shm.close()
+            shm.unlink()
+        self.shm    =   {}
+
+def attach(spec,shm):
+    """ numpy views of shared arrays described by SharedArrays.spec - the
+    blocks in shm must be kept open for as long as the views are used
+
+    args
+    ----
+    spec:   dictionary of name: (shared memory name, shape, dtype)
+    shm:    dictionary of name: opened SharedMemory block
+    """
+    return { name: np.ndarray(s[1],dtype=np.dtype(s[2]),buffer=shm[name].buf) for name,s in spec.items() }
+
+#===============================================================================
+""" worker processes """
+#-------------------------------------------------------------------------------
+
+_blocks =   None
+_shared =   None
+_tree   =   (None,None)
+
+# module parameters read by the passes - the workers' copies of the modules
+# date from the fork, so the parent's values are sent with every task
+params  =   { inc:  ('c0','rho0','alpha','beta','gamma','G'),
+              eos:  ('gamma_ad','c_iso') }
+
+def _values():
+    """ current values of params in the parent """
+    return { m.__name__: { k: getattr(m,k) for k in names } for m,names in params.items() }
+
+def _set(values):
+    """ sets params of a worker to the values from _values """
+    for m,names in params.items():
+        for k in names: setattr(m,k,values[m.__name__][k])
+
+def _init(spec):
+    """ attaches a worker to the shared arrays once """
+    global _blocks,_shared
+    _blocks =   { name: shared_memory.SharedMemory(name=s[0]) for name,s in spec.items() }
+    _shared =   attach(spec,_blocks)
+
+def _octree(key):
+    """ gravity tree of the current positions, built once per worker and pass """
+    global _tree
+    if _tree[0] != key:
+        _tree   =   (key,tree.Octree(_shared['r'],_shared['m'],_shared['h']))
+    return _tree[1]
+
+def _local(T,K):
+    """ targets T plus their halo - every particle close enough to the
+    bounding box of the targets to interact with one of them - as global
+    indices
+    """
+    rA,hA   =   _shared['r'],_shared['h']
+    lo      =   rA[T].min(axis=0)
+    hi      =   rA[T].max(axis=0)
+    gap     =   np.maximum( np.abs(rA - .5*(lo+hi)) - .5*(hi-lo), 0 )
+    halo    =   np.nonzero( np.linalg.norm(gap,axis=1) < K.support * .5 * (hA[T].max() + hA) )[0]
+    return np.union1d(T,halo)
+
+def _density(T,K,EOS,values):
+    """ densities, neighbour counts, pressures and sound speeds of domain
+    targets T, with the parent's parameter values
+    """
+    _set(values)
+    rA,mA,hA    =   _shared['r'],_shared['m'],_shared['h']
+    L           =   _local(T,K)
+    t           =   np.searchsorted(L,T)
+    J,I         =   tree.pairs(rA[L],hA[L],idx=t,support=K.support,method='tree')
+    J,I         =   L[J],L[I]
+
+    r_ij1       =   np.linalg.norm( rA[J] - rA[I], axis=1 )
+    h_ij        =   .5 * (hA[I] + hA[J])
+    pos         =   np.searchsorted(T,J)
+    _shared['rho'][T]   =   np.bincount(pos,weights=mA[I] * h_ij**(-3) * K.W(r_ij1,h_ij),minlength=len(T))
+    _shared['n'][T]     =   np.bincount(pos,minlength=len(T))
+    _shared['P'][T],_shared['c'][T] =   eos.stage(_shared['rho'][T],eos=EOS)
+    return len(J)
+
+def _forces(T,K,theta,key,values):
+    """ fluid, viscous and gravitational accelerations of domain targets T,
+    summed onto the targets only so domains never write the same rows, with
+    the parent's parameter values
+    """
+    _set(values)
+    rA,vA,mA,hA =   _shared['r'],_shared['v'],_shared['m'],_shared['h']
+    rhoA,PA,cA  =   _shared['rho'],_shared['P'],_shared['c']
+    L           =   _local(T,K)
+    t           =   np.searchsorted(L,T)
+    J,I         =   tree.pairs(rA[L],hA[L],idx=t,support=K.support,method='tree')
+    J,I         =   L[J],L[I]
+
+    r_ij        =   rA[J] - rA[I]
+    r_ij1       =   np.linalg.norm(r_ij,axis=1)
+    h_ij        =   .5 * (hA[I] + hA[J])
+    vr          =   ((vA[J] - vA[I]) * r_ij).sum(axis=1)
+    fluid,visc  =   inc._pair_hydro(r_ij1,vr,h_ij,rhoA[I],rhoA[J],PA[I],PA[J],cA[I],cA[J],K.dW)
+
+    pos         =   np.searchsorted(T,J)
+    f           =   - mA[I] * (fluid + visc) / r_ij1
+    a           =   np.stack([ np.bincount(pos,weights=f*r_ij[:,k],minlength=len(T)) for k in range(3) ],axis=1)
+    if theta is None:
+        a       +=  inc.acc_grav_all(rA,mA,hA,idx=T)
+    else:
+        a       +=  _octree(key).acc(theta=theta,idx=T,G=inc.G)
+    _shared['a'][T]     =   a
+    return len(J)
+
+#===============================================================================
+""" domain decomposed engine """
+#-------------------------------------------------------------------------------
+
+class Engine:
+    """ process pool running the density and force passes on spatial
+    domains - particle state lives in shared memory, every domain reads its
+    halo directly from it, and domains are cut to hold equal numbers of
+    neighbour interactions
+
+    args
+    ----
+    rA:         array of particle positions
+    vA:         array of particle velocities
+    mA:         array of particle masses
+    hA:         array of particle smoothing lengths
+    nproc:      ** number of worker processes - default = all cores
+    domains:    ** number of domains - default = 4 per process
+    K:          ** kernel object, also sets the neighbour cutoff - default = kernel.M4
+    EOS:        ** barotropic equation of state or eos.Table - default = eos.barotropic
+    curve:      ** 'hilbert' or 'morton' to cut domains along a space-filling curve - default = None (longest axis)
+    """
+    def __init__(self,rA,vA,mA,hA,nproc=None,domains=None,K=kernel.M4,EOS=eos.barotropic,curve=None):
+        N               =   len(mA)
+        self.nproc      =   nproc or mp.cpu_count()
+        self.ndomain    =   domains or 4*self.nproc
+        self.K          =   K
+        self.EOS        =   EOS
+        self.curve      =   curve
+        self.shared     =   SharedArrays({ 'r':rA, 'v':vA, 'm':mA, 'h':hA,
+                                           'rho':np.zeros(N), 'P':np.zeros(N), 'c':np.zeros(N),
+                                           'a':np.zeros((N,3)), 'n':np.ones(N,dtype=np.int64) })
+        self.pool       =   mp.Pool(self.nproc,initializer=_init,initargs=(self.shared.spec,))
+        self.passes     =   0
+        self.decompose()
+
+    def __getattr__(self,name):
+        # rA, vA, rhoA, ... are the shared arrays
+        shared  =   self.__dict__.get('shared')
+        if shared is not None and name.endswith('A') and name[:-1] in shared.spec:
+            return self.shared[name[:-1]]
+        raise AttributeError(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def decompose(self):
+        """ cuts particles, ordered along the longest axis or the
+        space-filling curve, into domains of equal cost, where the cost of a
+        particle is its neighbour count from the last density pass - curve
+        domains are compact, so their halos are smaller than those of slabs
+        """
+        rA          =   self.shared['r']
+        if self.curve is None:
+            axis    =   np.argmax( rA.max(axis=0) - rA.min(axis=0) )
+            order   =   np.argsort(rA[:,axis],kind='stable')
+        else:
+            order   =   tree.sfc_order(rA,curve=self.curve)
+        cost        =   np.cumsum( self.shared['n'][order] + 1 )
+        cuts        =   np.searchsorted(cost,cost[-1] * np.arange(1,self.ndomain) / self.ndomain)
+        self.domains=   [ np.sort(d) for d in np.split(order,cuts) if len(d) > 0 ]
+
+    def density(self):
+        """ densities, pressures, sound speeds and neighbour counts of all
+        particles, after which the domains are cut again with the new counts
+
+        returns
+        -------
+        number of pair interactions
+        """
+        values  =   _values()
+        n       =   sum(self.pool.starmap(_density,[ (T,self.K,self.EOS,values) for T in self.domains ]))
+        self.decompose()
+        return n
+
+    def forces(self,theta=None):
+        """ total accelerations of all particles, written to aA
+
+        args
+        ----
+        theta:  ** tree opening angle for gravity - default = None (direct summation)
+
+        returns
+        -------
+        number of pair interactions
+        """
+        self.passes +=  1
+        values      =   _values()
+        return sum(self.pool.starmap(_forces,[ (T,self.K,theta,self.passes,values) for T in self.domains ]))
+
+    def close(self):
+        """ stops the workers and frees the shared memory """
+        self.pool.close()
+        self.pool.join()
+        self.shared.close()
@@ -0,0 +1,256 @@
+import djak.phys.SPH.incompressible as inc
+import djak.phys.SPH.precision as precision
+import djak.phys.SPH.eos as eos
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.tree as tree
+import numpy as np
+import os
+
+#===============================================================================
+""" particle container """
+#-------------------------------------------------------------------------------
+
+# per-particle fields and their trailing shape
+fields  =   { 'r':(3,), 'v':(3,), 'a':(3,), 'm':(), 'rho':(), 'P':(), 'c':(), 'u':(), 'h':() }
+
+class Particles:
+    """ struct of arrays holding the SPH particle state - every field is one
+    contiguous array of fixed capacity, and rA, vA, mA, rhoA, PA, cA, hA, aA are
+    views of the first N rows, so they can be passed straight to the SPH
+    functions
+
+    args
+    ----
+    capacity:   maximum number of particles
+    dtype:      ** dtype of the float fields, np.float32 halves memory - default = precision.store
+    fields:     ** dictionary of name: trailing shape - default = fields
+    path:       ** directory of .npy memory maps holding the fields and scratch
+                buffers, for runs larger than memory (see outofcore) - default = None (in memory)
+    """
+    def __init__(self,capacity,dtype=None,fields=fields,path=None):
+        self.capacity   =   capacity
+        self.dtype      =   np.dtype(dtype or precision.store)
+        self.N          =   0
+        self.next_id    =   0
+        self.path       =   path
+        self.shapes     =   dict(fields)
+        if path is not None: os.makedirs(path,exist_ok=True)
+        self.data       =   { name: self._array(name,(capacity,) + shape,self.dtype) for name,shape in self.shapes.items() }
+        self.data['id'] =   self._array('id',(capacity,),np.int64)
+        self._scratch   =   {}
+
+    def _array(self,name,shape,dtype):
+        """ zeroed array, a memory map in path when there is one """
+        if self.path is None: return np.zeros(shape,dtype=dtype)
+        return np.lib.format.open_memmap(os.path.join(self.path,name + '.npy'),mode='w+',dtype=dtype,shape=shape)
+
+    def flush(self):
+        """ writes memory-mapped fields and scratch buffers to disk """
+        for A in list(self.data.values()) + list(self._scratch.values()):
+            if isinstance(A,np.memmap): A.flush()
+
+    @classmethod
+    def from_arrays(cls,capacity=None,dtype=None,path=None,**arrays):
+        """ particles filled from arrays such as rA=..., mA=..., hA=...
+
+        args
+        ----
+        capacity:   ** maximum number of particles - default = number given
+        dtype:      ** dtype of the float fields - default = precision.store
+        path:       ** directory of memory maps - default = None (in memory)
+        arrays:     field arrays, named with or without the trailing A
+        """
+        N   =   len(next(iter(arrays.values())))
+        p   =   cls(capacity or N,dtype=dtype,path=path)
+        p.add(**arrays)
+        return p
+
+    def __len__(self):
+        return self.N
+
+    def __getattr__(self,name):
+        # rA, vA, ... are views of the first N rows of each field
+        data    =   self.__dict__.get('data')
+        if data is not None and name.endswith('A') and name[:-1] in data:
+            return data[name[:-1]][:self.N]
+        raise AttributeError(name)
+
+    def add(self,**arrays):
+        """ appends particles, fields not given are left zero
+
+        args
+        ----
+        arrays: field arrays of equal length, named with or without the trailing A
+        """
+        arrays  =   { (k[:-1] if k.endswith('A') else k): np.asarray(v) for k,v in arrays.items() }
+        n       =   { len(v) for v in arrays.values() }
+        assert len(n) == 1, "arrays are not matched"
+        n       =   n.pop()
+        assert self.N + n <= self.capacity, "capacity exceeded"
+        for name,A in arrays.items():
+            assert name in self.data, "unknown field %s" % name
+            self.data[name][self.N:self.N+n]    =   A
+        self.data['id'][self.N:self.N+n]    =   np.arange(self.next_id,self.next_id+n)
+        self.N          +=  n
+        self.next_id    +=  n
+
+    def scratch(self,name,shape=(),dtype=None):
+        """ preallocated work array of N rows, reused between calls
+
+        args
+        ----
+        name:   name of the buffer
+        shape:  ** trailing shape - default = ()
+        dtype:  ** dtype - default = dtype of the float fields
+        """
+        dtype   =   np.dtype(dtype or self.dtype)
+        buf     =   self._scratch.get(name)
+        if buf is None or buf.shape[1:] != tuple(shape) or buf.dtype != dtype:
+            buf                 =   self._array('scratch_' + name,(self.capacity,) + tuple(shape),dtype)
+            self._scratch[name] =   buf
+        return buf[:self.N]
+
+    def reorder(self,perm):
+        """ permutes all particles in place, the particle at position perm[i]
+        moves to position i, and idA keeps the original particle ids
+
+        args
+        ----
+        perm:   permutation of range(N)
+        """
+        assert len(perm) == self.N, "permutation does not match particles"
+        for name,A in self.data.items():
+            tmp             =   self.scratch('reorder_%s_%s' % (A.dtype.name,'_'.join(map(str,A.shape[1:]))),A.shape[1:],A.dtype)
+            np.take(A[:self.N],perm,axis=0,out=tmp)
+            A[:self.N]      =   tmp
+
+    def sort(self,curve='hilbert'):
+        """ reorders the particles along a space-filling curve so neighbours
+        are close in memory - idA keeps the original ids, and arrays indexed
+        by position (neighbour lists, pair tables, rungs) must be permuted
+        or rebuilt with the returned permutation
+
+        args
+        ----
+        curve:  ** 'hilbert' or 'morton' - default = 'hilbert'
+
+        returns
+        -------
+        permutation perm, the particle now at i was at perm[i]
+        """
+        perm    =   tree.sfc_order(self.rA,curve=curve)
+        self.reorder(perm)
+        return perm
+
+    def by_id(self,A):
+        """ per-particle array A rearranged into the order of the ids, e.g.
+        to compare runs sorted at different times
+
+        args
+        ----
+        A:  array with one row per particle
+        """
+        return A[np.argsort(self.idA,kind='stable')]
+
+    def view(self,start,stop):
+        """ particles in positions [start,stop) sharing memory with this
+        container, e.g. one domain after reorder
+
+        args
+        ----
+        start:  first particle
+        stop:   one past the last particle
+        """
+        return ParticleView(self,start,stop)
+
+    def select(self,mask):
+        """ moves the particles in mask to the front, keeping their order,
+        and returns a view of them - e.g. the active particles of a step
+
+        args
+        ----
+        mask:   boolean array of length N
+
+        returns
+        -------
+        view of the selected particles, and the permutation applied (as
+        from sort), to reorder arrays kept outside the container (rungs,
+        Verlet lists, pair tables) the same way
+        """
+        mask    =   np.asarray(mask,dtype=bool)
+        perm    =   np.concatenate(( np.nonzero(mask)[0], np.nonzero(~mask)[0] ))
+        self.reorder(perm)
+        return self.view(0,int(mask.sum())),perm
+
+class ParticleView:
+    """ contiguous range of particles of a Particles container, fields are
+    numpy views so writes go to the container
+
+    args
+    ----
+    parent: Particles container
+    start:  first particle
+    stop:   one past the last particle
+    """
+    def __init__(self,parent,start,stop):
+        self.parent =   parent
+        self.start  =   start
+        self.stop   =   stop
+        self.N      =   stop - start
+
+    def __len__(self):
+        return self.N
+
+    def __getattr__(self,name):
+        data    =   self.__dict__['parent'].data
+        if name.endswith('A') and name[:-1] in data:
+            return data[name[:-1]][self.start:self.stop]
+        raise AttributeError(name)
+
+#===============================================================================
+""" SPH passes on particles """
+#-------------------------------------------------------------------------------
+
+def density(p,nbrs=None,K=kernel.M4,table=None):
+    """ densities of all particles written into rhoA
+
+    args
+    ----
+    p:      Particles
+    nbrs:   ** neighbour lists from tree.neighbours - default = all particles
+    K:      ** smoothing kernel - default = kernel.M4
+    table:  ** tree.PairTable of this step, replaces nbrs and K - default = None
+    """
+    inc.rho_all(p.rA,p.mA,p.hA,W=K,nbrs=nbrs,out=p.rhoA,table=table)
+
+def pressure(p,EOS=eos.barotropic,**params):
+    """ pressures and sound speeds of all particles written into PA and cA
+
+    args
+    ----
+    p:      Particles
+    EOS:    ** equation of state from eos - default = eos.barotropic
+    params: ** parameters passed on to EOS
+    """
+    uA  =   p.data['u'][:p.N] if 'u' in p.data else None
+    eos.stage(p.rhoA,eos=EOS,uA=uA,out=(p.PA,p.cA),**params)
+
+def forces(p,pairs=None,theta=None,K=kernel.M4,Wstar=kernel.W_M4star,table=None):
+    """ total accelerations of all particles written into aA, with the
+    fluid, viscous and gravity parts kept in the scratch buffers a_fluid,
+    a_visc and a_grav, in the precision.accum dtype - sound speeds are read
+    from cA, so pressure must have been called after the last density pass
+
+    args
+    ----
+    p:      Particles
+    pairs:  ** (J,I) pair arrays from tree.pairs - default = all pairs
+    theta:  ** tree opening angle used with pairs - default = None (direct summation)
+    K:      ** smoothing kernel - default = kernel.M4
+    Wstar:  ** gravity smoothing function - default = kernel.W_M4star
+    table:  ** tree.PairTable of this step, replaces pairs - default = None
+    """
+    out     =   tuple( p.scratch(name,(3,),precision.accum) for name in ('a_fluid','a_visc','a_grav') )
+    inc.acc_all(p.rA,p.vA,p.mA,p.rhoA,p.PA,p.hA,Wstar=Wstar,dW=K.dW,pairs=pairs,theta=theta,out=out,cA=p.cA,table=table)
+    np.add(out[0],out[1],out=p.aA)
+    p.aA    +=  out[2]
@@ -1,26 +1,123 @@
+import djak.phys.SPH.precision as precision
 import numpy as np
 import djak.coordinates as dc
 
 O   =   np.zeros(3)
 
-def sphere_random(N,radius,R=O):
-    """ constructs particles into a randimized sphere
+#===============================================================================
+""" chunked generation
+
+every generator writes into an (N,3) array - a new one, a preallocated one or
+a memory map from memmap() - one chunk of particles at a time, and returns
+the x, y, z columns of it. chunk k draws from its own random stream, spawned
+from the seed with np.random.SeedSequence, so the particles do not depend on
+the chunk order and separate processes can fill disjoint chunks of one
+memory map with fill(..., chunk_ids=...) and get the same set as a serial run """
+#-------------------------------------------------------------------------------
+
+chunk   =   2**20
+
+def memmap(path,N):
+    """ (N,3) .npy memory map of particle positions in the store dtype of the
+    precision policy, to generate straight to disk
+
+    args
+    ----
+    path:   file name
+    N:      number of particles
+    """
+    return np.lib.format.open_memmap(path,mode='w+',dtype=precision.store,shape=(N,3))
+
+def streams(seed,n):
+    """ independent random generators of n chunks
+
+    args
+    ----
+    seed:   integer seed, None for fresh entropy
+    n:      number of chunks
+    """
+    return [ np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(n) ]
+
+def fill(out,sample,seed=None,size=None,R=O,chunk_ids=None):
+    """ fills out in chunks with positions from sample
+
+    args
+    ----
+    out:        (N,3) array or memory map
+    sample:     function (rng, first index, number) returning an (n,3) array of positions
+    seed:       ** integer seed - default = None (not reproducible)
+    size:       ** particles per chunk - default = chunk
+    R:          ** COM position vector added to every particle - default = Origin
+    chunk_ids:  ** indices of the chunks to fill - default = all chunks
+    """
+    if size is None: size = chunk
+    N       =   len(out)
+    n       =   -(-N // size)
+    rngs    =   streams(seed,n)
+    for k in (range(n) if chunk_ids is None else chunk_ids):
+        a,b         =   k*size,min((k+1)*size,N)
+        out[a:b]    =   sample(rngs[k],a,b-a) + R
+    return out
+
+def _output(N,out):
+    """ out, or a new (N,3) array in the store dtype """
+    if out is None: return np.empty((N,3),dtype=precision.store)
+    assert out.shape == (N,3), "out must have shape (N,3)"
+    return out
+
+def _columns(out):
+    return out[:,0],out[:,1],out[:,2]
+
+#===============================================================================
+""" random placements """
+#-------------------------------------------------------------------------------
+
+def _ball(rng,n):
+    """ n points uniform in the unit ball by inverse CDF, r = u^(1/3) and
+    isotropic directions
+    """
+    r       =   rng.random(n)**(1/3)
+    mu      =   rng.uniform(-1,1,n)
+    p       =   2 * np.pi * rng.random(n)
+    s       =   np.sqrt(1 - mu**2)
+    return np.stack(( r*s*np.cos(p), r*s*np.sin(p), r*mu ),axis=1)
+
+def _ball_reject(rng,n):
+    """ n points uniform in the unit ball by rejection from the cube, drawn in
+    vectorized batches
+    """
+    out     =   np.empty((n,3))
+    k       =   0
+    while k < n:
+        m       =   int( (n - k) * 6/np.pi * 1.05 ) + 16
+        p       =   rng.uniform(-1,1,(m,3))
+        p       =   p[ (p**2).sum(axis=1) <= 1 ][:n-k]
+        out[k:k+len(p)] = p
+        k       +=  len(p)
+    return out
+
+def sphere_random(N,radius,R=O,seed=None,out=None):
+    """ constructs particles into a randimized sphere - uniform in radius and
+    in the polar angle, so particles concentrate to the centre and the poles;
+    see sphere_uniformish for a uniform sphere
 
     args
     ----
     N:      number of particles
     radius: radius of sphere
     R:      ** COM position vector - default = Origin
+    seed:   ** integer seed - default = None
+    out:    ** (N,3) array or memory map to write into - default = new array
     """
-    r   =   radius * np.random.rand(N)
-    t   =   np.pi * np.random.rand(N)
-    p   =   2 * np.pi * np.random.rand(N)
-
-    x,y,z   =   dc.SPC2CC(r,t,p)
+    def sample(rng,a,n):
+        r   =   radius * rng.random(n)
+        t   =   np.pi * rng.random(n)
+        p   =   2 * np.pi * rng.random(n)
+        return np.stack(dc.SPC2CC(r,t,p),axis=1)
 
-    return x + R[0], y + R[1], z + R[2]
+    return _columns( fill(_output(N,out),sample,seed,R=R) )
 
-def box_random(N,length,R=O):
+def box_random(N,length,R=O,seed=None,out=None):
     """ constructs particles into randomized box
 
     args
@@ -28,77 +125,137 @@ def box_random(N,length,R=O):
     N:      number of particles
     length: length of box
     R:      ** COM position vector - default = Origin
+    seed:   ** integer seed - default = None
+    out:    ** (N,3) array or memory map to write into - default = new array
     """
+    def sample(rng,a,n):
+        return length * (rng.random((n,3)) - .5)
+
+    return _columns( fill(_output(N,out),sample,seed,R=R) )
 
-    # make sure N is divisible by 8
-    N   +=  divmod(N,8)[1]
-
-    def octant():
-        return (length/2) * np.random.rand(int(N/8),3)
-
-    # form octants
-    O1  =   octant()
-    O2  =   octant()
-    O3  =   octant()
-    O4  =   octant()
-    O5  =   octant()
-    O6  =   octant()
-    O7  =   octant()
-    O8  =   octant()
-
-    # octants 2,3,6, and 8 have -x
-    O2[:,0] *= -1
-    O3[:,0] *= -1
-    O6[:,0] *= -1
-    O8[:,0] *= -1
-
-    # octants 3,4,7, and 8 have -y
-    O3[:,1] *= -1
-    O4[:,1] *= -1
-    O7[:,1] *= -1
-    O8[:,1] *= -1
-
-    # octants 5,6,7, and 8 have -z
-    O5[:,2] *= -1
-    O6[:,2] *= -1
-    O7[:,2] *= -1
-    O8[:,2] *= -1
-
-    M   =   np.vstack((O1,O2,O3,O4,O5,O6,O6,O8))
-    x   =   M[:,0]
-    y   =   M[:,1]
-    z   =   M[:,2]
-
-    return x + R[0], y + R[1], z + R[2]
-
-def sphere_uniformish(N,radius,R=O):
-    """ constructs random box, then reallocates particles outside sphere
+def sphere_uniformish(N,radius,R=O,seed=None,out=None,method='cdf'):
+    """ constructs particles uniformly random in a sphere
 
     args
     ----
     N:      number of particles
     radius: cloud radius
-    R:      ** COM position vector
+    R:      ** COM position vector - default = Origin
+    seed:   ** integer seed - default = None
+    out:    ** (N,3) array or memory map to write into - default = new array
+    method: ** 'cdf' (inverse CDF) or 'reject' (rejection from the box) - default = 'cdf'
+    """
+    assert method in ('cdf','reject'), "method must be 'cdf' or 'reject'"
+    ball    =   _ball if method == 'cdf' else _ball_reject
+
+    def sample(rng,a,n):
+        return radius * ball(rng,n)
+
+    return _columns( fill(_output(N,out),sample,seed,R=R) )
+
+#===============================================================================
+""" lattice placements """
+#-------------------------------------------------------------------------------
+
+class Lattice:
+    """ cubic or hexagonal close-packed lattice filling a cube, centred on
+    the origin, with the spacing that gives number density n - the sites are
+    numbered, so any range of them can be generated on its own
+
+    args
+    ----
+    n:      number density
+    length: length of the cube
+    kind:   ** 'cubic' or 'hcp' - default = 'hcp'
     """
+    def __init__(self,n,length,kind='hcp'):
+        assert kind in ('cubic','hcp'), "kind must be 'cubic' or 'hcp'"
+        self.kind   =   kind
+        if kind == 'cubic':
+            self.a      =   n**(-1/3)
+            self.step   =   np.full(3,self.a)
+            self.shift  =   np.zeros(3)
+        else:
+            # sphere radius r of close packing with density 1 / (4 sqrt(2) r^3)
+            self.a      =   (4*np.sqrt(2) * n)**(-1/3)
+            self.step   =   self.a * np.array([ 2, np.sqrt(3), 2*np.sqrt(6)/3 ])
+            # mean offset of the shifted rows and layers
+            self.shift  =   self.a * np.array([ .5, np.sqrt(3)/6, 0 ])
+        self.shape  =   np.maximum( np.floor(length / self.step).astype(np.int64), 1 )
+        self.N      =   int(np.prod(self.shape))
 
-    # make sure N is divisible by 8
-    N       +=  divmod(N,8)[1]
+    def sites(self,a,n):
+        """ positions of sites a to a+n """
+        i,j,k   =   np.unravel_index(np.arange(a,a+n),self.shape)
+        if self.kind == 'cubic':
+            p   =   np.stack((i,j,k),axis=1) * self.step
+        else:
+            r   =   self.a
+            p   =   np.stack(( (2*i + (j + k) % 2) * r,
+                               np.sqrt(3) * (j + (k % 2)/3) * r,
+                               2*np.sqrt(6)/3 * k * r ),axis=1)
+        return p - .5 * (self.shape - 1) * self.step - self.shift
 
-    # make box of particles
-    x,y,z   =   box_random(N,radius*2)
+def _jittered(L,jitter):
+    """ sampler of lattice sites displaced uniformly by up to jitter spacings """
+    def sample(rng,a,n):
+        p   =   L.sites(a,n)
+        if jitter: p += jitter * L.a * rng.uniform(-1,1,(n,3))
+        return p
+    return sample
 
-    # if particles are outside sphere, relocate them in random positions within sphere
-    for i in range(N):
-        if np.sqrt( x[i]**2 + y[i]**2 + z[i]**2 ) > radius:
-            r       =   radius * np.random.rand(1)[0]
-            t       =   np.pi * np.random.rand(1)[0]
-            p       =   2 * np.pi * np.random.rand(1)[0]
+def box_lattice(N,length,R=O,kind='hcp',jitter=0,seed=None,out=None):
+    """ constructs particles on a lattice in a box - the lattice holds about
+    N sites, use box_lattice_count for the exact number (the length of out)
 
-            x[i]    =   r * np.sin(t) * np.cos(p)
-            y[i]    =   r * np.sin(t) * np.sin(p)
-            z[i]    =   r * np.cos(t)
+    args
+    ----
+    N:      approximate number of particles
+    length: length of box
+    R:      ** COM position vector - default = Origin
+    kind:   ** 'cubic' or 'hcp' - default = 'hcp'
+    jitter: ** random displacement in units of the spacing - default = 0
+    seed:   ** integer seed of the jitter - default = None
+    out:    ** (n,3) array or memory map to write into - default = new array
+    """
+    L       =   Lattice(N/length**3,length,kind)
+    return _columns( fill(_output(L.N,out),_jittered(L,jitter),seed,R=R) )
+
+def box_lattice_count(N,length,kind='hcp'):
+    """ exact number of particles of box_lattice(N,length,kind=kind) """
+    return Lattice(N/length**3,length,kind).N
 
-    return x + R[0], y + R[1], z + R[2]
+def sphere_lattice(N,radius,R=O,kind='hcp',jitter=0,seed=None,out=None):
+    """ constructs particles on a lattice cut to a sphere, with about N
+    particles - use sphere_lattice_count for the exact number (the length of
+    out)
+
+    args
+    ----
+    N:      approximate number of particles
+    radius: cloud radius
+    R:      ** COM position vector - default = Origin
+    kind:   ** 'cubic' or 'hcp' - default = 'hcp'
+    jitter: ** random displacement in units of the spacing - default = 0
+    seed:   ** integer seed of the jitter - default = None
+    out:    ** (n,3) array or memory map to write into - default = new array
+    """
+    L       =   Lattice(N / (4/3*np.pi*radius**3),2*radius,kind)
+    n       =   sphere_lattice_count(N,radius,kind)
+    out     =   _output(n,out)
+    sample  =   _jittered(L,jitter)
 
+    # chunks of the cube lattice, inside sites packed into out
+    rngs    =   streams(seed,-(-L.N // chunk))
+    k       =   0
+    for c,a in enumerate(range(0,L.N,chunk)):
+        inside  =   (L.sites(a,min(chunk,L.N-a))**2).sum(axis=1) <= radius**2
+        p       =   sample(rngs[c],a,len(inside))[inside]
+        out[k:k+len(p)] = p + R
+        k       +=  len(p)
+    return _columns(out)
 
-    return
+def sphere_lattice_count(N,radius,kind='hcp'):
+    """ exact number of particles of sphere_lattice(N,radius,kind=kind) """
+    L       =   Lattice(N / (4/3*np.pi*radius**3),2*radius,kind)
+    return int(sum( ((L.sites(a,min(chunk,L.N-a))**2).sum(axis=1) <= radius**2).sum() for a in range(0,L.N,chunk) ))
@@ -0,0 +1,132 @@
+import numpy as np
+
+#===============================================================================
+""" precision policies
+
+store:  dtype of particle fields (positions, velocities, densities, h, ...)
+        written by placement, Particles and smoothing
+pair:   dtype of per-pair geometry and kernel evaluations (tree.PairTable,
+        the broadcast blocks of incompressible.py)
+accum:  dtype of accelerations, gravity and the sums they are built from
+
+'double' is float64 throughout, 'mixed' stores and evaluates pairs in
+float32 but accumulates forces and gravity in float64, 'single' is float32
+throughout. np.bincount always sums in float64, so the pair-list passes
+accumulate in float64 under every policy; energies (compressible.energy)
+are always summed in float64.
+
+conservation errors, measured with measure() on an adiabatic gas sphere of
+radius 1 (u = 0.05, no gravity, KDK steps of 0.2 * compressible.dt_step),
+with positions compared to the float64 run:
+
+    N = 2000, 100 steps
+    policy   |dE|/E      |sum m v|/sum m|v|   max |r - r_double|   s / step
+    double   4.86e-03    2.3e-17              0                    0.40
+    mixed    4.86e-03    2.4e-09              8.5e-07              0.38
+    single   4.86e-03    3.1e-09              8.5e-07              0.39
+
+    N = 20000, 3 steps
+    double   1.72e-04    1.7e-17              0                    3.43
+    mixed    1.72e-04    4.1e-10              1.1e-07              2.62
+    single   1.72e-04    4.6e-10              1.1e-07              3.14
+
+the energy error comes from the time integration and is the same under
+every policy; float32 adds momentum round-off of order 1e-9 and moves
+positions by ~1e-6 of the radius. the gain in speed is smaller than the
+halved memory traffic suggests, because the neighbour search and the
+float64 bincount scatters are not bandwidth bound """
+#-------------------------------------------------------------------------------
+
+policies    =   { 'double': (np.float64,np.float64,np.float64),
+                  'mixed':  (np.float32,np.float32,np.float64),
+                  'single': (np.float32,np.float32,np.float32) }
+
+name                =   'double'
+store,pair,accum    =   policies[name]
+
+def set_policy(policy='double'):
+    """ selects the precision policy of the SPH modules
+
+    args
+    ----
+    policy: ** 'double', 'mixed' or 'single' - default = 'double'
+
+    returns
+    -------
+    name of the previous policy
+    """
+    global name,store,pair,accum
+    assert policy in policies, "policy must be 'double', 'mixed' or 'single'"
+    old                 =   name
+    name                =   policy
+    store,pair,accum    =   policies[policy]
+    return old
+
+def cast(A,kind='store'):
+    """ array A in the dtype of the current policy, without copying if it
+    already has it
+
+    args
+    ----
+    A:      array
+    kind:   ** 'store', 'pair' or 'accum' - default = 'store'
+    """
+    return np.asarray(A,dtype={ 'store': store, 'pair': pair, 'accum': accum }[kind])
+
+#===============================================================================
+""" conservation measurements """
+#-------------------------------------------------------------------------------
+
+def measure(N=2000,steps=100,seed=0,policies=('double','mixed','single')):
+    """ runs the same adiabatic gas sphere under each policy and compares
+    conservation and positions with the float64 run - the numbers in the
+    header of this module come from measure()
+
+    args
+    ----
+    N:          ** number of particles - default = 2000
+    steps:      ** number of KDK steps - default = 100
+    seed:       ** random seed of the initial conditions - default = 0
+    policies:   ** policies to run, the first is the reference - default = all
+
+    returns
+    -------
+    dictionary of policy: dictionary of energy error, momentum error,
+    largest position difference from the reference and seconds per step
+    """
+    import djak.phys.SPH.compressible as compressible
+    import djak.phys.SPH.smoothing as smoothing
+    import time
+
+    rng     =   np.random.default_rng(seed)
+    r       =   rng.normal(size=(N,3))
+    r       *=  (rng.random(N)**(1/3) / np.linalg.norm(r,axis=1))[:,None]
+    h0      =   smoothing.solve_h(r,np.full(N,1/N),np.full(N,.1))[0]
+
+    old     =   name
+    out     =   {}
+    ref     =   None
+    try:
+        for policy in policies:
+            set_policy(policy)
+            rA,vA   =   np.array(r,dtype=store),np.zeros((N,3),dtype=store)
+            mA,uA   =   np.full(N,1/N,dtype=store),np.full(N,.05,dtype=store)
+            hA      =   np.array(h0,dtype=store)
+            aA,duA,rhoA,PA,cA,table = compressible.derivs(rA,vA,mA,uA,hA,theta=False)
+            dt      =   .2 * compressible.dt_step(rA,vA,hA,rhoA,PA,cA,aA,table=table)
+            E0      =   sum(compressible.energy(vA,mA,uA))
+
+            t       =   time.time()
+            for k in range(steps):
+                compressible.step(rA,vA,uA,mA,hA,aA,duA,dt,theta=False)
+            t       =   (time.time() - t) / steps
+
+            p       =   (mA[:,None] * vA.astype(np.float64)).sum(axis=0)
+            out[policy] = { 'energy': abs(sum(compressible.energy(vA,mA,uA)) / E0 - 1),
+                            'momentum': np.linalg.norm(p) / (mA * np.linalg.norm(vA,axis=1)).sum(dtype=np.float64),
+                            'position': 0. if ref is None else np.abs(rA - ref).max(),
+                            'time': t }
+            if ref is None: ref = rA.astype(np.float64)
+    finally:
+        set_policy(old)
+    return out
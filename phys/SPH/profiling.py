@@ -0,0 +1,206 @@
+import numpy as np
+import json
+import time
+
+#===============================================================================
+""" step-phase profiling
+
+the SPH passes call phase(name), count(name,n) and hist(name,values) at the
+points worth measuring; these do nothing until a Profiler is made active
+with start() (or Simulation(..., profiler=...)), so an uninstrumented run
+pays one global lookup per call. an active Profiler records
+
+    nested wall-clock timers of every phase, as a Chrome trace timeline
+    (chrome://tracing or ui.perfetto.dev) written by Profiler.trace
+    per-step totals of every phase (as time_<phase>) and counter, written
+    by Profiler.csv
+    histograms, e.g. of neighbour counts, from Profiler.histograms """
+#-------------------------------------------------------------------------------
+
+active  =   None
+
+class _Null:
+    """ context manager that does nothing, returned by phase() when profiling is off """
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        return False
+
+_null   =   _Null()
+
+class _Phase:
+    """ timer of one phase of the active profiler """
+    __slots__   =   ('prof','name','t0')
+
+    def __init__(self,prof,name):
+        self.prof   =   prof
+        self.name   =   name
+
+    def __enter__(self):
+        self.prof.depth +=  1
+        self.t0     =   time.perf_counter()
+        return self
+
+    def __exit__(self,*args):
+        t1          =   time.perf_counter()
+        prof        =   self.prof
+        prof.depth  -=  1
+        prof.events.append((self.name,prof.depth,self.t0,t1))
+        prof.totals[self.name] = prof.totals.get(self.name,0.) + (t1 - self.t0)
+        return False
+
+class Profiler:
+    """ recorder of phase timers, counters and histograms across the steps
+    of a run - the step being recorded is closed with end_step
+    """
+    def __init__(self):
+        self.t_start    =   time.perf_counter()
+        self.depth      =   0
+        self.events     =   []
+        self.markers    =   []
+        self.totals     =   {}
+        self.counters   =   {}
+        self.hists      =   {}
+        self.rows       =   []
+
+    def phase(self,name):
+        """ context manager timing a phase, nested phases are timed inside it """
+        return _Phase(self,name)
+
+    def count(self,name,n=1):
+        """ adds n to a counter of the current step """
+        self.counters[name] =   self.counters.get(name,0) + n
+
+    def hist(self,name,values):
+        """ adds integer values to a histogram of the whole run """
+        h               =   np.bincount(np.asarray(values,dtype=np.int64))
+        old             =   self.hists.get(name)
+        if old is not None:
+            if len(old) > len(h):   h,old = old,h
+            h[:len(old)]    +=  old
+        self.hists[name] =   h
+
+    def end_step(self,step=None):
+        """ closes the current step, its totals become one row of the CSV -
+        phase seconds are keyed time_<phase>, apart from the step number and
+        the counters
+
+        args
+        ----
+        step:   ** step number - default = number of rows so far
+        """
+        row             =   { 'step': len(self.rows) if step is None else step }
+        row.update({ 'time_' + name: t for name,t in self.totals.items() })
+        row.update(self.counters)
+        self.rows.append(row)
+        self.markers.append((row['step'],time.perf_counter(),dict(self.counters)))
+        self.totals     =   {}
+        self.counters   =   {}
+
+    def histograms(self):
+        """ dictionary of name: array of counts, entry k is the number of
+        values equal to k over the whole run
+        """
+        return dict(self.hists)
+
+    def summary(self):
+        """ dictionary of time_<phase> or counter: total over all closed steps """
+        out     =   {}
+        for row in self.rows:
+            for k,v in row.items():
+                if k != 'step': out[k] = out.get(k,0) + v
+        return out
+
+    def trace(self,fname):
+        """ writes the phases as a Chrome trace JSON timeline, with the
+        counters of each step as counter tracks
+
+        args
+        ----
+        fname:  file name
+        """
+        us      =   lambda t: (t - self.t_start) * 1e6
+        events  =   [ { 'name': name, 'ph': 'X', 'ts': us(t0), 'dur': (t1 - t0) * 1e6,
+                        'pid': 0, 'tid': 0, 'args': { 'depth': depth } }
+                      for name,depth,t0,t1 in self.events ]
+        for step,t,counters in self.markers:
+            events.append({ 'name': 'end of step', 'ph': 'i', 's': 'g', 'ts': us(t), 'pid': 0, 'tid': 0, 'args': { 'step': step } })
+            for name,n in counters.items():
+                events.append({ 'name': name, 'ph': 'C', 'ts': us(t), 'pid': 0, 'args': { name: n } })
+        with open(fname,'w') as f:
+            json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' },f)
+
+    def csv(self,fname):
+        """ writes one row per closed step of phase seconds and counters
+
+        args
+        ----
+        fname:  file name
+        """
+        cols    =   []
+        for row in self.rows:
+            for k in row:
+                if k not in cols: cols.append(k)
+        with open(fname,'w') as f:
+            f.write(','.join(cols) + '\n')
+            for row in self.rows:
+                f.write(','.join( repr(row.get(k,0)) for k in cols ) + '\n')
+
+#===============================================================================
+""" instrumentation points """
+#-------------------------------------------------------------------------------
+
+def start(profiler=None):
+    """ makes a profiler active
+
+    args
+    ----
+    profiler:   ** Profiler to record into - default = new Profiler
+
+    returns
+    -------
+    the active Profiler
+    """
+    global active
+    active  =   Profiler() if profiler is None else profiler
+    return active
+
+def stop():
+    """ deactivates profiling and returns the profiler that was active """
+    global active
+    prof,active =   active,None
+    return prof
+
+def enabled():
+    """ True if a profiler is active, to skip preparing costly hist values """
+    return active is not None
+
+def phase(name):
+    """ context manager timing a phase of the active profiler
+
+    args
+    ----
+    name:   name of the phase
+    """
+    if active is None: return _null
+    return active.phase(name)
+
+def count(name,n=1):
+    """ adds n to a counter of the active profiler
+
+    args
+    ----
+    name:   name of the counter
+    n:      ** amount - default = 1
+    """
+    if active is not None: active.count(name,n)
+
+def hist(name,values):
+    """ adds integer values to a histogram of the active profiler
+
+    args
+    ----
+    name:   name of the histogram
+    values: array of non-negative integers
+    """
+    if active is not None: active.hist(name,values)
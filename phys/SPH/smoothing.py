@@ -0,0 +1,129 @@
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.tree as tree
+import djak.phys.SPH.precision as precision
+import numpy as np
+
+#===============================================================================
+""" parameters """
+#-------------------------------------------------------------------------------
+
+eta         =   1.2     # h = eta * (m/rho)^(1/3)
+n_target    =   50      # target number of neighbours
+
+#===============================================================================
+""" smoothing length relations """
+#-------------------------------------------------------------------------------
+
+def h_rho(mA,rhoA,eta=eta):
+    """ smoothing length from density, h = eta * (m/rho)^(1/3)
+
+    args
+    ----
+    mA:     array of particle masses
+    rhoA:   array of particle densities
+    eta:    ** proportionality constant - default = eta
+    """
+    return eta * (mA/rhoA)**(1/3)
+
+def h_count(hA,nA,n_target=n_target):
+    """ smoothing length rescaled towards a target number of neighbours,
+    assuming the number of neighbours grows as h^3
+
+    args
+    ----
+    hA:         array of current smoothing lengths
+    nA:         array of current neighbour counts
+    n_target:   ** target number of neighbours - default = n_target
+    """
+    f   =   ( n_target / np.maximum(nA,1) )**(1/3)
+    return hA * np.clip(f,.5,2)
+
+#===============================================================================
+""" solver """
+#-------------------------------------------------------------------------------
+
+def solve_h(rA,mA,hA,method='eta',eta=eta,n_target=n_target,dn=2,tol=1e-3,iters=50,W=kernel.W_M4,dW=kernel.dW_M4,support=None,search='tree',verlet=None):
+    """ iterates smoothing lengths and densities together until every particle
+    satisfies the chosen relation - only particles that have not converged
+    are searched for neighbours and updated again
+
+    method 'eta' solves rho(h) = m * (eta/h)^3 with Newton-Raphson steps,
+    falling back to the fixed point h = eta * (m/rho)^(1/3) when a step
+    would leave [h/2, 2h]; method 'count' rescales h towards n_target
+    neighbours
+
+    args
+    ----
+    rA:         array of particle positions
+    mA:         array of particle masses
+    hA:         array of initial smoothing lengths
+    method:     ** 'eta' or 'count' - default = 'eta'
+    eta:        ** proportionality constant for method 'eta' - default = eta
+    n_target:   ** target number of neighbours for method 'count' - default = n_target
+    dn:         ** allowed deviation from n_target for method 'count' - default = 2
+    tol:        ** relative change in h counted as converged - default = 1e-3
+    iters:      ** maximum number of iterations - default = 50
+    W:          ** smoothing function or kernel object - default = kernel.W_M4
+    dW:         ** derivative of smoothing function, unused for kernel objects - default = kernel.dW_M4
+    support:    ** kernel support radius in units of h - default = kernel.support(W)
+    search:     ** neighbour search method passed to tree.pairs - default = 'tree'
+    verlet:     ** tree.Verlet lists to take the pairs from instead of a search,
+                rebuilt if h grows past their skin - default = None
+
+    returns
+    -------
+    hA:     array of smoothing lengths
+    rhoA:   array of densities at the last update of each particle
+    nA:     array of neighbour counts at the last update of each particle
+    """
+    assert method in ('eta','count'), "method must be 'eta' or 'count'"
+    if support is None: support = kernel.support(W)
+    assert rA.shape[0] == mA.shape[0] == hA.shape[0], "arrays are not matched"
+    N       =   len(mA)
+    hA      =   np.array(hA,dtype=precision.store)
+    rhoA    =   np.zeros(N,dtype=precision.store)
+    nA      =   np.zeros(N,dtype=np.int64)
+
+    active  =   np.arange(N)
+    for it in range(iters):
+        if verlet is None:
+            J,I     =   tree.pairs(rA,hA,idx=active,support=support,method=search)
+        else:
+            if not verlet.valid(rA,hA): verlet.build(rA,hA)
+            J,I     =   verlet.pairs(rA,hA,idx=active)
+        pos     =   np.searchsorted(active,J)
+        Na      =   len(active)
+
+        r_ij1   =   np.linalg.norm( rA[J] - rA[I], axis=1 )
+        h_ij    =   .5 * (hA[I] + hA[J])
+        s_ij    =   r_ij1 / h_ij
+
+        # kernel objects give W and dW from one evaluation
+        if isinstance(W,kernel.Kernel): w,dw = W.W_dW(r_ij1,h_ij)
+        else:                           w,dw = W(r_ij1,h_ij),dW(r_ij1,h_ij)
+
+        nA[active]      =   np.bincount(pos,minlength=Na)
+        rhoA[active]    =   np.bincount(pos,weights=mA[I] * h_ij**(-3) * w,minlength=Na)
+
+        h       =   hA[active]
+        m       =   mA[active]
+        rho     =   rhoA[active]
+        if method == 'eta':
+            # d rho / d h_j, where h_ij depends on h_j with weight 1/2
+            drho    =   np.bincount(pos,weights=-.5 * mA[I] * h_ij**(-4) * (3*w + s_ij*dw),minlength=Na)
+            f       =   rho - m * (eta/h)**3
+            df      =   drho + 3 * m * eta**3 / h**4
+            h_new   =   h - f / df
+            bad     =   ~( (h_new > .5*h) & (h_new < 2*h) )
+            h_new[bad]  =   np.clip( h_rho(m[bad],np.maximum(rho[bad],1e-300),eta=eta), .5*h[bad], 2*h[bad] )
+            conv    =   np.abs(h_new - h) <= tol * h
+        else:
+            h_new   =   h_count(h,nA[active],n_target=n_target)
+            conv    =   ( np.abs(nA[active] - n_target) <= dn ) | ( np.abs(h_new - h) <= tol * h )
+            h_new   =   np.where(conv,h,h_new)
+
+        hA[active]      =   h_new
+        active          =   active[~conv]
+        if len(active) == 0: break
+
+    return hA,rhoA,nA
@@ -0,0 +1,250 @@
+import numpy as np
+import threading
+import struct
+import queue
+import json
+import zlib
+import lzma
+
+#===============================================================================
+""" file layout
+
+magic (8 bytes), version (uint32), header length (uint64), JSON header,
+then one contiguous block per field, every block aligned to `align` bytes.
+the header holds the attributes and, for every field, its dtype, shape,
+compression and the offset and size of its block from the start of the
+data section, so single fields can be read or memory mapped on their own """
+#-------------------------------------------------------------------------------
+
+magic       =   b'DJAKSNAP'
+version     =   1
+align       =   64
+preamble    =   struct.Struct('<8sIQ')
+
+compressors =   { None:   (lambda b,level: b,                                   lambda b: b),
+                  'zlib': (lambda b,level: zlib.compress(b,6 if level is None else level),  zlib.decompress),
+                  'lzma': (lambda b,level: lzma.compress(b,preset=6 if level is None else level), lzma.decompress) }
+
+def _pad(n):
+    """ number of bytes to the next multiple of align """
+    return -n % align
+
+#===============================================================================
+""" writing """
+#-------------------------------------------------------------------------------
+
+def write(fname,fields,attrs=None,compress=None,level=None):
+    """ writes a snapshot of particle arrays
+
+    args
+    ----
+    fname:      file name
+    fields:     dictionary of name: array, e.g. {'r':rA, 'rho':rhoA}
+    attrs:      ** dictionary of JSON serialisable attributes, e.g. time - default = {}
+    compress:   ** None, 'zlib' or 'lzma' - default = None (fields can be memory mapped)
+    level:      ** compression level - default = 6
+    """
+    assert compress in compressors, "compress must be None, 'zlib' or 'lzma'"
+    comp,_  =   compressors[compress]
+
+    blocks  =   []
+    header  =   { 'attrs': attrs or {}, 'fields': {} }
+    offset  =   0
+    for name,A in fields.items():
+        A       =   np.ascontiguousarray(A)
+        data    =   comp(A.tobytes(),level) if compress else A
+        nbytes  =   len(data) if compress else A.nbytes
+        header['fields'][name] = { 'dtype': A.dtype.str, 'shape': list(A.shape),
+                                   'compression': compress, 'offset': offset,
+                                   'nbytes': nbytes, 'raw_nbytes': A.nbytes }
+        blocks.append((data,nbytes))
+        offset  +=  nbytes + _pad(nbytes)
+
+    head    =   json.dumps(header).encode('utf-8')
+    head    +=  b' ' * _pad(preamble.size + len(head))
+
+    with open(fname,'wb') as f:
+        f.write(preamble.pack(magic,version,len(head)))
+        f.write(head)
+        for data,nbytes in blocks:
+            if isinstance(data,np.ndarray): data.tofile(f)
+            else:                           f.write(data)
+            f.write(b'\0' * _pad(nbytes))
+
+def particle_fields(p,names=None):
+    """ dictionary of the fields of a particles.Particles container
+
+    args
+    ----
+    p:      Particles
+    names:  ** fields to include - default = all fields
+    """
+    names   =   names or list(p.data)
+    return { name: p.data[name][:p.N] for name in names }
+
+#===============================================================================
+""" background writing """
+#-------------------------------------------------------------------------------
+
+class Writer:
+    """ writes snapshots from a background thread so the simulation can go on
+    with the next step - submitted arrays are copied into one of a fixed
+    number of reused buffers, and submit blocks while all buffers are
+    waiting to be written, which caps the memory held by the writer
+
+    args
+    ----
+    buffers:    ** number of snapshot copies held at once - default = 2
+    compress:   ** None, 'zlib' or 'lzma' - default = None
+    level:      ** compression level - default = 6
+    """
+    def __init__(self,buffers=2,compress=None,level=None):
+        self.compress   =   compress
+        self.level      =   level
+        self.free       =   queue.Queue()
+        self.todo       =   queue.Queue()
+        self.error      =   None
+        self.written    =   0
+        for k in range(buffers): self.free.put({})
+        self.thread     =   threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def _run(self):
+        while True:
+            item    =   self.todo.get()
+            if item is None: break
+            fname,buf,attrs =   item
+            try:
+                if self.error is None:
+                    write(fname,buf,attrs=attrs,compress=self.compress,level=self.level)
+                    self.written    +=  1
+            except Exception as e:
+                self.error  =   e
+            finally:
+                self.free.put(buf)
+                self.todo.task_done()
+
+    def _raise(self):
+        if self.error is not None:
+            error,self.error    =   self.error,None
+            raise IOError("background snapshot write failed") from error
+
+    def submit(self,fname,fields,attrs=None):
+        """ copies the fields and queues them for writing, returns as soon
+        as the copy is made
+
+        args
+        ----
+        fname:  file name
+        fields: dictionary of name: array
+        attrs:  ** dictionary of JSON serialisable attributes - default = {}
+        """
+        self._raise()
+        buf     =   self.free.get()
+        for name,A in fields.items():
+            A       =   np.asarray(A)
+            B       =   buf.get(name)
+            if B is None or B.shape != A.shape or B.dtype != A.dtype:
+                B           =   np.empty_like(A)
+                buf[name]   =   B
+            np.copyto(B,A)
+        for name in set(buf) - set(fields): del buf[name]
+        self.todo.put( (fname,buf,dict(attrs or {})) )
+
+    def flush(self):
+        """ waits until every submitted snapshot is written and raises any
+        error from the writer thread
+        """
+        self.todo.join()
+        self._raise()
+
+    def close(self):
+        """ flushes and stops the writer thread """
+        if self.thread.is_alive():
+            self.todo.join()
+            self.todo.put(None)
+            self.thread.join()
+        self._raise()
+
+#===============================================================================
+""" reading """
+#-------------------------------------------------------------------------------
+
+class Snapshot:
+    """ snapshot opened for reading - only the header is read on opening,
+    fields are read (or memory mapped) when they are accessed
+
+    args
+    ----
+    fname:  file name
+    mmap:   ** memory map uncompressed fields instead of reading them - default = True
+    """
+    def __init__(self,fname,mmap=True):
+        self.fname  =   fname
+        self.mmap   =   mmap
+        with open(fname,'rb') as f:
+            m,v,n   =   preamble.unpack(f.read(preamble.size))
+            assert m == magic, "%s is not a snapshot" % fname
+            assert v <= version, "snapshot version %s is newer than %s" % (v,version)
+            header  =   json.loads(f.read(n).decode('utf-8'))
+        self.start  =   preamble.size + n
+        self.attrs  =   header['attrs']
+        self.fields =   header['fields']
+
+    def __contains__(self,name):
+        return name in self.fields
+
+    def __getitem__(self,name):
+        return self.read(name)
+
+    def keys(self):
+        return self.fields.keys()
+
+    def read(self,name,mmap=None):
+        """ one field of the snapshot
+
+        args
+        ----
+        name:   field name
+        mmap:   ** memory map the field if uncompressed - default = self.mmap
+        """
+        info    =   self.fields[name]
+        dtype   =   np.dtype(info['dtype'])
+        shape   =   tuple(info['shape'])
+        offset  =   self.start + info['offset']
+        mmap    =   self.mmap if mmap is None else mmap
+
+        if info['compression'] is None:
+            if mmap and info['nbytes'] > 0:
+                return np.memmap(self.fname,dtype=dtype,mode='r',offset=offset,shape=shape)
+            with open(self.fname,'rb') as f:
+                f.seek(offset)
+                return np.fromfile(f,dtype=dtype,count=int(np.prod(shape))).reshape(shape)
+
+        with open(self.fname,'rb') as f:
+            f.seek(offset)
+            data    =   compressors[info['compression']][1](f.read(info['nbytes']))
+        return np.frombuffer(data,dtype=dtype).reshape(shape).copy()
+
+def read(fname,fields=None,mmap=True):
+    """ reads fields of a snapshot
+
+    args
+    ----
+    fname:  file name
+    fields: ** list of field names to read - default = all fields
+    mmap:   ** memory map uncompressed fields - default = True
+
+    returns
+    -------
+    dictionary of name: array, attributes
+    """
+    snap    =   Snapshot(fname,mmap=mmap)
+    names   =   fields or list(snap.keys())
+    return { name: snap.read(name) for name in names },snap.attrs
@@ -0,0 +1,27 @@
+import djak.phys.SPH.particles as particles
+import djak.phys.SPH.placement as placement
+import djak.phys.SPH.driver as driver
+import numpy as np
+import pytest
+
+#===============================================================================
+""" tests """
+#-------------------------------------------------------------------------------
+
+def _particles(N=300):
+    rng     =   np.random.default_rng(0)
+    rA      =   np.stack(placement.sphere_uniformish(N,1.,seed=0),axis=1)
+    return particles.Particles.from_arrays(rA=rA,vA=rng.normal(scale=.1,size=(N,3)),mA=np.full(N,1/N),hA=np.full(N,.25))
+
+@pytest.mark.parametrize('theta',[None,.7])
+def test_restart_is_bit_exact(tmp_path,theta):
+    sim     =   driver.Simulation(_particles(),5e-3,theta=theta,ckpt_dir=str(tmp_path),ckpt_every=2)
+    sim.run(4)
+
+    restart =   driver.Simulation.restore(str(tmp_path / 'checkpoint_000000002.ckpt'))
+    assert restart.theta == theta
+    restart.run(2)
+    assert restart.t == sim.t and restart.n_force == sim.n_force
+    for name in ('rA','vA','aA','rhoA'):
+        assert np.array_equal(getattr(restart.p,name),getattr(sim.p,name)), name
+    assert np.array_equal(restart.rungA,sim.rungA)
@@ -0,0 +1,15 @@
+import djak.phys.SPH.eos as eos
+import numpy as np
+
+#===============================================================================
+""" tests """
+#-------------------------------------------------------------------------------
+
+def test_table_matches_function():
+    # P and the sound speed convention sqrt(P/rho) of barotropic are both kept
+    table   =   eos.Table.from_function(eos.barotropic,1e-3,1e9)
+    rhoA    =   np.geomspace(1e-2,1e8,1000)
+    P,c     =   eos.barotropic(rhoA)
+    Pt,ct   =   table(rhoA)
+    assert np.abs(Pt/P - 1).max() < 1e-4
+    assert np.abs(ct/c - 1).max() < 1e-4
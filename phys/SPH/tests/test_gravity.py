@@ -0,0 +1,62 @@
+import djak.phys.SPH.gravity as gravity
+import djak.phys.SPH.incompressible as inc
+import numpy as np
+from math import erfc
+
+#===============================================================================
+""" Ewald reference """
+#-------------------------------------------------------------------------------
+
+def ewald(rA,mA,L=1.,alpha=6.,nr=2,nk=6):
+    """ periodic accelerations of point masses (G = 1) by Ewald summation """
+    d   =   rA[:,None,:] - rA[None,:,:]
+    out =   np.zeros(rA.shape)
+    erfc_   =   np.vectorize(erfc)
+    for n in np.ndindex(2*nr+1,2*nr+1,2*nr+1):
+        x   =   d + L * (np.array(n) - nr)
+        s   =   np.linalg.norm(x,axis=2)
+        self_   =   s == 0
+        s[self_]    =   1
+        f   =   ( erfc_(alpha*s) + 2*alpha*s/np.sqrt(np.pi) * np.exp(-alpha**2 * s**2) ) / s**3
+        f[self_]    =   0
+        out -=  (f[:,:,None] * x * mA[None,:,None]).sum(axis=1)
+    for n in np.ndindex(2*nk+1,2*nk+1,2*nk+1):
+        if all( c == nk for c in n ): continue
+        k   =   2*np.pi/L * (np.array(n) - nk)
+        k2  =   k @ k
+        out -=  4*np.pi/L**3 * (k/k2)[None,:] * ( np.exp(-k2/(4*alpha**2)) * np.sin(d @ k) * mA[None,:] ).sum(axis=1)[:,None]
+    return out
+
+def _errors(a,ref):
+    return np.linalg.norm(a - ref,axis=1) / np.linalg.norm(ref,axis=1)
+
+#===============================================================================
+""" tests """
+#-------------------------------------------------------------------------------
+
+def test_direct_matches_acc_grav_all():
+    rng     =   np.random.default_rng(0)
+    N       =   700
+    rA,mA   =   rng.random((N,3)),rng.random(N)/N
+    hA      =   np.full(N,.05)
+    ref     =   inc.acc_grav_all(rA,mA,hA)
+    a       =   gravity.Direct(tile=128).acc(rA,mA,hA)
+    assert np.abs(a - ref).max() < 1e-12 * np.abs(ref).max()
+
+def test_pm_pair_on_mesh_point():
+    # a particle on a mesh point used to make the spectral gradient ring
+    r       =   np.array([[0,0,0],[.2,0,0]],dtype=float)
+    a       =   gravity.PM(1.,M=64,G=1.).acc(r,np.ones(2))
+    ref     =   ewald(r,np.ones(2))
+    assert _errors(a,ref).max() < 1e-2
+
+def test_pm_against_ewald():
+    rng     =   np.random.default_rng(1)
+    N       =   300
+    rA,mA   =   rng.random((N,3)),rng.random(N)/N
+    ref     =   ewald(rA,mA)
+    pm      =   _errors(gravity.PM(1.,M=64,G=1.).acc(rA,mA),ref)
+    treepm  =   _errors(gravity.PM(1.,M=64,split=1.25,G=1.).acc(rA,mA,np.full(N,1e-4)),ref)
+    assert np.median(pm) < .02
+    assert np.median(treepm) < .01
+    assert np.percentile(treepm,95) < .05
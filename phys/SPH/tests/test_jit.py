@@ -0,0 +1,22 @@
+import djak.phys.SPH.jit as jit
+import pytest
+
+#===============================================================================
+""" tests """
+#-------------------------------------------------------------------------------
+
+@pytest.mark.skipif(not jit.available(), reason="numba is not installed")
+def test_numba_matches_numpy():
+    diff    =   jit.parity()
+    assert diff
+    for name,d in diff.items():
+        assert d < 1e-12, name
+    assert jit.backend == 'numpy'
+
+def test_numpy_fallback():
+    old     =   jit.backend
+    try:
+        assert jit.set_backend('numpy') == 'numpy'
+        assert not jit.enabled()
+    finally:
+        jit.set_backend(old)
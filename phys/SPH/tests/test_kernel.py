@@ -0,0 +1,25 @@
+import djak.phys.SPH.kernel as kernel
+import numpy as np
+import pytest
+
+#===============================================================================
+""" tests """
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('W',[kernel.W_M4,kernel.dW_M4,kernel.W_M4star])
+def test_table_error(W):
+    assert kernel.Table(W,n=1024).error() < 1e-6
+
+@pytest.mark.parametrize('W',[kernel.W_M4,kernel.dW_M4,kernel.W_M4star])
+def test_nearest_is_coarser(W):
+    assert kernel.Table(W,n=1024,method='nearest').error() > kernel.Table(W,n=1024).error()
+
+def test_set_tables_switches_back():
+    q       =   np.linspace(0,2.5,1001)[1:]
+    exact   =   kernel.W_M4(q,1.)
+    try:
+        kernel.set_tables(1024)
+        assert np.abs(kernel.W_M4(q,1.) - exact).max() < 1e-6
+    finally:
+        kernel.set_tables(None)
+    assert np.array_equal(kernel.W_M4(q,1.),exact)
@@ -0,0 +1,25 @@
+import djak.phys.SPH.timestep as timestep
+import djak.phys.SPH.particles as particles
+import djak.phys.SPH.placement as placement
+import djak.phys.SPH.driver as driver
+import numpy as np
+
+#===============================================================================
+""" tests """
+#-------------------------------------------------------------------------------
+
+def test_rungs_of_undefined_steps():
+    k   =   timestep.rungs(np.array([np.nan,np.inf,0.,1e-3,1.]),1.,14)
+    assert np.array_equal(k,[14,0,14,10,0])
+
+def test_isolated_particle():
+    # a particle without neighbours has rho = 0 and an undefined sound speed
+    N       =   200
+    rA      =   np.stack(placement.sphere_uniformish(N,1.,seed=0),axis=1)
+    rA[0]   =   (10,0,0)
+    p       =   particles.Particles.from_arrays(rA=rA,vA=np.zeros((N,3)),mA=np.full(N,1/N),hA=np.full(N,.3))
+    sim     =   driver.Simulation(p,1e-2)
+    assert sim.rungA.min() >= 0 and sim.rungA.max() <= timestep.max_rung
+    sim.run(1)
+    assert sim.steps == 1
+    assert np.all(np.isfinite(p.rA))
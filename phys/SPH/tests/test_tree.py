@@ -0,0 +1,32 @@
+import djak.phys.SPH.incompressible as inc
+import djak.phys.SPH.placement as placement
+import numpy as np
+import pytest
+
+#===============================================================================
+""" tests """
+#-------------------------------------------------------------------------------
+
+N   =   2000
+
+@pytest.fixture(scope='module')
+def sphere():
+    rA  =   np.stack(placement.sphere_uniformish(N,1.,seed=1),axis=1)
+    return rA,np.full(N,1/N),np.full(N,.05)
+
+# theta, quadrupole, bound on the median and the 99th percentile of the relative error
+@pytest.mark.parametrize('theta,quadrupole,median,p99',[
+    (.3,False,2e-3,1e-2),
+    (.5,False,1e-2,5e-2),
+    (.5,True,2e-3,1e-2),
+    (.7,True,1e-2,5e-2),
+    ])
+def test_tree_against_direct(sphere,theta,quadrupole,median,p99):
+    err     =   inc.grav_error(*sphere,theta=theta,quadrupole=quadrupole)
+    assert np.median(err) < median
+    assert np.percentile(err,99) < p99
+
+def test_quadrupole_is_more_accurate(sphere):
+    mono    =   inc.grav_error(*sphere,theta=.5)
+    quad    =   inc.grav_error(*sphere,theta=.5,quadrupole=True)
+    assert np.median(quad) < np.median(mono)
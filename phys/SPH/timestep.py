@@ -0,0 +1,267 @@
+import djak.phys.SPH.incompressible as inc
+import djak.phys.SPH.eos as eos
+import djak.phys.SPH.kernel as kernel
+import djak.phys.SPH.tree as tree
+import djak.phys.SPH.profiling as profiling
+import numpy as np
+
+#===============================================================================
+""" parameters """
+#-------------------------------------------------------------------------------
+
+C_cfl       =   0.3     # Courant factor
+C_acc       =   0.25    # acceleration factor
+max_rung    =   20      # smallest step is dt_max / 2^max_rung
+
+#===============================================================================
+""" per-particle time step limits """
+#-------------------------------------------------------------------------------
+
+def mu_max(rA,vA,hA,J,I,table=None):
+    """ largest viscous mu_ij (as in inc.acc_visc) of approaching pairs for
+    each particle
+
+    args
+    ----
+    rA:     array of particle positions
+    vA:     array of particle velocities
+    hA:     array of particle smoothing lengths
+    J,I:    neighbour pair arrays from tree.pairs
+    table:  ** tree.PairTable of J,I, its separations are reused - default = None
+    """
+    if table is None:
+        r_ij    =   rA[J] - rA[I]
+        h_ij    =   .5 * (hA[I] + hA[J])
+        r2      =   (r_ij**2).sum(axis=1)
+    else:
+        r_ij,h_ij   =   table.r_ij,table.h_ij
+        r2          =   table.r_ij1**2
+    v_ij    =   vA[J] - vA[I]
+    c       =   (v_ij * r_ij).sum(axis=1)
+    mu_ij   =   ( c * h_ij ) / ( r2 + 0.01*h_ij**2 )
+
+    out     =   np.zeros(len(hA))
+    np.maximum.at(out,J,np.where(c < 0,-mu_ij,0))
+    return out
+
+def dt_cfl(hA,cA,C=C_cfl):
+    """ Courant condition dt = C h / c
+
+    args
+    ----
+    hA: array of particle smoothing lengths
+    cA: array of particle sound speeds
+    C:  ** Courant factor - default = C_cfl
+    """
+    return C * hA / cA
+
+def dt_visc(hA,cA,muA,C=C_cfl,alpha=None,beta=None):
+    """ Courant condition including the artificial viscosity signal speed,
+    dt = C h / (c + 1.2 (alpha c + beta mu))
+
+    args
+    ----
+    hA:     array of particle smoothing lengths
+    cA:     array of particle sound speeds
+    muA:    array of largest viscous mu of each particle (mu_max)
+    C:      ** Courant factor - default = C_cfl
+    alpha:  ** linear viscosity parameter - default = inc.alpha
+    beta:   ** quadratic viscosity parameter - default = inc.beta
+    """
+    if alpha is None: alpha = inc.alpha
+    if beta is None: beta = inc.beta
+    return C * hA / ( cA + 1.2 * (alpha*cA + beta*muA) )
+
+def dt_acc(hA,aA,C=C_acc):
+    """ acceleration condition dt = C sqrt(h / |a|)
+
+    args
+    ----
+    hA: array of particle smoothing lengths
+    aA: array of particle accelerations
+    C:  ** acceleration factor - default = C_acc
+    """
+    a1  =   np.linalg.norm(aA,axis=1)
+    return C * np.sqrt( hA / np.maximum(a1,1e-300) )
+
+def dt_particle(rA,vA,hA,rhoA,PA,aA,J,I,cA=None,table=None):
+    """ smallest of the Courant, viscosity and acceleration limits of every
+    particle - limits that are not defined (NaN, e.g. the sound speed of a
+    particle without neighbours, whose density is 0) are ignored
+
+    args
+    ----
+    rA:     array of particle positions
+    vA:     array of particle velocities
+    hA:     array of particle smoothing lengths
+    rhoA:   array of particle densities
+    PA:     array of particle pressures
+    aA:     array of particle accelerations
+    J,I:    neighbour pair arrays from tree.pairs
+    cA:     ** array of sound speeds from eos.stage - default = inc.c_gas
+    table:  ** tree.PairTable of J,I - default = None
+    """
+    if cA is None: cA = inc.c_gas(slice(None),rhoA,PA)
+    muA =   mu_max(rA,vA,hA,J,I,table=table)
+    with np.errstate(invalid='ignore'):
+        return np.fmin.reduce([ dt_cfl(hA,cA), dt_visc(hA,cA,muA), dt_acc(hA,aA) ])
+
+#===============================================================================
+""" power of two rungs """
+#-------------------------------------------------------------------------------
+
+def rungs(dtA,dt_max,max_rung=max_rung):
+    """ bins time steps into rungs, particles on rung k step with dt_max / 2^k -
+    an undefined (NaN) time step gets the deepest rung
+
+    args
+    ----
+    dtA:        array of allowed particle time steps
+    dt_max:     longest time step
+    max_rung:   ** deepest rung - default = max_rung
+    """
+    with np.errstate(divide='ignore',invalid='ignore'):
+        k   =   np.ceil( np.log2( dt_max / np.asarray(dtA) ) )
+    k   =   np.clip( np.nan_to_num(k,nan=max_rung), 0, max_rung ).astype(np.int64)
+    assert np.all( (k >= 0) & (k <= max_rung) ), "rungs outside [0, max_rung]"
+    return k
+
+def ticks(rungA,max_rung=max_rung):
+    """ length of the step of each rung in units of dt_max / 2^max_rung
+
+    args
+    ----
+    rungA:      array of particle rungs
+    max_rung:   ** deepest rung - default = max_rung
+    """
+    return np.left_shift(1,max_rung - rungA)
+
+#===============================================================================
+""" hierarchical kick-drift-kick """
+#-------------------------------------------------------------------------------
+
+def block_step(rA,vA,aA,rungA,dt_max,accel,dt_fn=None,max_rung=max_rung):
+    """ advances all particles by dt_max with hierarchical block time steps
+
+    every particle is kicked by half its own step, all particles drift to the
+    next time at which some particle finishes its step, and only those
+    particles get new accelerations and their closing half kick. finished
+    particles then move to the rung required by dt_fn, but only to a longer
+    step if the current time is a boundary of that longer step; at the end of
+    the block (dt_max) all particles are re-binned freely
+
+    rA, vA, aA and rungA are updated in place
+
+    args
+    ----
+    rA:         array of particle positions
+    vA:         array of particle velocities
+    aA:         array of particle accelerations at the start of the step
+    rungA:      array of particle rungs
+    dt_max:     longest time step
+    accel:      function accel(idx) returning accelerations of particles idx
+                from the current rA and vA
+    dt_fn:      ** function dt_fn(idx) returning allowed time steps of
+                particles idx - default = None (rungs are kept)
+    max_rung:   ** deepest rung - default = max_rung
+
+    returns
+    -------
+    number of particle force evaluations
+    """
+    assert rA.shape[0] == vA.shape[0] == aA.shape[0] == rungA.shape[0], "arrays are not matched"
+    tick    =   dt_max / 2**max_rung
+    T_end   =   2**max_rung
+
+    begin   =   np.zeros(len(rungA),dtype=np.int64)
+    vA      +=  .5 * aA * (tick * ticks(rungA,max_rung))[:,None]
+
+    t       =   0
+    n_force =   0
+    while t < T_end:
+        end     =   begin + ticks(rungA,max_rung)
+        t_next  =   end.min()
+        rA      +=  vA * (t_next - t) * tick
+        t       =   t_next
+
+        # closing kick of the particles that finished their step
+        idx         =   np.nonzero(end == t)[0]
+        aA[idx]     =   accel(idx)
+        n_force     +=  len(idx)
+        vA[idx]     +=  .5 * aA[idx] * (tick * ticks(rungA[idx],max_rung))[:,None]
+
+        # every rung is synchronised at the end of the block, so any rung is allowed
+        if t == T_end:
+            if dt_fn is not None: rungA[idx] = rungs(dt_fn(idx),dt_max,max_rung)
+            break
+
+        # new rungs, longer steps only where they are synchronised
+        if dt_fn is not None:
+            k           =   rungs(dt_fn(idx),dt_max,max_rung)
+            while True:
+                early   =   (k < rungA[idx]) & (t % ticks(k,max_rung) != 0)
+                if not early.any(): break
+                k[early] +=  1
+            rungA[idx]  =   k
+
+        begin[idx]  =   t
+        vA[idx]     +=  .5 * aA[idx] * (tick * ticks(rungA[idx],max_rung))[:,None]
+
+    return n_force
+
+#===============================================================================
+""" SPH accelerations """
+#-------------------------------------------------------------------------------
+
+def sph_accel(rA,vA,mA,hA,rhoA,PA,K=kernel.M4,cA=None,EOS=eos.barotropic,theta=None,quadrupole=False):
+    """ builds an accel(idx) function for block_step from the incompressible
+    SPH terms - densities, pressures and sound speeds are refreshed only for
+    the active particles and their neighbours, and rhoA, PA, cA are updated
+    in place, with the density and force passes sharing one tree.PairTable
+
+    every particle is searched once per call: the active particles first,
+    then the neighbours they bring in. the table of the last call is kept
+    as accel.table, for the active particles accel.idx, so the time step
+    pass can reuse it
+
+    args
+    ----
+    rA:         array of particle positions
+    vA:         array of particle velocities
+    mA:         array of particle masses
+    hA:         array of particle smoothing lengths
+    rhoA:       array of particle densities
+    PA:         array of particle pressures
+    K:          ** kernel object, also sets the neighbour cutoff - default = kernel.M4
+    cA:         ** array of particle sound speeds - default = new array
+    EOS:        ** barotropic equation of state or eos.Table - default = eos.barotropic
+    theta:      ** opening angle of the tree gravity - default = None (direct summation)
+    quadrupole: ** include quadrupole moments in the tree - default = False
+    """
+    if cA is None: cA = np.zeros_like(PA)
+
+    def accel(idx):
+        with profiling.phase('neighbours'):
+            J,I         =   tree.pairs(rA,hA,idx=idx,support=K.support)
+            need        =   np.union1d(idx,I)
+            rest        =   np.setdiff1d(need,idx,assume_unique=True)
+            if len(rest):
+                J2,I2   =   tree.pairs(rA,hA,idx=rest,support=K.support)
+                s       =   np.argsort(np.concatenate((J,J2)),kind='stable')
+                J,I     =   np.concatenate((J,J2))[s],np.concatenate((I,I2))[s]
+            table       =   tree.PairTable(rA,hA,(J,I),idx=need,W=K)
+            accel.table,accel.idx   =   table,idx
+        profiling.count('pair interactions',len(table))
+        if profiling.enabled(): profiling.hist('neighbours',table.counts()[idx])
+
+        with profiling.phase('density'):
+            rhoA[need]  =   inc.rho_all(rA,mA,hA,idx=need,table=table)
+        with profiling.phase('eos'):
+            PA[need],cA[need]   =   eos.stage(rhoA[need],eos=EOS)
+        with profiling.phase('forces'):
+            a_fluid,a_visc      =   inc.acc_table(table,vA,mA,rhoA,PA,cA,idx=idx)
+        with profiling.phase('gravity'):
+            a_grav      =   inc.acc_grav_all(rA,mA,hA,idx=idx,theta=theta,quadrupole=quadrupole)
+        return a_fluid[idx] + a_visc[idx] + a_grav
+
+    return accel
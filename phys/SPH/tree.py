@@ -0,0 +1,657 @@
+import djak.phys.SPH.precision as precision
+import djak.phys.SPH.profiling as profiling
+import djak.phys.SPH.kernel as kernel
+import numpy as np
+
+#===============================================================================
+""" cell-linked list """
+#-------------------------------------------------------------------------------
+
+# offsets to a cell and its 26 surrounding cells
+offsets =   np.array([ (i,j,k) for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1) ])
+
+def cells(rA,size):
+    """ sorts particles into a uniform grid of cubic cells
+
+    args
+    ----
+    rA:     array of particle positions
+    size:   length of cell edge
+
+    returns
+    -------
+    cA:     array of integer cell coordinates of each particle
+    nc:     number of cells along each axis
+    """
+    cA  =   np.floor( (rA - rA.min(axis=0)) / size ).astype(np.int64)
+    nc  =   cA.max(axis=0) + 1
+    return cA,nc
+
+def cell_key(cA,nc):
+    """ flattens integer cell coordinates into a single key
+
+    args
+    ----
+    cA: array of integer cell coordinates
+    nc: number of cells along each axis
+    """
+    return ( cA[...,0] * nc[1] + cA[...,1] ) * nc[2] + cA[...,2]
+
+def _expand(starts,counts):
+    """ concatenated ranges [starts[k], starts[k] + counts[k]) as one array """
+    total   =   counts.sum()
+    first   =   np.cumsum(counts) - counts
+    return np.repeat(starts - first, counts) + np.arange(total)
+
+#===============================================================================
+""" neighbour search """
+#-------------------------------------------------------------------------------
+
+def pairs(rA,hA,idx=None,support=kernel.M4.support,block=4096,method='cell'):
+    """ finds all interacting pairs with a cell-linked list, where particles
+    i and j interact if |r_ij| < support * h_ij - cells are sized by the
+    largest h, so use method 'tree' when smoothing lengths vary strongly
+
+    args
+    ----
+    rA:         array of particle positions
+    hA:         array of particle smoothing lengths
+    idx:        ** indices of target particles - default = all particles
+    support:    ** kernel support radius in units of h - default = kernel.M4.support
+    block:      ** number of target particles handled at once - default = 4096
+    method:     ** 'cell' for the cell-linked list or 'tree' for the octree - default = 'cell'
+
+    returns
+    -------
+    J:  array of target particle indices, sorted
+    I:  array of neighbour indices, I[k] is a neighbour of J[k] (never J[k] itself)
+    """
+    assert rA.shape[0] == hA.shape[0], "arrays are not matched"
+    assert method in ('cell','tree'), "method must be 'cell' or 'tree'"
+    N       =   len(hA)
+    if idx is None: idx = np.arange(N)
+    idx     =   np.atleast_1d(idx)
+
+    if method == 'tree':
+        return Octree(rA,np.ones(N),hA).pairs(idx=idx,support=support)
+
+    # h_ij <= max(h), so every neighbour lies in one of the surrounding cells
+    size    =   support * hA.max()
+    cA,nc   =   cells(rA,size)
+    key     =   cell_key(cA,nc)
+
+    order   =   np.argsort(key,kind='stable')
+    ukey,start,count = np.unique(key[order],return_index=True,return_counts=True)
+
+    J_out,I_out = [],[]
+    for b in range(0,len(idx),block):
+        T   =   idx[b:b+block]
+        for o in offsets:
+            c       =   cA[T] + o
+            inside  =   np.all( (c >= 0) & (c < nc), axis=1 )
+            t       =   T[inside]
+            k       =   cell_key(c[inside],nc)
+
+            # locate the neighbouring cell among the occupied ones
+            loc     =   np.searchsorted(ukey,k)
+            loc[loc == len(ukey)] = 0
+            found   =   ukey[loc] == k
+            t,loc   =   t[found],loc[found]
+
+            n       =   count[loc]
+            j       =   np.repeat(t,n)
+            i       =   order[_expand(start[loc],n)]
+
+            r_ij1   =   np.linalg.norm( rA[j] - rA[i], axis=1 )
+            h_ij    =   .5 * (hA[i] + hA[j])
+            keep    =   (r_ij1 < support * h_ij) & (i != j)
+
+            J_out.append(j[keep])
+            I_out.append(i[keep])
+
+    J       =   np.concatenate(J_out)
+    I       =   np.concatenate(I_out)
+    s       =   np.lexsort((I,J))
+    return J[s],I[s]
+
+def neighbours(rA,hA,idx=None,support=kernel.M4.support,method='cell'):
+    """ neighbour lists of particles with a cell-linked list
+
+    args
+    ----
+    rA:         array of particle positions
+    hA:         array of particle smoothing lengths
+    idx:        ** indices of target particles - default = all particles
+    support:    ** kernel support radius in units of h - default = kernel.M4.support
+    method:     ** 'cell' for the cell-linked list or 'tree' for the octree - default = 'cell'
+
+    returns
+    -------
+    list with one array of neighbour indices per particle, particles not in
+    idx get an empty array
+    """
+    N       =   len(hA)
+    J,I     =   pairs(rA,hA,idx=idx,support=support,method=method)
+    counts  =   np.bincount(J,minlength=N)
+    return np.split(I,np.cumsum(counts)[:-1])
+
+def neighbour_pairs(nbrs,idx=None):
+    """ flattens neighbour lists back into pair arrays
+
+    args
+    ----
+    nbrs:   list of neighbour index arrays, one per particle
+    idx:    ** indices of target particles - default = all particles
+
+    returns
+    -------
+    J:  array of target particle indices
+    I:  array of neighbour indices
+    """
+    if idx is None: idx = np.arange(len(nbrs))
+    idx     =   np.atleast_1d(idx)
+    lens    =   np.array([ len(nbrs[j]) for j in idx ],dtype=np.int64)
+    if lens.sum() == 0: return np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64)
+    J       =   np.repeat(idx,lens)
+    I       =   np.concatenate([ nbrs[j] for j in idx ]).astype(np.int64)
+    return J,I
+
+#===============================================================================
+""" Verlet lists """
+#-------------------------------------------------------------------------------
+
+class Verlet:
+    """ neighbour lists built out to support * h_ij + skin and reused across
+    steps - a pair that is not in the list can only come within range once
+    two particles have closed the skin between them, so the list stays
+    complete until the largest displacement since the build exceeds half
+    the skin (growth of h is counted against the skin as well), and update
+    rebuilds it then
+
+    lists are stored compressed (CSR): the neighbours of particle j are
+    index[start[j]:start[j+1]]
+
+    args
+    ----
+    rA:         array of particle positions
+    hA:         array of particle smoothing lengths
+    skin:       ** extra search radius - default = 0.1 * support * median h
+    support:    ** kernel support radius in units of h - default = kernel.M4.support
+    method:     ** 'cell' or 'tree', passed to pairs - default = 'tree'
+    """
+    def __init__(self,rA,hA,skin=None,support=kernel.M4.support,method='tree'):
+        self.support    =   support
+        self.method     =   method
+        self.skin       =   .1 * support * np.median(hA) if skin is None else skin
+        self.builds     =   0
+        self.checks     =   0
+        self.efficiency =   1.
+        self.build(rA,hA)
+
+    def build(self,rA,hA):
+        """ rebuilds the lists from the current positions and smoothing lengths
+
+        args
+        ----
+        rA: array of particle positions
+        hA: array of particle smoothing lengths
+        """
+        N           =   len(hA)
+        J,I         =   pairs(rA,hA + self.skin/self.support,support=self.support,method=self.method)
+        self.start  =   np.zeros(N+1,dtype=np.int64)
+        np.cumsum(np.bincount(J,minlength=N),out=self.start[1:])
+        self.index  =   I
+        self.r0     =   np.array(rA,dtype=float)
+        self.h0     =   np.array(hA,dtype=float)
+        self.builds +=  1
+        self.since  =   0
+
+    def valid(self,rA,hA):
+        """ True while the lists still hold every pair within support * h_ij
+
+        args
+        ----
+        rA: array of particle positions
+        hA: array of particle smoothing lengths
+        """
+        if len(hA) != len(self.h0): return False
+        disp    =   np.sqrt( ((rA - self.r0)**2).sum(axis=1).max() ) if len(hA) else 0.
+        grow    =   max( (hA - self.h0).max(), 0 ) if len(hA) else 0.
+        return 2 * disp + self.support * grow <= self.skin
+
+    def update(self,rA,hA):
+        """ rebuilds the lists if they are no longer valid
+
+        args
+        ----
+        rA: array of particle positions
+        hA: array of particle smoothing lengths
+
+        returns
+        -------
+        True if the lists were rebuilt
+        """
+        self.checks +=  1
+        if self.valid(rA,hA):
+            self.since  +=  1
+            return False
+        self.build(rA,hA)
+        return True
+
+    def neighbours(self,j):
+        """ listed neighbours of particle j, including those in the skin """
+        return self.index[self.start[j]:self.start[j+1]]
+
+    def pairs(self,rA=None,hA=None,idx=None):
+        """ pair arrays of the lists, sorted by target as from pairs
+
+        args
+        ----
+        rA:     ** array of particle positions - default = None
+        hA:     ** array of particle smoothing lengths - default = None
+        idx:    ** sorted indices of the target particles - default = all particles
+
+        returns
+        -------
+        J, I - if rA and hA are given, only pairs within support * h_ij,
+        otherwise every listed pair including those in the skin
+        """
+        n       =   np.diff(self.start)
+        if idx is None:
+            J       =   np.repeat(np.arange(len(n)),n)
+            I       =   self.index
+        else:
+            J       =   np.repeat(idx,n[idx])
+            I       =   self.index[_expand(self.start[idx],n[idx])]
+        if rA is None: return J,I
+
+        r_ij1   =   np.linalg.norm( rA[J] - rA[I], axis=1 )
+        keep    =   r_ij1 < self.support * .5 * (hA[I] + hA[J])
+        self.efficiency =   float(keep.mean()) if len(keep) else 1.
+        return J[keep],I[keep]
+
+    def stats(self):
+        """ rebuild statistics for tuning the skin - a large skin gives few
+        builds but a low efficiency (fraction of listed pairs that interact)
+
+        returns
+        -------
+        dictionary of builds, checks, steps per build, steps since the last
+        build, listed pairs and efficiency
+        """
+        return { 'builds': self.builds, 'checks': self.checks,
+                 'steps_per_build': (self.checks + 1) / self.builds,
+                 'since': self.since, 'pairs': len(self.index),
+                 'efficiency': self.efficiency }
+
+#===============================================================================
+""" pair table """
+#-------------------------------------------------------------------------------
+
+# the pairs argument of PairTable shadows the search function
+_search =   pairs
+
+class PairTable:
+    """ per-step table of pair geometry in CSR layout - separations,
+    distances, h_ij and the kernel terms h_ij^-3 W and h_ij^-4 dW are
+    evaluated once for every pair (J,I), and the density, force and time
+    step passes gather from it and scatter back onto particles with bincount
+
+    the pairs of target j are rows start[j]:start[j+1]; when the table was
+    built for all particles (full) every pair is listed in both directions,
+    so symmetric passes can use the half with J < I
+
+    args
+    ----
+    rA:         array of particle positions
+    hA:         array of particle smoothing lengths
+    pairs:      ** (J,I) pair arrays sorted by J, e.g. from Verlet.pairs - default = new search
+    idx:        ** indices of target particles searched - default = all particles
+    W:          ** smoothing function or kernel object, None for force passes only - default = kernel.M4
+    dW:         ** derivative of smoothing function, unused for kernel objects - default = kernel.dW_M4
+    support:    ** kernel support radius in units of h - default = kernel.support(W)
+    method:     ** 'cell' or 'tree', passed to pairs - default = 'tree'
+    """
+    def __init__(self,rA,hA,pairs=None,idx=None,W=kernel.M4,dW=kernel.dW_M4,support=None,method='tree'):
+        if support is None: support = kernel.support(dW if W is None else W)
+        N           =   len(hA)
+        if pairs is None: pairs = _search(rA,hA,idx=idx,support=support,method=method)
+        self.N      =   N
+        self.full   =   idx is None
+        self.J,self.I   =   J,I =   pairs
+
+        self.start  =   np.zeros(N+1,dtype=np.int64)
+        np.cumsum(np.bincount(J,minlength=N),out=self.start[1:])
+
+        self.r_ij   =   precision.cast(rA[J] - rA[I],'pair')
+        self.r_ij1  =   np.sqrt( (self.r_ij**2).sum(axis=1) )
+        self.h_ij   =   precision.cast(.5 * (hA[I] + hA[J]),'pair')
+        if isinstance(W,kernel.Kernel): w,dw = W.W_dW(self.r_ij1,self.h_ij)
+        elif W is None:                 w,dw = None,dW(self.r_ij1,self.h_ij)
+        else:                           w,dw = W(self.r_ij1,self.h_ij),dW(self.r_ij1,self.h_ij)
+        self.W      =   None if w is None else self.h_ij**(-3) * w
+        self.dW     =   self.h_ij**(-4) * dw
+
+    def __len__(self):
+        return len(self.J)
+
+    def rows(self,idx):
+        """ positions in the table of the pairs of targets idx """
+        idx     =   np.atleast_1d(idx)
+        return _expand(self.start[idx],self.start[idx+1] - self.start[idx])
+
+    def half(self):
+        """ positions of the pairs with J < I, each unique pair once """
+        assert self.full, "table was not built for all particles"
+        return np.nonzero(self.J < self.I)[0]
+
+    def sum(self,w,rows=None,J=None):
+        """ sums per-pair values onto their targets
+
+        args
+        ----
+        w:      array of values, one per pair (or per pair in rows)
+        rows:   ** positions of the pairs w belongs to - default = all pairs
+        J:      ** particles to sum onto instead of the targets - default = J
+        """
+        if J is None: J = self.J if rows is None else self.J[rows]
+        return np.bincount(J,weights=w,minlength=self.N)
+
+    def density(self,mA):
+        """ densities of the targets, sum of m_i h_ij^-3 W over their pairs """
+        return self.sum(mA[self.I] * self.W)
+
+    def counts(self):
+        """ number of pairs of every particle """
+        return np.diff(self.start)
+
+#===============================================================================
+""" space-filling curves """
+#-------------------------------------------------------------------------------
+
+def _quantize(rA,bits):
+    """ positions mapped onto a 2^bits integer grid over their bounding cube """
+    lo      =   rA.min(axis=0)
+    size    =   max( (rA.max(axis=0) - lo).max(), 1e-300 )
+    n       =   (1 << bits) - 1
+    return np.clip( (rA - lo) / size * n, 0, n ).astype(np.uint64)
+
+def _spread(x):
+    """ inserts two zero bits between each of the lowest 21 bits of x """
+    x   =   x & np.uint64(0x1fffff)
+    x   =   (x | x << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    x   =   (x | x << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    x   =   (x | x << np.uint64(8))  & np.uint64(0x100f00f00f00f00f)
+    x   =   (x | x << np.uint64(4))  & np.uint64(0x10c30c30c30c30c3)
+    x   =   (x | x << np.uint64(2))  & np.uint64(0x1249249249249249)
+    return x
+
+def morton_key(rA,bits=21):
+    """ Morton (Z-order) keys of particle positions, interleaving the bits
+    of the x, y and z grid coordinates
+
+    args
+    ----
+    rA:     array of particle positions
+    bits:   ** bits per axis, at most 21 - default = 21
+    """
+    assert bits <= 21, "at most 21 bits per axis fit in 64 bit keys"
+    X   =   _quantize(rA,bits)
+    return _spread(X[:,0]) << np.uint64(2) | _spread(X[:,1]) << np.uint64(1) | _spread(X[:,2])
+
+def hilbert_key(rA,bits=21):
+    """ Hilbert keys of particle positions (Skilling's transpose algorithm,
+    run on all particles at once) - unlike Morton order, consecutive keys
+    are always neighbouring grid cells
+
+    args
+    ----
+    rA:     array of particle positions
+    bits:   ** bits per axis, at most 21 - default = 21
+    """
+    assert bits <= 21, "at most 21 bits per axis fit in 64 bit keys"
+    X   =   _quantize(rA,bits)
+    x   =   [ X[:,i].copy() for i in range(3) ]
+
+    # inverse undo
+    Q   =   1 << (bits-1)
+    while Q > 1:
+        P   =   np.uint64(Q - 1)
+        for i in range(3):
+            flip        =   (x[i] & np.uint64(Q)) != 0
+            x[0][flip]  ^=  P
+            t           =   np.where(flip,np.uint64(0),(x[0] ^ x[i]) & P)
+            x[0]        ^=  t
+            x[i]        ^=  t
+        Q   >>= 1
+
+    # Gray encode
+    x[1]    ^=  x[0]
+    x[2]    ^=  x[1]
+    t       =   np.zeros_like(x[0])
+    Q       =   1 << (bits-1)
+    while Q > 1:
+        t[(x[2] & np.uint64(Q)) != 0]  ^=  np.uint64(Q - 1)
+        Q   >>= 1
+    for i in range(3): x[i] ^= t
+
+    key     =   np.zeros_like(x[0])
+    for b in range(bits-1,-1,-1):
+        for i in range(3):
+            key =   key << np.uint64(1) | (x[i] >> np.uint64(b)) & np.uint64(1)
+    return key
+
+def sfc_order(rA,curve='hilbert',bits=21):
+    """ permutation sorting particles along a space-filling curve, so
+    particles close in space are close in memory
+
+    args
+    ----
+    rA:     array of particle positions
+    curve:  ** 'hilbert' or 'morton' - default = 'hilbert'
+    bits:   ** bits per axis - default = 21
+    """
+    assert curve in ('hilbert','morton'), "curve must be 'hilbert' or 'morton'"
+    key     =   hilbert_key(rA,bits) if curve == 'hilbert' else morton_key(rA,bits)
+    return np.argsort(key,kind='stable')
+
+#===============================================================================
+""" Barnes-Hut octree """
+#-------------------------------------------------------------------------------
+
+class Octree:
+    """ octree over particle positions with monopole (and optionally
+    quadrupole) moments of every node
+
+    args
+    ----
+    rA:         array of particle positions
+    mA:         array of particle masses
+    hA:         array of particle smoothing lengths
+    leaf:       ** maximum number of particles in a leaf - default = 16
+    quadrupole: ** compute quadrupole moments - default = False
+    depth:      ** maximum depth, deeper nodes are forced to be leaves - default = 32
+    """
+    def __init__(self,rA,mA,hA,leaf=16,quadrupole=False,depth=32):
+        assert rA.shape[0] == mA.shape[0] == hA.shape[0], "arrays are not matched"
+        self.rA         =   rA
+        self.mA         =   mA
+        self.hA         =   hA
+        self.quadrupole =   quadrupole
+
+        # particles of every node are contiguous in order[start:end]
+        self.order      =   np.arange(len(mA))
+        lo,hi           =   rA.min(axis=0),rA.max(axis=0)
+
+        start,end,center,half,child = [],[],[],[],[]
+        queue           =   [ (0,len(mA),.5*(lo+hi),.5*(hi-lo).max()*(1+1e-10)+1e-300,0,-1,-1) ]
+        while queue:
+            s,e,c,hw,d,parent,octant = queue.pop()
+            n   =   len(start)
+            start.append(s); end.append(e); center.append(c); half.append(hw); child.append([-1]*8)
+            if parent >= 0: child[parent][octant] = n
+
+            if e - s <= leaf or d >= depth: continue
+
+            # sort the node's particles by octant
+            P               =   self.order[s:e]
+            code            =   ( (rA[P] > c) * np.array([4,2,1]) ).sum(axis=1)
+            o               =   np.argsort(code,kind='stable')
+            self.order[s:e] =   P[o]
+            bounds          =   s + np.concatenate(( [0], np.cumsum(np.bincount(code,minlength=8)) ))
+            for k in range(8):
+                if bounds[k+1] > bounds[k]:
+                    sign    =   np.array([ (k>>2)&1, (k>>1)&1, k&1 ]) * 2 - 1
+                    queue.append( (bounds[k],bounds[k+1],c + .5*hw*sign,.5*hw,d+1,n,k) )
+
+        self.start      =   np.array(start)
+        self.end        =   np.array(end)
+        self.center     =   np.array(center)
+        self.half       =   np.array(half)
+        self.child      =   np.array(child)
+        self.leaf       =   np.all(self.child < 0, axis=1)
+
+        # node moments
+        Nn              =   len(start)
+        self.mass       =   np.zeros(Nn)
+        self.com        =   np.zeros((Nn,3))
+        self.hmax       =   np.zeros(Nn)
+        self.quad       =   np.zeros((Nn,3,3))
+        for n in range(Nn):
+            P               =   self.order[start[n]:end[n]]
+            m               =   mA[P]
+            self.mass[n]    =   m.sum()
+            self.com[n]     =   (m[:,None] * rA[P]).sum(axis=0) / self.mass[n]
+            self.hmax[n]    =   hA[P].max()
+            if quadrupole:
+                x               =   rA[P] - self.com[n]
+                self.quad[n]    =   3 * np.einsum('i,ia,ib->ab',m,x,x) - np.eye(3) * (m * (x**2).sum(axis=1)).sum()
+
+    def acc(self,theta=.5,idx=None,W=kernel.W_M4star,support=None,G=1):
+        """ gravitational acceleration by walking the tree for all targets at
+        once - a node is accepted when size/distance < theta, the targets
+        lie outside its box and outside the softening of every particle in it,
+        otherwise it is opened (leaves are summed directly with softening W)
+
+        args
+        ----
+        theta:      ** opening angle - default = 0.5
+        idx:        ** indices of target particles - default = all particles
+        W:          ** softening function - default = kernel.W_M4star
+        support:    ** softening support radius in units of h - default = kernel.support(W)
+        G:          ** gravitational constant - default = 1
+
+        returns
+        -------
+        array of accelerations, one for each index in idx
+        """
+        rA,mA,hA    =   self.rA,self.mA,self.hA
+        if support is None: support = kernel.support(W)
+        if idx is None: idx = np.arange(len(mA))
+        idx         =   np.atleast_1d(idx)
+        pos         =   np.arange(len(idx))
+        out         =   np.zeros((len(idx),3),dtype=precision.accum)
+
+        self.opened =   0
+        stack       =   [ (0,pos) ]
+        while stack:
+            n,T     =   stack.pop()
+            J       =   idx[T]
+            d       =   rA[J] - self.com[n]
+            d1      =   np.linalg.norm(d,axis=1)
+
+            outside =   np.any( np.abs(rA[J] - self.center[n]) > self.half[n], axis=1 )
+            accept  =   outside & ( 2*self.half[n] < theta * d1 ) & ( d1 >= support * .5*(hA[J] + self.hmax[n]) )
+
+            if accept.any():
+                Ta,da,d1a   =   T[accept],d[accept],d1[accept]
+                a           =   - self.mass[n] * da / d1a[:,None]**3
+                if self.quadrupole:
+                    Qd          =   da @ self.quad[n]
+                    dQd         =   (Qd * da).sum(axis=1)
+                    a           +=  Qd / d1a[:,None]**5 - 2.5 * (dQd / d1a**7)[:,None] * da
+                out[Ta]     +=  a
+
+            T       =   T[~accept]
+            if len(T) == 0: continue
+            self.opened +=  1
+
+            if self.leaf[n]:
+                P       =   self.order[self.start[n]:self.end[n]]
+                J       =   idx[T]
+                r_ij    =   rA[J,None,:] - rA[None,P,:]
+                r_ij1   =   np.linalg.norm(r_ij,axis=2)
+                h_ij    =   .5 * (hA[J,None] + hA[None,P])
+                self_   =   J[:,None] == P[None,:]
+                r_ij1[self_] = 1
+                f       =   mA[None,P] * W(r_ij1,h_ij) / r_ij1**3
+                f[self_] = 0
+                out[T]  -=  (f[:,:,None] * r_ij).sum(axis=1)
+            else:
+                for c in self.child[n]:
+                    if c >= 0: stack.append( (c,T) )
+
+        profiling.count('tree nodes opened',self.opened)
+        return G * out
+
+    def pairs(self,idx=None,support=kernel.M4.support):
+        """ finds all interacting pairs by walking the tree, where particles i
+        and j interact if |r_ij| < support * h_ij - a node is skipped when its
+        box is further than support * (h_j + max h of node)/2 from target j,
+        so this stays efficient when smoothing lengths vary strongly
+
+        args
+        ----
+        idx:        ** indices of target particles - default = all particles
+        support:    ** kernel support radius in units of h - default = kernel.M4.support
+
+        returns
+        -------
+        J:  array of target particle indices, sorted
+        I:  array of neighbour indices, I[k] is a neighbour of J[k] (never J[k] itself)
+        """
+        rA,hA       =   self.rA,self.hA
+        if idx is None: idx = np.arange(len(hA))
+        idx         =   np.atleast_1d(idx)
+
+        J_out,I_out =   [np.zeros(0,dtype=np.int64)],[np.zeros(0,dtype=np.int64)]
+        stack       =   [ (0,idx) ]
+        while stack:
+            n,J     =   stack.pop()
+            gap     =   np.maximum( np.abs(rA[J] - self.center[n]) - self.half[n], 0 )
+            J       =   J[ np.linalg.norm(gap,axis=1) < support * .5*(hA[J] + self.hmax[n]) ]
+            if len(J) == 0: continue
+
+            if self.leaf[n]:
+                P       =   self.order[self.start[n]:self.end[n]]
+                r_ij1   =   np.linalg.norm( rA[J,None,:] - rA[None,P,:], axis=2 )
+                h_ij    =   .5 * (hA[J,None] + hA[None,P])
+                keep    =   (r_ij1 < support * h_ij) & (J[:,None] != P[None,:])
+                j,i     =   np.nonzero(keep)
+                J_out.append(J[j])
+                I_out.append(P[i])
+            else:
+                for c in self.child[n]:
+                    if c >= 0: stack.append( (c,J) )
+
+        J           =   np.concatenate(J_out)
+        I           =   np.concatenate(I_out)
+        s           =   np.lexsort((I,J))
+        return J[s],I[s]
+
+def acc_grav_tree(rA,mA,hA,theta=.5,quadrupole=False,idx=None,leaf=16,W=kernel.W_M4star,G=1):
+    """ gravitational acceleration from a Barnes-Hut octree
+
+    args
+    ----
+    rA:         array of particle positions
+    mA:         array of particle masses
+    hA:         array of particle smoothing lengths
+    theta:      ** opening angle - default = 0.5
+    quadrupole: ** include quadrupole moments - default = False
+    idx:        ** indices of target particles - default = all particles
+    leaf:       ** maximum number of particles in a leaf - default = 16
+    W:          ** softening function - default = kernel.W_M4star
+    G:          ** gravitational constant - default = 1
+    """
+    return Octree(rA,mA,hA,leaf=leaf,quadrupole=quadrupole).acc(theta=theta,idx=idx,W=W,G=G)